@@ -49,6 +49,11 @@ Example:
         vk = sk.gen_pub()
         # verify the signature, if invalid an exception will be raised
         vk.verify(b'abc', signature)
+
+The classes are loaded on first access, i.e. ``import hsslms`` does not import
+``multiprocessing`` or ``cryptography``. Applications which only verify
+signatures can use the module :py:mod:`hsslms.verify`, which imports nothing
+but the parsing and verification code.
 """
 
 __all__ = ['INVALID', 'FAILURE', 'LMOTS_ALGORITHM_TYPE', 'LMS_ALGORITHM_TYPE', 'LM_OTS_Pub', 'LM_OTS_Priv', 'LMS_Pub', 'LMS_Priv', 'HSS_Pub', 'HSS_Priv', 'PersHSS_Priv']
@@ -56,8 +61,24 @@ __version__ = '0.1.3'
 
 from .utils import INVALID, FAILURE
 from .utils import LMOTS_ALGORITHM_TYPE, LMS_ALGORITHM_TYPE
-from .lmots import LM_OTS_Priv, LM_OTS_Pub
-from .lms import LMS_Priv, LMS_Pub
-from .hss import HSS_Pub, HSS_Priv
-from .pershss import PersHSS_Priv
-from .lmswrapper import LMS_Wrapper_Priv
+
+_LAZY = {
+    'LM_OTS_Priv': 'lmots', 'LM_OTS_Pub': 'lmots',
+    'LMS_Priv': 'lms', 'LMS_Pub': 'lms',
+    'HSS_Pub': 'hss', 'HSS_Priv': 'hss',
+    'PersHSS_Priv': 'pershss',
+    'LMS_Wrapper_Priv': 'lmswrapper',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        from importlib import import_module
+        value = getattr(import_module('.' + _LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
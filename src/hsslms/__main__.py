@@ -12,24 +12,38 @@ import getpass
 import argparse
 from hsslms.utils import LMOTS_ALGORITHM_TYPE, LMS_ALGORITHM_TYPE, FAILURE, INVALID
 from hsslms import PersHSS_Priv, HSS_Pub
+from hsslms.checkpoint import KeyGenCheckpoint
+from hsslms.advisor import FAMILIES, calibrate, advise
+from hsslms.verifycache import VerificationCache
+
+def print_progress(level, done, total, eta):
+    if eta is None:
+        eta = '-'
+    else:
+        eta = '%d:%02d:%02d' % (eta // 3600, (eta // 60) % 60, eta % 60)
+    print('level %d: %d/%d leafs (%.1f%%), ETA %s' % (level, done, total, 100*done/total, eta), file=sys.stderr, flush=True)
 
 def main():
     parser = argparse.ArgumentParser(description='Hierarchical Signature System of Leighton-Micali Hash-Based Signatures according to RFC 8554')
     subparsers = parser.add_subparsers(title='commands', description='availabel commands', dest='cmd')
     
     parser_keygen = subparsers.add_parser('key-gen', description='generate a key pair')
-    parser_keygen.add_argument('--lmots', choices=('LMOTS_SHA256_N32_W1', 'LMOTS_SHA256_N32_W2', 'LMOTS_SHA256_N32_W4', 'LMOTS_SHA256_N32_W8'), dest='lmots', required=True, help='lmots parameter set')
-    parser_keygen.add_argument('--lms', choices=('LMS_SHA256_M32_H5', 'LMS_SHA256_M32_H10', 'LMS_SHA256_M32_H15', 'LMS_SHA256_M32_H20', 'LMS_SHA256_M32_H25'), dest='lms', nargs='+', required=True, help='lms parameter set')
+    parser_keygen.add_argument('--lmots', choices=[t.name for t in LMOTS_ALGORITHM_TYPE], dest='lmots', nargs='+', required=True, help='lmots parameter set, either one for all levels or one per level')
+    parser_keygen.add_argument('--lms', choices=[t.name for t in LMS_ALGORITHM_TYPE], dest='lms', nargs='+', required=True, help='lms parameter set')
     parser_keygen.add_argument('--out', '-o', help='filename of private key, ".pub" is appended to the filename of the pubklic key', required=True, dest='out')
     parser_keygen.add_argument('--password', '-p', help='password to encrypt the private key', required=False, dest='password')
     parser_keygen.add_argument('--cores', '-c', help='number of cpu cores for computation (default=2)', type=int, default=2, choices=range(1,cpu_count()+1), required=False, dest='num_cores')
+    parser_keygen.add_argument('--checkpoint', help='store finished subtrees in the encrypted file "<out>.ckpt" and resume an interrupted key generation from it', action='store_true', dest='checkpoint')
+    parser_keygen.add_argument('--progress', help='print progress and estimated remaining time of the key generation', action='store_true', dest='progress')
+    parser_keygen.add_argument('--deterministic', help='derive the lower levels from their parent, only their seeds are stored in the private key file', action='store_true', dest='deterministic')
+    parser_keygen.add_argument('--lazy', help='generate only the top level, the lower levels are generated by the first signature', action='store_true', dest='lazy')
     
     parser_keygen = subparsers.add_parser('pubkey-gen', description='generate the public form a private key')
     parser_keygen.add_argument('--in', '-i', help='filename of private key', required=True, dest='infile')
     parser_keygen.add_argument('--password', '-p', help='password to decrypt the private key', required=False, dest='password')
     parser_keygen.add_argument('--out', '-o', help='filename of public key, if not present, the filename of the private key is used where ".pub" is appended', required=False, dest='out')
 
-    parser_sign = subparsers.add_parser('sign')
+    parser_sign = subparsers.add_parser('sign', description='sign a message, several processes can sign with the same private key in parallel')
     parser_sign.add_argument('--key', '-k', help='filename of the private key', required=True, dest='fn_key')
     parser_sign.add_argument('--password', '-p', help='password to decrypt the private key', required=False, dest='password')
     parser_sign.add_argument('-m', '--message', help='filename of a message to sign, -- means stdin', required=True, dest='fn_message')
@@ -39,6 +53,13 @@ def main():
     parser_verfiy.add_argument('--key', '-k', help='filename of the public key', required=True, dest='fn_key')
     parser_verfiy.add_argument('-m', '--message', help='filename of the message, -- means stdin', required=True, dest='fn_message')
     parser_verfiy.add_argument('-s', '--signature', help='filename of the signature', required=True, dest='fn_signature')
+    parser_verfiy.add_argument('--cache', help='skip the verification of a signature which has already been verified, the results are stored in the given file and its secret in <file>.key, whoever can write them can make verify accept forged signatures (default=~/.cache/hsslms/verify.db)', nargs='?', const=str(Path.home() / '.cache' / 'hsslms' / 'verify.db'), required=False, dest='fn_cache')
+    
+    parser_split = subparsers.add_parser('split', description='split a private key into shards owning disjoint ranges of signatures')
+    parser_split.add_argument('--key', '-k', help='filename of the private key, it is exhausted afterwards', required=True, dest='fn_key')
+    parser_split.add_argument('--password', '-p', help='password to decrypt the private key', required=False, dest='password')
+    parser_split.add_argument('--shards', '-n', help='number of shards', type=int, required=True, dest='num_shards')
+    parser_split.add_argument('--out', '-o', help='filenames of the shards, by default ".shard<k>" is appended to the filename of the private key', nargs='+', required=False, dest='out')
     
     parser_skinfo = subparsers.add_parser('sk-info')
     parser_skinfo.add_argument('--key', '-k', help='filename of the private key', required=True, dest='fn_key')
@@ -47,12 +68,29 @@ def main():
     parser_vkinfo = subparsers.add_parser('vk-info')
     parser_vkinfo.add_argument('--key', '-k', help='filename of the public key', required=True, dest='fn_key')
     
+    parser_advise = subparsers.add_parser('advise', description='recommend parameter sets based on a benchmark of this host')
+    parser_advise.add_argument('--signatures', '-n', help='required total number of signatures', type=float, required=True, dest='signatures')
+    parser_advise.add_argument('--rate', '-r', help='required sustained signatures per second (default=1)', type=float, default=1, dest='rate')
+    parser_advise.add_argument('--latency', '-l', help='latency budget of a signature in seconds (default=0.1)', type=float, default=0.1, dest='latency')
+    parser_advise.add_argument('--max-keygen', help='maximal time of the key generation in seconds', type=float, required=False, dest='max_keygen')
+    parser_advise.add_argument('--max-rollover', help='maximal latency of a signature with the worst case rollover in seconds', type=float, required=False, dest='max_rollover')
+    parser_advise.add_argument('--levels', help='maximal number of levels, at most 4 (default=3)', type=int, default=3, choices=range(1,5), dest='levels')
+    parser_advise.add_argument('--family', help='hash functions and output lengths (default=all)', nargs='+', choices=FAMILIES, default=list(FAMILIES), dest='families')
+    parser_advise.add_argument('--cores', '-c', help='number of cpu cores for the key generation (default=all)', type=int, default=cpu_count(), dest='num_cores')
+    parser_advise.add_argument('--top', help='number of recommendations (default=5)', type=int, default=5, dest='top')
+    parser_advise.add_argument('--calibration-time', help='duration of every benchmark in seconds (default=0.2)', type=float, default=0.2, dest='calibration_time')
+    
     args = parser.parse_args()
     
     
     if args.cmd == 'key-gen':
-        lmotstype = LMOTS_ALGORITHM_TYPE[args.lmots]
+        lmotstype = [LMOTS_ALGORITHM_TYPE[t] for t in args.lmots]
         lmstypes = [LMS_ALGORITHM_TYPE[t] for t in args.lms]
+        if len(lmotstype) == 1:
+            lmotstype = lmotstype[0]
+        elif len(lmotstype) != len(lmstypes):
+            print('Either one lmots parameter set or one per level is required. Exit.', file=sys.stderr)
+            sys.exit(1)
         if Path(args.out).exists():
             print('File "%s" already exists. Exit.' % args.out, file=sys.stderr)
             sys.exit(1)
@@ -67,8 +105,12 @@ def main():
                 sys.exit(1)
         else:
             password = args.password
-        sk = PersHSS_Priv(lmstypes, lmotstype, args.out, password.encode(sys.getdefaultencoding()), 1, args.num_cores)
+        checkpoint = None
+        if args.checkpoint:
+            checkpoint = KeyGenCheckpoint(args.out+'.ckpt', password.encode(sys.getdefaultencoding()))
+        progress = print_progress if args.progress else None
         try:
+            sk = PersHSS_Priv(lmstypes, lmotstype, args.out, password.encode(sys.getdefaultencoding()), 1, args.num_cores, progress, checkpoint, args.deterministic, args.lazy)
             sk.save()
         except FAILURE as e:
             print(e, file=sys.stderr)
@@ -123,12 +165,13 @@ def main():
         else:
             password = args.password   
         try:
-            sk = PersHSS_Priv.from_file(args.fn_key, password.encode(sys.getdefaultencoding()))
             if args.fn_message == '--':
                 f_message = sys.stdin
             else:
                 f_message = open(args.fn_message, 'rb')
-            signature = sk.sign(f_message)
+            # the key file is locked only while a signature is reserved
+            with PersHSS_Priv.reserve(args.fn_key, password.encode(sys.getdefaultencoding()), 1) as sk:
+                signature = sk.sign(f_message)
             with open(args.fn_signature, 'wb') as fout:
                 fout.write(signature)          
         except FAILURE as e:
@@ -160,7 +203,13 @@ def main():
                 f_message = sys.stdin
             else:
                 f_message = open(args.fn_message, 'rb')
+            if args.fn_cache is not None:
+                Path(args.fn_cache).parent.mkdir(parents=True, exist_ok=True)
+                vk.set_verification_cache(VerificationCache(args.fn_cache))
             vk.verify(f_message, signature)
+        except FAILURE as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
         except INVALID:
             print("Signature is invalid.", file=sys.stderr)
             sys.exit(1)
@@ -168,6 +217,28 @@ def main():
             print(e, file=sys.stderr)
             sys.exit(1)
         print("Signature is valid.", file=sys.stderr)
+    elif args.cmd == 'split':
+        if not Path(args.fn_key).exists():
+            print('File "%s" does not exist. Exit.' % args.fn_key, file=sys.stderr)
+            sys.exit(1)
+        if args.out is None:
+            args.out = ['%s.shard%d' % (args.fn_key, k) for k in range(args.num_shards)]
+        if len(args.out) != args.num_shards:
+            print('Number of filenames does not match the number of shards. Exit.', file=sys.stderr)
+            sys.exit(1)
+        for fn in args.out:
+            if Path(fn).exists():
+                print('File "%s" already exists. Exit.' % fn, file=sys.stderr)
+                sys.exit(1)
+        if args.password is None:
+            password = getpass.getpass(prompt='Please enter the password: ')
+        else:
+            password = args.password
+        try:
+            PersHSS_Priv.split_file(args.fn_key, password.encode(sys.getdefaultencoding()), args.num_shards, args.out)
+        except FAILURE as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
     elif args.cmd == 'sk-info':
         if not Path(args.fn_key).exists():
             print('File "%s" does not exist. Exit.' % args.fn_key, file=sys.stderr)
@@ -198,6 +269,20 @@ def main():
         except INVALID:
             print("Public Key is invalid.", file=sys.stderr)
             sys.exit(1)
+    elif args.cmd == 'advise':
+        profile = calibrate(args.calibration_time)
+        for name, t in profile.items():
+            print('%s: %.0f chain hashes/s, %.0f tree hashes/s' % (name, 1/t['chain'], 1/t['tree']))
+        results = advise(args.signatures, args.rate, args.latency, profile, args.num_cores, args.max_keygen, args.max_rollover, args.levels, args.families, args.top)
+        if len(results) == 0:
+            print('No parameter set meets the requirements.', file=sys.stderr)
+            sys.exit(1)
+        for e in results:
+            print()
+            print('--lms %s --lmots %s' % (' '.join(e['lms']), e['lmots']))
+            print('  signatures: %d, signature size: %d bytes' % (e['signatures'], e['signature_size']))
+            print('  key generation: %.1f s, signature: %.4f s, worst case rollover: %.1f s, verification: %.4f s' % (e['keygen'], e['sign'], e['rollover'], e['verify']))
+            print('  sustained rate: %.0f signatures/s' % e['rate'])
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
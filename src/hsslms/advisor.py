@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Advisor for the choice of parameter sets
+
+The choice of the LMS heights, the number of HSS levels and the Winternitz
+parameter is a trade-off between key generation time, rollover cost, signing
+latency, verification cost and signature size. The advisor combines an
+analytical model of the number of hash computations with the measured hash
+throughput of the host:
+
+  * key generation of a LMS tree: every leaf computes p seeds, p chains of
+    length 2^w-1, the LM-OTS public key and the leaf, plus 2^h-1 inner nodes
+  * signing: p seeds and on average half of every chain, plus the message hash
+  * verification per level: on average half of every chain, the message hash,
+    the LM-OTS public key, the leaf and h inner nodes
+  * a rollover of level d regenerates the LMS trees of the levels d, ..., L-1,
+    the worst case is a rollover of level 1
+
+The key generation uses all cores, signatures are computed by one core.
+
+Example:
+    Configurations for 2^30 signatures, 100 signatures per second and a
+    signing latency of 10 ms::
+
+        from hsslms.advisor import calibrate, advise
+
+        profile = calibrate()
+        for estimate in advise(2**30, 100, 0.01, profile):
+            print(estimate)
+"""
+import time
+from os import cpu_count, urandom
+from itertools import product
+from .lms import LMS_Priv
+from .utils import LMOTS_ALGORITHM_TYPE, LMS_ALGORITHM_TYPE
+from .utils import D_INTR
+from .utils import u8str, u16str, u32str
+
+
+FAMILIES = ('SHA256_M32', 'SHA256_M24', 'SHAKE_M32', 'SHAKE_M24')
+
+
+def _family(lmstype):
+    return lmstype.name[4:].rsplit('_', 1)[0]
+
+
+def compatible(lmstype, lmotstype):
+    """Returns True if the LMS and LMOTS algorithm types use the same hash function and output length."""
+    return lmstype.m == lmotstype.n and lmstype.H is lmotstype.H
+
+
+def _measure(f, duration):
+    count, start = 0, time.perf_counter()
+    while True:
+        f()
+        count += 256
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return elapsed / count
+
+
+def calibrate(duration=0.1):
+    """Measures the hash throughput of this host.
+
+    The time of a hash computation of a Winternitz chain and of an inner node
+    of a LMS tree is measured for SHA-256 and SHAKE256.
+
+    Args:
+        duration (float, optional): duration of every measurement in seconds
+
+    Returns:
+        dict: Maps the hash function, i.e. 'SHA256' or 'SHAKE', to a dict with
+        the time of one hash computation of a chain ('chain') and of a tree
+        ('tree') in seconds.
+    """
+    profile = {}
+    for name, H in (('SHA256', LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5.H), ('SHAKE', LMS_ALGORITHM_TYPE.LMS_SHAKE_M32_H5.H)):
+        I, q, tmp = urandom(16), u32str(0), urandom(32)
+
+        def chain():
+            nonlocal tmp
+            for j in range(256):
+                tmp = H(I + q + u16str(j) + u8str(j % 255) + tmp).digest()[:32]
+
+        def tree():
+            nonlocal tmp
+            for r in range(256, 512):
+                tmp = H(I + u32str(r) + D_INTR + tmp + tmp).digest()[:32]
+
+        profile[name] = {'chain': _measure(chain, duration), 'tree': _measure(tree, duration)}
+    return profile
+
+
+def _hash_time(profile, lmotstype):
+    return profile['SHAKE' if 'SHAKE' in lmotstype.name else 'SHA256']
+
+
+def leaf_hashes(lmotstype):
+    """Returns the number of hash computations of a leaf of a LMS tree, i.e. the seeds, the chains, the LM-OTS public key and the leaf."""
+    p, w = lmotstype.p, lmotstype.w
+    return p + p*(2**w - 1) + 2
+
+
+def keygen_hashes(lmstype, lmotstype):
+    """Returns the number of hash computations of the key generation of a LMS tree."""
+    return 2**lmstype.h * leaf_hashes(lmotstype) + 2**lmstype.h - 1
+
+
+def sign_hashes(lmotstype):
+    """Returns the expected number of hash computations of a LM-OTS signature."""
+    p, w = lmotstype.p, lmotstype.w
+    return p + p*(2**w - 1) / 2 + 1
+
+
+def verify_hashes(lmstype, lmotstype):
+    """Returns the expected number of hash computations of the verification of a LMS signature."""
+    p, w = lmotstype.p, lmotstype.w
+    return p*(2**w - 1) / 2 + 3 + lmstype.h
+
+
+def estimate(lmstypes, lmotstype, profile, cores=None):
+    """Estimates the performance of a HSS configuration.
+
+    Args:
+        lmstypes (:obj:`list` of :obj:`LMS_ALGORITHM_TYPE`): LMS algorithm types of the levels
+        lmotstype (LMOTS_ALGORITHM_TYPE): LMOTS algorithm type of all levels
+        profile (dict): hash times as returned by `calibrate`
+        cores (int, None, optional): number of CPU cores of the key generation, None=all cores
+
+    Returns:
+        dict: The number of signatures, the signature size in bytes, the times in
+        seconds of the key generation, a signature, the worst case rollover and
+        a verification, and the sustainable signing rate per second.
+    """
+    if cores is None:
+        cores = cpu_count()
+    t = _hash_time(profile, lmotstype)
+    L = len(lmstypes)
+    keygen = [(2**lmstype.h * leaf_hashes(lmotstype) * t['chain'] + (2**lmstype.h - 1) * t['tree']) / cores for lmstype in lmstypes]
+    sign = sign_hashes(lmotstype) * t['chain']
+    signatures, size = 1, 4
+    for i, lmstype in enumerate(lmstypes):
+        signatures *= 2**lmstype.h
+        size += LMS_Priv._signature_length(lmstype, lmotstype)
+        if i > 0:
+            size += 24 + lmstype.m
+    # the tree of level i is regenerated and signed by its parent after the signatures of the levels i, ..., L-1
+    amortized = sign
+    remaining = 1
+    for i in range(L-1, 0, -1):
+        remaining *= 2**lmstypes[i].h
+        amortized += (keygen[i] + sign) / remaining
+    return {
+        'lms': [lmstype.name for lmstype in lmstypes],
+        'lmots': lmotstype.name,
+        'signatures': signatures,
+        'signature_size': size,
+        'keygen': sum(keygen),
+        'sign': sign,
+        'rollover': L*sign + sum(keygen[1:]),
+        'verify': sum((verify_hashes(lmstype, lmotstype) - lmstype.h) * t['chain'] + lmstype.h * t['tree'] for lmstype in lmstypes),
+        'rate': 1 / amortized,
+    }
+
+
+def configurations(max_levels=3, families=FAMILIES):
+    """Yields all configurations, i.e. a list of LMS algorithm types and a LMOTS algorithm type, of up to `max_levels` levels."""
+    for family in families:
+        lmstypes = [t for t in LMS_ALGORITHM_TYPE if _family(t) == family]
+        lmotstypes = [t for t in LMOTS_ALGORITHM_TYPE if compatible(lmstypes[0], t)]
+        for L in range(1, max_levels+1):
+            for levels in product(lmstypes, repeat=L):
+                for lmotstype in lmotstypes:
+                    yield list(levels), lmotstype
+
+
+def advise(signatures, rate, latency, profile, cores=None, max_keygen=None, max_rollover=None, max_levels=3, families=FAMILIES, top=10):
+    """Recommends configurations meeting the requirements.
+
+    Args:
+        signatures (int): required total number of signatures
+        rate (float): required sustained signatures per second
+        latency (float): latency budget of a signature without rollover in seconds
+        profile (dict): hash times as returned by `calibrate`
+        cores (int, None, optional): number of CPU cores, None=all cores
+        max_keygen (float, None, optional): maximal time of the key generation in seconds
+        max_rollover (float, None, optional): maximal latency of a signature with the worst case rollover in seconds
+        max_levels (int, optional): maximal number of HSS levels
+        families (tuple, optional): hash families, e.g. 'SHA256_M32'
+        top (int, optional): maximal number of recommendations
+
+    Returns:
+        :obj:`list` of :obj:`dict`: The estimates of the recommended configurations,
+        see `estimate`, sorted by signature size and the total time of the key
+        generation and the worst case rollover.
+    """
+    results = []
+    for lmstypes, lmotstype in configurations(max_levels, families):
+        e = estimate(lmstypes, lmotstype, profile, cores)
+        if e['signatures'] < signatures or e['rate'] < rate or e['sign'] > latency:
+            continue
+        if max_keygen is not None and e['keygen'] > max_keygen:
+            continue
+        if max_rollover is not None and e['rollover'] > max_rollover:
+            continue
+        results.append(e)
+    results.sort(key=lambda e: (e['signature_size'], e['keygen'] + e['rollover']))
+    return results[:top]
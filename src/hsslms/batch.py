@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Batch signatures
+
+Every HSS signature consumes a leaf of the lowest LMS tree. A batch signature
+signs many messages with a single leaf: a Merkle tree is built over the
+messages, its root is signed with the HSS key, and the signature of every
+message consists of its inclusion proof and the signature of the root.
+
+The Merkle tree uses the hash function of the top level LMS tree and its
+identifier `I`, i.e. a verifier only needs the HSS public key. If the number
+of messages is not a power of 2, the last node of a level without sibling is
+moved up to the next level. The signature of a message is
+
+    u32str(count) || u32str(index) || path[0] || ... || path[k-1] || HSS signature
+
+where `count` is the size of the batch, `index` the position of the message
+in the batch and `path` the siblings of the nodes on the way to the root.
+
+The root is signed as the message D_BATCH_ROOT || u32str(count) || root. The
+ordinary signature functions of ``HSS_Priv`` refuse messages starting with
+D_BATCH_ROOT, so a signature of a message can never be taken for the signature
+of a batch.
+
+Example:
+    Signing 1000 records with one leaf::
+
+        signatures = sk.sign_batch(records)
+        vk = sk.gen_pub()
+        vk.verify_batch(records[17], signatures[17])
+"""
+import io
+from .utils import INVALID, FAILURE
+from .utils import D_BATCH_LEAF, D_BATCH_INTR, D_BATCH_ROOT
+from .utils import u32str, strTou32
+
+
+def _leaf(H, m, I, index, message):
+    return H(I + D_BATCH_LEAF + u32str(index) + message).digest()[:m]
+
+
+def _node(H, m, I, left, right):
+    return H(I + D_BATCH_INTR + left + right).digest()[:m]
+
+
+def _root_message(count, root):
+    """The message which is signed with the HSS key."""
+    return D_BATCH_ROOT + u32str(count) + root
+
+
+def check_message(message):
+    """Refuses messages which could be taken for the root of a batch.
+
+    Args:
+        message (bytes, BufferedReader): message to be signed by `HSS_Priv.sign`
+
+    Raises:
+        FAILURE: If the message starts with D_BATCH_ROOT, or has an invalid type.
+    """
+    if type(message) is bytes:
+        head = message[:len(D_BATCH_ROOT)]
+    elif type(message) is io.BufferedReader:
+        try:
+            if message.seekable():
+                start = message.tell()
+                head = message.read(len(D_BATCH_ROOT))
+                message.seek(start)
+            else:
+                head = message.peek(len(D_BATCH_ROOT))[:len(D_BATCH_ROOT)]
+        except IOError:
+            raise FAILURE("Error. Cannot read message.")
+    else:
+        raise FAILURE("Invalid message type.")
+    if head == D_BATCH_ROOT:
+        raise FAILURE("Messages starting with the batch root separator cannot be signed.")
+
+
+def _path_length(index, count):
+    k = 0
+    while count > 1:
+        if index ^ 1 < count:
+            k += 1
+        index //= 2
+        count = (count + 1) // 2
+    return k
+
+
+def sign_batch(sk, messages):
+    """Signs a batch of messages with a single signature of a HSS key.
+
+    Args:
+        sk (HSS_Priv): the private key, e.g. a ``PersHSS_Priv``
+        messages (:obj:`list` of :obj:`bytes`): the messages
+
+    Raises:
+        FAILURE: If the batch is empty or too large, or the key is exhausted.
+
+    Returns:
+        :obj:`list` of :obj:`bytes`: The signatures in the order of the messages.
+    """
+    count = len(messages)
+    if count < 1 or count >= 2**32:
+        raise FAILURE("The size of a batch must be between 1 and 2^32-1.")
+    top = sk.gen_pub().pub
+    H, m, I = top.H, top.m, top.I
+    levels = [[_leaf(H, m, I, i, message) for i, message in enumerate(messages)]]
+    while len(levels[-1]) > 1:
+        nodes = levels[-1]
+        parents = [_node(H, m, I, nodes[i], nodes[i+1]) for i in range(0, len(nodes) - 1, 2)]
+        if len(nodes) % 2 == 1:
+            parents.append(nodes[-1])
+        levels.append(parents)
+    signature = sk._sign_batch_root(_root_message(count, levels[-1][0]))
+    signatures = []
+    for index in range(count):
+        path = []
+        i = index
+        for nodes in levels[:-1]:
+            if i ^ 1 < len(nodes):
+                path.append(nodes[i ^ 1])
+            i //= 2
+        signatures.append(u32str(count) + u32str(index) + b''.join(path) + signature)
+    return signatures
+
+
+def verify_batch(vk, message, signature):
+    """Verifies the batch signature of a message.
+
+    Args:
+        vk (HSS_Pub): the public key
+        message (bytes): the message
+        signature (bytes): the signature of the message as created by `sign_batch`
+
+    Raises:
+        INVALID: If the signature is invalid.
+    """
+    if len(signature) < 8:
+        raise INVALID
+    count, index = strTou32(signature[:4]), strTou32(signature[4:8])
+    if index >= count:
+        raise INVALID
+    H, m, I = vk.pub.H, vk.pub.m, vk.pub.I
+    k = _path_length(index, count)
+    if len(signature) < 8 + k*m:
+        raise INVALID
+    node = _leaf(H, m, I, index, message)
+    path = signature[8:8+k*m]
+    i, size = index, count
+    while size > 1:
+        if i ^ 1 < size:
+            sibling, path = path[:m], path[m:]
+            node = _node(H, m, I, node, sibling) if i % 2 == 0 else _node(H, m, I, sibling, node)
+        i //= 2
+        size = (size + 1) // 2
+    vk.verify(_root_message(count, node), signature[8+k*m:])
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Bundles of HSS signatures
+
+All signatures which are generated between two rollovers of a HSS key share
+the same prefix, i.e. u32str(L-1) and the signed public keys of the upper
+levels. A bundle stores every distinct prefix once as a segment, and every
+signature as a reference to its segment plus its LMS signature of the lowest
+level and an optional tag, e.g. the name or the hash of the signed message.
+
+The file consists of the header and a sequence of records::
+
+    segment:   u8str(0) || u32str(length) || prefix
+    signature: u8str(1) || u32str(length) || u32str(segment) || u32str(len(tag)) || tag || LMS signature
+
+The reader maps the file into memory. The verifier authenticates every
+segment once and then only the LMS signatures of the lowest level.
+
+Example:
+    Archiving and auditing signatures::
+
+        from hsslms.bundle import BundleWriter, BundleReader
+
+        with BundleWriter('archive.bundle') as writer:
+            for name, signature in signatures:
+                writer.add(signature, name)
+
+        with BundleReader('archive.bundle') as reader:
+            results = reader.verify(vk, lambda name: open(name, 'rb').read())
+"""
+import mmap
+from .lms import LMS_Pub
+from .utils import INVALID, FAILURE
+from .utils import u8str, u32str, strTou32
+from . import __version__
+
+
+FILEHEADER = b'HSSLMS_Bundle_v\x00' + __version__.encode('utf-8')
+RECORD_SEGMENT = 0
+RECORD_SIGNATURE = 1
+
+
+def split_signature(signature):
+    """Splits a HSS signature into its prefix and the LMS signature of the lowest level.
+
+    Raises:
+        INVALID: If the signature is malformed.
+
+    Returns:
+        tuple: The prefix and the LMS signature.
+    """
+    if len(signature) < 4:
+        raise INVALID
+    pos = 4
+    for _ in range(strTou32(signature[:4])):
+        pos += LMS_Pub._len_signature(signature[pos:])
+        pos += LMS_Pub._len_pubkey(signature[pos:])
+    return signature[:pos], signature[pos:]
+
+
+class BundleWriter:
+    """A class used to write a bundle of signatures.
+
+    Args:
+        filename (str): name of the bundle file, an existing file is overwritten
+
+    Raises:
+        FAILURE: If the file cannot be written.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.segments = {}  # prefix -> number of the segment
+        self.count = 0
+        try:
+            self.fout = open(filename, 'wb')
+            self.fout.write(FILEHEADER)
+        except IOError:
+            raise FAILURE("File %s cannot be saved." % filename)
+
+    def _write(self, rtype, payload):
+        try:
+            self.fout.write(u8str(rtype) + u32str(len(payload)) + payload)
+        except IOError:
+            raise FAILURE("File %s cannot be saved." % self.filename)
+
+    def add(self, signature, tag=b''):
+        """Adds a signature.
+
+        Args:
+            signature (bytes): HSS signature
+            tag (bytes, str, optional): tag of the signature, e.g. the name of the message
+
+        Raises:
+            INVALID: If the signature is malformed.
+
+        Returns:
+            int: The number of the signature in the bundle.
+        """
+        if isinstance(tag, str):
+            tag = tag.encode('utf-8')
+        prefix, lms_signature = split_signature(signature)
+        segment = self.segments.get(prefix)
+        if segment is None:
+            segment = self.segments[prefix] = len(self.segments)
+            self._write(RECORD_SEGMENT, prefix)
+        self._write(RECORD_SIGNATURE, u32str(segment) + u32str(len(tag)) + tag + lms_signature)
+        self.count += 1
+        return self.count - 1
+
+    def close(self):
+        self.fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class BundleReader:
+    """A class used to read a bundle of signatures.
+
+    The file is mapped into memory, only the positions of the records are
+    kept.
+
+    Args:
+        filename (str): name of the bundle file
+
+    Raises:
+        FAILURE: If the file cannot be read or is malformed.
+    """
+    def __init__(self, filename):
+        try:
+            with open(filename, 'rb') as fin:
+                self.mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, ValueError):
+            raise FAILURE("File %s cannot be read." % filename)
+        self.segments = []  # (offset, length)
+        self.entries = []  # (segment, offset of the tag, length of the tag, offset of the signature, end)
+        mm = self.mm
+        if mm[:len(FILEHEADER)] != FILEHEADER:
+            self.close()
+            raise FAILURE("Invalid file type.")
+        pos = len(FILEHEADER)
+        while pos < len(mm):
+            if pos + 5 > len(mm) or pos + 5 + strTou32(mm[pos+1:pos+5]) > len(mm):
+                self.close()
+                raise FAILURE("Malformed bundle %s." % filename)
+            rtype, end = mm[pos], pos + 5 + strTou32(mm[pos+1:pos+5])
+            pos += 5
+            if rtype == RECORD_SEGMENT:
+                self.segments.append((pos, end - pos))
+            elif rtype == RECORD_SIGNATURE and end - pos >= 8 and strTou32(mm[pos:pos+4]) < len(self.segments) and strTou32(mm[pos+4:pos+8]) <= end - pos - 8:
+                taglen = strTou32(mm[pos+4:pos+8])
+                self.entries.append((strTou32(mm[pos:pos+4]), pos+8, taglen, pos+8+taglen, end))
+            else:
+                self.close()
+                raise FAILURE("Malformed bundle %s." % filename)
+            pos = end
+
+    def __len__(self):
+        return len(self.entries)
+
+    def segment(self, i):
+        """Returns the prefix of segment `i`."""
+        offset, length = self.segments[i]
+        return self.mm[offset:offset+length]
+
+    def tag(self, i):
+        """Returns the tag of signature `i`."""
+        _, offset, length, _, _ = self.entries[i]
+        return self.mm[offset:offset+length]
+
+    def __getitem__(self, i):
+        """Returns the complete HSS signature `i`."""
+        segment, _, _, start, end = self.entries[i]
+        return self.segment(segment) + self.mm[start:end]
+
+    def verify(self, vk, messages):
+        """Verifies all signatures of the bundle.
+
+        The signed public keys of every segment are verified once.
+
+        Args:
+            vk (HSS_Pub): the public key
+            messages: sequence of the messages in the order of the signatures,
+                or a function which returns the message of a tag
+
+        Returns:
+            :obj:`list` of :obj:`bool`: True for every valid signature.
+        """
+        keys = {}
+        results = []
+        for i, (segment, _, _, start, end) in enumerate(self.entries):
+            if segment not in keys:
+                try:
+                    key, rest = vk._verify_upper(self.segment(segment))
+                    keys[segment] = key if len(rest) == 0 else None
+                except (INVALID, ValueError):
+                    keys[segment] = None
+            message = messages(self.tag(i)) if callable(messages) else messages[i]
+            valid = False
+            if keys[segment] is not None:
+                try:
+                    keys[segment].verify(message, self.mm[start:end])
+                    valid = True
+                except (INVALID, ValueError):
+                    pass
+            results.append(valid)
+        return results
+
+    def close(self):
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
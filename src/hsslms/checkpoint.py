@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints of the key generation
+
+The key generation of large LMS trees, e.g. H20 or H25, takes hours. A
+checkpoint stores the finished subtrees of the key generation in an encrypted
+scratch file, such that an interrupted key generation can be resumed.
+
+The file consists of the header, the salt of the key derivation and a
+sequence of records. Every record is encrypted and authenticated on its own
+with AES-GCM, so the file is only appended to. A record which has been
+partially written, e.g. due to a crash, is discarded when the checkpoint is
+loaded.
+
+Example:
+    Resumable key generation::
+
+        from hsslms import HSS_Priv
+        from hsslms.checkpoint import KeyGenCheckpoint
+
+        checkpoint = KeyGenCheckpoint('key.ckpt', b'password')
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H20], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, checkpoint=checkpoint)
+        # ... save the key, afterwards the checkpoint is removed, otherwise a
+        # key generation with the same checkpoint would yield the same key
+        checkpoint.remove()
+
+    ``PersHSS_Priv`` removes its checkpoint after the key has been saved the
+    first time.
+"""
+import os
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from .pershss import kdf
+from .utils import LMOTS_ALGORITHM_TYPE, LMS_ALGORITHM_TYPE
+from .utils import FAILURE
+from .utils import u32str, strTou32
+from . import __version__
+
+
+class KeyGenCheckpoint:
+    """A class used to hold the checkpoint of a key generation.
+
+    The checkpoint can hold several trees, e.g. all levels of a HSS key. The
+    object itself is the checkpoint of tree 0, the checkpoints of other trees
+    are obtained by `tree`.
+
+    Args:
+        filename (str): name of the checkpoint file
+        password (bytes): password to encrypt the checkpoint file
+    """
+    FILEHEADER = b'HSSLMS_Checkpoint_v\x00' + __version__.encode('utf-8')
+    RECORD_HEADER = 0
+    RECORD_SUBTREE = 1
+
+    def __init__(self, filename, password):
+        self.filename = filename
+        self.password = password
+        self.aesgcm = None
+        self.records = None
+
+    def _read(self):
+        """Reads all complete records of the checkpoint file."""
+        self.records = []
+        try:
+            with open(self.filename, 'rb') as fin:
+                if fin.read(len(KeyGenCheckpoint.FILEHEADER)) != KeyGenCheckpoint.FILEHEADER:
+                    raise FAILURE("Invalid checkpoint file.")
+                salt = fin.read(16)
+                if len(salt) < 16:
+                    raise FAILURE("Invalid checkpoint file.")
+                self.aesgcm = AESGCM(kdf(salt, self.password))
+                valid = fin.tell()
+                while True:
+                    length = fin.read(4)
+                    if len(length) < 4:
+                        break
+                    record = fin.read(strTou32(length))
+                    if len(record) < max(12, strTou32(length)):
+                        break
+                    try:
+                        data = self.aesgcm.decrypt(record[:12], record[12:], KeyGenCheckpoint.FILEHEADER)
+                    except InvalidTag:
+                        if valid == len(KeyGenCheckpoint.FILEHEADER) + 16:
+                            raise FAILURE("Wrong password.")
+                        break
+                    self.records.append(data)
+                    valid = fin.tell()
+        except FileNotFoundError:
+            return
+        except IOError:
+            raise FAILURE("File %s cannot be read." % self.filename)
+        # discard a partially written record
+        if valid < os.path.getsize(self.filename):
+            with open(self.filename, 'r+b') as fout:
+                fout.truncate(valid)
+
+    def _append(self, data):
+        if self.aesgcm is None:
+            salt = os.urandom(16)
+            self.aesgcm = AESGCM(kdf(salt, self.password))
+            with open(self.filename, 'wb') as fout:
+                fout.write(KeyGenCheckpoint.FILEHEADER)
+                fout.write(salt)
+        nonce = os.urandom(12)
+        record = nonce + self.aesgcm.encrypt(nonce, data, KeyGenCheckpoint.FILEHEADER)
+        try:
+            with open(self.filename, 'ab') as fout:
+                fout.write(u32str(len(record)) + record)
+                fout.flush()
+                os.fsync(fout.fileno())
+        except IOError:
+            raise FAILURE("File %s cannot be saved." % self.filename)
+        self.records.append(data)
+
+    def tree(self, index):
+        """Returns the checkpoint of another tree stored in the same file.
+
+        Args:
+            index (int): number of the tree, e.g. the level of a HSS key
+
+        Returns:
+            The checkpoint of the tree.
+        """
+        return _TreeCheckpoint(self, index)
+
+    def load(self, index=0):
+        """Loads the state of the key generation of a tree.
+
+        Args:
+            index (int, optional): number of the tree
+
+        Raises:
+            FAILURE: If the checkpoint cannot be read.
+
+        Returns:
+            tuple, None: None if the tree has not been started, otherwise the
+            tuple (typecode, otstypecode, SEED, I, subtree height, dictionary
+            of the serialized subtrees).
+        """
+        if self.records is None:
+            self._read()
+        state = None
+        for data in self.records:
+            if strTou32(data[:4]) != index:
+                continue
+            if data[4] == KeyGenCheckpoint.RECORD_HEADER:
+                typecode = LMS_ALGORITHM_TYPE(strTou32(data[5:9]))
+                otstypecode = LMOTS_ALGORITHM_TYPE(strTou32(data[9:13]))
+                s = data[13]
+                state = (typecode, otstypecode, data[14:14+typecode.m], data[14+typecode.m:30+typecode.m], s, {})
+            elif data[4] == KeyGenCheckpoint.RECORD_SUBTREE and state is not None:
+                state[5][strTou32(data[5:9])] = data[9:]
+        return state
+
+    def start(self, typecode, otstypecode, SEED, I, s, index=0):
+        """Stores the parameters of the key generation of a tree.
+
+        Args:
+            typecode (LMS_ALGORITHM_TYPE): LMS algorithm type of the tree
+            otstypecode (LMOTS_ALGORITHM_TYPE): LMOTS algorithm type of the tree
+            SEED (bytes): seed of the tree
+            I (bytes): identifier of the tree
+            s (int): height of the subtrees
+            index (int, optional): number of the tree
+        """
+        if self.records is None:
+            self._read()
+        self._append(u32str(index) + bytes([KeyGenCheckpoint.RECORD_HEADER]) + u32str(typecode.value) + u32str(otstypecode.value) + bytes([s]) + SEED + I)
+
+    def add(self, j, block, index=0):
+        """Stores a finished subtree.
+
+        Args:
+            j (int): number of the subtree
+            block (bytes): serialized nodes of the subtree
+            index (int, optional): number of the tree
+        """
+        self._append(u32str(index) + bytes([KeyGenCheckpoint.RECORD_SUBTREE]) + u32str(j) + block)
+
+    def remove(self):
+        """Removes the checkpoint file."""
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+        self.aesgcm = None
+        self.records = []
+
+
+class _TreeCheckpoint:
+    """The checkpoint of one tree of a `KeyGenCheckpoint`."""
+    def __init__(self, checkpoint, index):
+        self.checkpoint = checkpoint
+        self.index = index
+
+    def load(self):
+        return self.checkpoint.load(self.index)
+
+    def start(self, typecode, otstypecode, SEED, I, s):
+        self.checkpoint.start(typecode, otstypecode, SEED, I, s, self.index)
+
+    def add(self, j, block):
+        self.checkpoint.add(j, block, self.index)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Distributed key generation of LMS trees
+
+The key generation of a LMS tree is split into independent subtree jobs.
+A job holds the parameters, the identifier `I` and the encrypted `SEED` of
+the tree, and the number of its subtree. Jobs can be executed by separate
+processes or machines with `run_job`, the results hold the nodes of the
+subtrees. The coordinator checks every result, i.e. the inner nodes are
+recomputed and randomly chosen leafs are recomputed from the `SEED`, and merges
+all results into the final `LMS_Priv`.
+
+Jobs and results are encrypted and authenticated with a key derived from a
+password, which has to be shared with the workers.
+
+Example:
+    Key generation with 8 jobs executed by local processes::
+
+        from hsslms.distkeygen import KeyGenCoordinator, run_local
+
+        coordinator = KeyGenCoordinator(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H20, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, b'password', 8)
+        for result in run_local(coordinator.jobs(), b'password', 8):
+            coordinator.add_result(result)
+        sk = coordinator.finish()
+"""
+import os
+from os import cpu_count
+from multiprocessing import Pool
+from secrets import token_bytes, randbelow
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from .pershss import kdf
+from .lms import LMS_Priv
+from .utils import LMOTS_ALGORITHM_TYPE, LMS_ALGORITHM_TYPE
+from .utils import FAILURE
+from .utils import u32str, strTou32
+from . import __version__
+
+
+JOBHEADER = b'HSSLMS_Job_v\x00' + __version__.encode('utf-8')
+RESULTHEADER = b'HSSLMS_JobResult_v\x00' + __version__.encode('utf-8')
+
+
+def _seal(header, password, data):
+    salt = os.urandom(16)
+    nonce = os.urandom(12)
+    return header + salt + nonce + AESGCM(kdf(salt, password)).encrypt(nonce, data, header)
+
+
+def _open(header, password, blob):
+    if blob[:len(header)] != header or len(blob) < len(header) + 28:
+        raise FAILURE("Invalid file type.")
+    salt = blob[len(header):len(header)+16]
+    nonce = blob[len(header)+16:len(header)+28]
+    try:
+        return AESGCM(kdf(salt, password)).decrypt(nonce, blob[len(header)+28:], header)
+    except InvalidTag:
+        raise FAILURE("Wrong password.")
+
+
+def _parse_job(data):
+    typecode = LMS_ALGORITHM_TYPE(strTou32(data[:4]))
+    otstypecode = LMOTS_ALGORITHM_TYPE(strTou32(data[4:8]))
+    j, s = strTou32(data[8:12]), data[12]
+    return typecode, otstypecode, j, s, data[13:29], data[29:29+typecode.m]
+
+
+def run_job(job, password, num_cores=1):
+    """Executes a subtree job.
+
+    Args:
+        job (bytes): the job as created by `KeyGenCoordinator.jobs`
+        password (bytes): password of the job
+        num_cores (int, None, optional): the number of CPU cores used, None=all cores
+
+    Raises:
+        FAILURE: If the job is invalid.
+
+    Returns:
+        bytes: The result which is passed to `KeyGenCoordinator.add_result`.
+    """
+    typecode, otstypecode, j, s, I, SEED = _parse_job(_open(JOBHEADER, password, job))
+    if num_cores is None:
+        num_cores = cpu_count()
+    if num_cores == 1:
+        block = LMS_Priv._calc_subtree(None, typecode.H, I, typecode.h, otstypecode, SEED, typecode.m, j, s)
+    else:
+        with Pool(num_cores) as p:
+            block = LMS_Priv._calc_subtree(p, typecode.H, I, typecode.h, otstypecode, SEED, typecode.m, j, s)
+    return _seal(RESULTHEADER, password, I + u32str(j) + bytes([s]) + block)
+
+
+def _run_job(job, password):
+    return run_job(job, password, 1)
+
+
+def run_local(jobs, password, processes=None):
+    """Executes subtree jobs in local processes, one CPU core per job.
+
+    Args:
+        jobs (:obj:`list` of :obj:`bytes`): the jobs
+        password (bytes): password of the jobs
+        processes (int, None, optional): number of processes, None=all cores
+
+    Returns:
+        :obj:`list` of :obj:`bytes`: The results in the order of the jobs.
+    """
+    with Pool(processes) as p:
+        return p.starmap(_run_job, ((job, password) for job in jobs))
+
+
+class KeyGenCoordinator:
+    """A class used to coordinate the distributed key generation of a LMS tree.
+
+    Args:
+        typecode (LMS_ALGORITHM_TYPE): Enumeration of Leighton-Micali Signatures (LMS) algorithm types
+        otstypecode (LMOTS_ALGORITHM_TYPE): Enumeration of Leighton-Micali One-Time-Signatures (LMOTS) algorithm types
+        password (bytes): password to encrypt the jobs and results
+        num_jobs (int): number of jobs, a power of 2 and at most the number of leafs
+        verify_leafs (int, optional): number of randomly chosen leafs of every
+            result which are recomputed by the coordinator
+
+    Raises:
+        FAILURE: If the number of jobs is invalid.
+    """
+    def __init__(self, typecode, otstypecode, password, num_jobs, verify_leafs=1):
+        if num_jobs < 1 or num_jobs & (num_jobs-1) != 0 or num_jobs > 2**typecode.h:
+            raise FAILURE("The number of jobs must be a power of 2 and at most %d." % 2**typecode.h)
+        self.typecode = typecode
+        self.otstypecode = otstypecode
+        self.password = password
+        self.s = typecode.h - (num_jobs.bit_length() - 1)
+        self.num_jobs = num_jobs
+        self.verify_leafs = verify_leafs
+        self.SEED = token_bytes(typecode.m)
+        self.I = token_bytes(16)
+        self.blocks = {}
+
+    def jobs(self):
+        """Creates the subtree jobs.
+
+        Returns:
+            :obj:`list` of :obj:`bytes`: The jobs.
+        """
+        return [_seal(JOBHEADER, self.password, u32str(self.typecode.value) + u32str(self.otstypecode.value) + u32str(j) + bytes([self.s]) + self.I + self.SEED) for j in range(self.num_jobs)]
+
+    def add_result(self, result):
+        """Checks and adds the result of a job.
+
+        Args:
+            result (bytes): result of a job
+
+        Raises:
+            FAILURE: If the result does not belong to this key generation or is invalid.
+
+        Returns:
+            int: The number of the subtree.
+        """
+        data = _open(RESULTHEADER, self.password, result)
+        I, j, s, block = data[:16], strTou32(data[16:20]), data[20], data[21:]
+        typecode, otstypecode, m = self.typecode, self.otstypecode, self.typecode.m
+        if I != self.I or s != self.s or j >= self.num_jobs:
+            raise FAILURE("Result does not belong to this key generation.")
+        if not LMS_Priv._verify_subtree(typecode.H, I, typecode.h, m, j, s, block):
+            raise FAILURE("Invalid subtree %d." % j)
+        for _ in range(self.verify_leafs):
+            k = randbelow(2**s)
+            r = 2**typecode.h + j*2**s + k
+            if LMS_Priv._calc_leafs(typecode.H, I, r, typecode.h, otstypecode, self.SEED, m) != block[k*m:(k+1)*m]:
+                raise FAILURE("Invalid leaf in subtree %d." % j)
+        self.blocks[j] = block
+        return j
+
+    def missing(self):
+        """Returns the numbers of the subtrees whose results are missing."""
+        return [j for j in range(self.num_jobs) if j not in self.blocks]
+
+    def finish(self):
+        """Merges the results into the private key.
+
+        Raises:
+            FAILURE: If results are missing.
+
+        Returns:
+            LMS_Priv: The private key.
+        """
+        if len(self.missing()) > 0:
+            raise FAILURE("Results of the subtrees %s are missing." % self.missing())
+        return LMS_Priv._from_subtrees(self.typecode, self.otstypecode, self.SEED, self.I, self.s, self.blocks)
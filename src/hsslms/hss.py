@@ -3,9 +3,16 @@
 
 For reference see RFC 8554, section 6.
 """
+from os import cpu_count
+from time import perf_counter
+from copy import deepcopy
 from .lms import LMS_Priv, LMS_Pub
+from .utils import LMOTS_ALGORITHM_TYPE
 from .utils import INVALID, FAILURE
 from .utils import u32str, strTou32
+from .instrumentation import phase
+from .verifycache import digest_message
+from . import batch
 
 
 class HSS_Pub:
@@ -21,11 +28,53 @@ class HSS_Pub:
     Raises:
         INVALID: If the public is invalid.
     """
+    key_cache = None  # public key -> LMS_Pub of the lower levels, see enable_cache
+    verification_cache = None  # see set_verification_cache
+
     def __init__(self, pubkey):
         if len(pubkey) < 4:
             raise INVALID
         self.L = strTou32(pubkey[:4])
         self.pub = LMS_Pub(pubkey[4:])
+
+    def enable_cache(self, max_nodes=2**16, max_keys=16):
+        """Enables the caches of verified internal nodes, see `LMS_Pub.enable_cache`.
+
+        The lower level LMS public keys of the signatures are kept together
+        with their caches, the least recently used key is dropped.
+
+        Args:
+            max_nodes (int, optional): maximal number of cached nodes per LMS public key
+            max_keys (int, optional): maximal number of cached lower level LMS public keys
+        """
+        self.pub.enable_cache(max_nodes)
+        self.key_cache = {}
+        self.max_cache_keys = max_keys
+        self.max_cache_nodes = max_nodes
+
+    def _lower_key(self, lms_pub):
+        if self.key_cache is None:
+            return LMS_Pub(lms_pub)
+        key = self.key_cache.pop(lms_pub, None)
+        if key is None:
+            key = LMS_Pub(lms_pub)
+            key.enable_cache(self.max_cache_nodes)
+            if self.key_cache and len(self.key_cache) >= self.max_cache_keys:
+                self.key_cache.pop(next(iter(self.key_cache)))
+        self.key_cache[lms_pub] = key
+        return key
+
+    def set_verification_cache(self, cache):
+        """Sets the cache of the results of `verify`.
+
+        A valid signature of a message is verified once, later verifications
+        only compute the hash of the message, see `hsslms.verifycache`.
+
+        Args:
+            cache (VerificationCache, None): the cache, which can be shared by
+                several public keys, None=no cache
+        """
+        self.verification_cache = cache
         
     def verify(self, message, signature):
         """Signature Verification of HSS
@@ -40,6 +89,23 @@ class HSS_Pub:
         Raises:
             INVALID: If signature is invalid.
         """
+        cache = self.verification_cache
+        if cache is not None:
+            digest, message = digest_message(message)
+            entry = cache.key(self.get_pubkey(), digest, signature)
+            if entry in cache:
+                return
+        key, lms_signature = self._verify_upper(signature)
+        key.verify(message, lms_signature)
+        if cache is not None:
+            cache.add(entry)
+
+    def _verify_upper(self, signature):
+        """Verifies the signed public keys of the upper levels of a signature.
+
+        Returns:
+            tuple: The LMS public key of the lowest level and the remaining LMS signature.
+        """
         Nspk = strTou32(signature[:4])
         if Nspk+1 != self.L:
             raise INVALID
@@ -53,8 +119,64 @@ class HSS_Pub:
             lms_pub = signature[:l]
             key.verify(lms_pub, lms_sig)
             signature = signature[l:]
-            key = LMS_Pub(lms_pub)
-        key.verify(message, signature)
+            key = self._lower_key(lms_pub)
+        return key, signature
+
+    def verify_parallel(self, message, signature, pool=None):
+        """Signature Verification of HSS with the levels verified concurrently
+
+        The signature is parsed up front. The LMS signature of every level is
+        verified independently: the upper levels by the worker processes of
+        `pool`, the lowest level, which signs `message`, in this process.
+        This reduces the latency of a single verification for L > 1. The
+        start of a pool costs more than a verification, so the pool has to be
+        reused for many verifications.
+
+        Args:
+            message (bytes, BufferedReader): Message to be verified with `signature`
+            signature (bytes): Signature belonging to the `message`
+            pool (multiprocessing.pool.Pool, None, optional): pool of worker
+                processes, None=the levels are verified serially by `verify`
+
+        Raises:
+            INVALID: If signature is invalid.
+        """
+        if pool is None:
+            return self.verify(message, signature)
+        Nspk = strTou32(signature[:4])
+        if Nspk+1 != self.L:
+            raise INVALID
+        signature = signature[4:]
+        levels = []
+        key = self.pub.get_pubkey()
+        for i in range(Nspk):
+            l = LMS_Pub._len_signature(signature)
+            lms_sig = signature[:l]
+            signature = signature[l:]
+            l = LMS_Pub._len_pubkey(signature)
+            lms_pub = signature[:l]
+            levels.append((key, lms_pub, lms_sig))
+            signature = signature[l:]
+            key = lms_pub
+        if len(levels) == 0:
+            self.pub.verify(message, signature)
+        else:
+            _verify_levels(pool, levels, key, message, signature)
+
+    def verify_batch(self, message, signature):
+        """Verification of a Batch Signature
+
+        Verifies the inclusion proof of the message and the HSS signature of
+        the batch, see `hsslms.batch`.
+
+        Args:
+            message (bytes): Message to be verified with `signature`
+            signature (bytes): Batch signature belonging to the `message`
+
+        Raises:
+            INVALID: If signature is invalid.
+        """
+        batch.verify_batch(self, message, signature)
         
     def get_pubkey(self):
         return u32str(self.L) + self.pub.get_pubkey()
@@ -64,6 +186,31 @@ class HSS_Pub:
         
 
 
+def _verify_level(pubkey, message, signature):
+    try:
+        LMS_Pub(pubkey).verify(message, signature)
+        return True
+    except INVALID:
+        return False
+
+
+def _verify_levels(pool, levels, key, message, signature):
+    upper = pool.starmap_async(_verify_level, levels)
+    # if the lowest level is invalid, the result of the upper levels is not needed
+    LMS_Pub(key).verify(message, signature)
+    if not all(upper.get()):
+        raise INVALID
+
+
+def _level_keygen_args(level, progress, checkpoint):
+    """Progress callback and checkpoint of the LMS tree of a level."""
+    if progress is not None:
+        level_progress = lambda done, total, eta: progress(level, done, total, eta)
+    else:
+        level_progress = None
+    return level_progress, None if checkpoint is None else checkpoint.tree(level)
+
+
 class HSS_Priv:
     """A class used to hold the private key of Hierarchical Signatures (HSS)
     
@@ -73,23 +220,92 @@ class HSS_Priv:
 
     Args:
         lmstypecodes (:obj:`list` of :obj:`LMS_ALGORITHM_TYPE`): List of enumeration of Leighton-Micali Signatures (LMS) algorithm types
-        otstypecode (LMOTS_ALGORITHM_TYPE): Enumeration of Leighton-Micali One-Time-Signatures (LMOTS) algorithm types
+        otstypecode (LMOTS_ALGORITHM_TYPE, :obj:`list` of :obj:`LMOTS_ALGORITHM_TYPE`): Enumeration of
+            Leighton-Micali One-Time-Signatures (LMOTS) algorithm types, either one for all levels or one per level
         num_cores (int, None, optional): the number of CPU cores used for key generation, None=all cores
+        progress (callable, None, optional): called during key generation with the level,
+            the number of computed leafs, the total number of leafs of the level and
+            the estimated remaining time of the level in seconds (None if unknown)
+        checkpoint (:obj:`hsslms.checkpoint.KeyGenCheckpoint`, None, optional): checkpoint
+            to resume an interrupted key generation. It has to be removed after
+            the key has been stored, otherwise a key generation with the same
+            checkpoint yields the same key
+        deterministic (bool, optional): if True, the seed and the identifier of
+            the LMS trees of the lower levels are derived from their parent
+            (see `LMS_Priv.derive_child`), and only the seeds and counters of the
+            lower levels are saved, their trees are recomputed when needed
+        lazy (bool, optional): if True, only the LMS tree of the top level is
+            generated, the lower levels are generated by the first signature or
+            by `materialize`
+    
+    Raises:
+        FAILURE: If the number of LMOTS algorithm types does not match the number of levels.
     """
+    metrics = None
+    otstypecodes = None
+    deterministic = False
+    next_tree = None
+    materializer = None
+    _prefix = None
     
-    def __init__(self, lmstypecodes, otstypecode, num_cores=None):
+    def __init__(self, lmstypecodes, otstypecode, num_cores=None, progress=None, checkpoint=None, deterministic=False, lazy=False):
         self.lmstypecodes = lmstypecodes
-        self.otstypecode = otstypecode
         self.L = len(lmstypecodes)
-        self.priv = [LMS_Priv(self.lmstypecodes[0], self.otstypecode, num_cores)]
-        self.avail_signatures = self.priv[0].get_avail_signatures()
-        self.pub = [self.priv[0].gen_pub()]
-        self.sig = []
-        for i in range(1, self.L):
-            self.priv.append(LMS_Priv(self.lmstypecodes[i], self.otstypecode, num_cores))
-            self.avail_signatures *= self.priv[-1].get_avail_signatures()
-            self.pub.append(self.priv[-1].gen_pub())
-            self.sig.append(self.priv[-2].sign(self.pub[-1].get_pubkey()))
+        if isinstance(otstypecode, LMOTS_ALGORITHM_TYPE):
+            self.otstypecodes = [otstypecode]*self.L
+        else:
+            self.otstypecodes = list(otstypecode)
+            if len(self.otstypecodes) != self.L:
+                raise FAILURE("One LMOTS algorithm type per level is required.")
+        self.deterministic = deterministic
+        self.priv = [None]*self.L
+        self.pub = [None]*self.L
+        self.sig = [None]*(self.L-1)
+        self.avail_signatures = 1
+        for typecode in lmstypecodes:
+            self.avail_signatures *= 2**typecode.h
+        self._materialize(num_cores, progress, checkpoint, 1 if lazy else self.L)
+    
+    def _materialize(self, num_cores=None, progress=None, checkpoint=None, levels=None):
+        """Generates the LMS trees of the first `levels` levels which have not been generated yet.
+        
+        The leafs of all trees are computed concurrently by one pool, afterwards
+        every tree is signed by its parent.
+        """
+        if levels is None:
+            levels = self.L
+        missing = [i for i in range(levels) if self.pub[i] is None]
+        # the parents exist before their children are derived from them
+        for i in missing:
+            if self.priv[i] is None:
+                self.priv[i] = self._keygen_level(i, num_cores, progress, checkpoint, False)
+        LMS_Priv._build_all([self.priv[i] for i in missing], num_cores)
+        for i in missing:
+            self.pub[i] = self.priv[i].gen_pub()
+            if i > 0:
+                self.sig[i-1] = self.priv[i-1].sign(self.pub[i].get_pubkey())
+        self._prefix = None
+    
+    def materialize(self, num_cores=None, background=False):
+        """Generates the lower levels of a lazily generated key.
+        
+        Args:
+            num_cores (int, None, optional): the number of CPU cores used for key generation, None=all cores
+            background (bool, optional): if True, the levels are generated in a
+                background thread, which is joined by the next signature
+        """
+        self._join_materializer()
+        if background:
+            import threading
+            self.materializer = threading.Thread(target=self._materialize, args=(num_cores,), daemon=True)
+            self.materializer.start()
+        else:
+            self._materialize(num_cores)
+    
+    def _join_materializer(self):
+        if self.materializer is not None:
+            self.materializer.join()
+            self.materializer = None
         
     def sign(self, message):
         """Signature Generation of HSS
@@ -100,26 +316,264 @@ class HSS_Priv:
             message (bytes, BufferedReader): Message to be signed
         
         Raises:
-            FAILURE: If a signature has already been computed, or for other
-                technical reason
+            FAILURE: If a signature has already been computed, the message
+                starts with the batch root separator, see `hsslms.batch`, or
+                for other technical reason
         
         Returns:
             bytes: The signature to `message`.
         """
+        batch.check_message(message)
+        signature = bytearray(self.get_signature_length())
+        self._sign_into(message, signature, 0)
+        return bytes(signature)
+
+    def _sign_batch_root(self, message):
+        """Signs the root of a batch, see `hsslms.batch`."""
+        signature = bytearray(self.get_signature_length())
+        self._sign_into(message, signature, 0)
+        return bytes(signature)
+
+    def sign_into(self, message, buffer, offset=0):
+        """Signature Generation of HSS into a buffer
+        
+        Signs a message like `sign`, the signature is written into `buffer`,
+        e.g. a preallocated network buffer.
+        
+        Args:
+            message (bytes, BufferedReader): Message to be signed
+            buffer (bytearray, memoryview): writable buffer of at least
+                `offset` + `get_signature_length()` bytes
+            offset (int, optional): position of the signature in `buffer`
+        
+        Raises:
+            FAILURE: If the buffer is too small, a signature has already been
+                computed, the message starts with the batch root separator, or
+                for other technical reason
+        
+        Returns:
+            int: The length of the signature.
+        """
+        batch.check_message(message)
+        return self._sign_into(message, buffer, offset)
+
+    def _sign_into(self, message, buffer, offset):
+        length = self.get_signature_length()
+        if len(buffer) - offset < length:
+            raise FAILURE("The buffer is too small for the signature.")
+        if self.metrics is not None:
+            start = perf_counter()
+        d = self._rollover()
+        prefix = self._signature_prefix()
+        buffer[offset:offset+len(prefix)] = prefix
+        self.avail_signatures -= 1
+        self.priv[-1].sign_into(message, buffer, offset+len(prefix))
+        if self.metrics is not None:
+            duration = perf_counter() - start
+            self.metrics.set_avail_signatures(self.avail_signatures, self.get_avail_signatures_levels())
+            self.metrics.observe_sign(duration, self.L - d)
+        return length
+
+    def sign_many(self, messages, num_cores=None):
+        """Signature Generation of HSS for several messages
+        
+        The messages are signed by consecutive leafs of the lowest level, the
+        LM-OTS signatures are computed concurrently by a pool of worker
+        processes. Rollovers within the batch are handled like by `sign`.
+        
+        Args:
+            messages (:obj:`list` of :obj:`bytes`): Messages to be signed
+            num_cores (int, None, optional): the number of CPU cores used, None=all cores
+        
+        Raises:
+            FAILURE: If not enough signatures are left, a message starts with
+                the batch root separator, or for other technical reason
+        
+        Returns:
+            :obj:`list` of :obj:`bytes`: The signatures in the order of the messages.
+        """
+        messages = list(messages)
+        for message in messages:
+            batch.check_message(message)
+        if len(messages) > self.get_avail_signatures():
+            raise FAILURE("Not enough signatures left for %d messages." % len(messages))
+        if num_cores is None:
+            num_cores = cpu_count()
+        pool = None
+        if num_cores > 1 and len(messages) > 1:
+            from multiprocessing import Pool  # not needed for verification
+            pool = Pool(num_cores)
+        signatures = []
+        try:
+            while len(signatures) < len(messages):
+                if self.metrics is not None:
+                    start = perf_counter()
+                d = self._rollover()
+                bottom = self.priv[-1]
+                chunk = messages[len(signatures):len(signatures) + bottom.q_end - bottom.q]
+                prefix = self._signature_prefix()
+                self.avail_signatures -= len(chunk)
+                signatures += [prefix + signature for signature in bottom.sign_many(chunk, pool)]
+                if self.metrics is not None:
+                    duration = (perf_counter() - start) / len(chunk)
+                    self.metrics.set_avail_signatures(self.avail_signatures, self.get_avail_signatures_levels())
+                    for k in range(len(chunk)):
+                        self.metrics.observe_sign(duration, self.L - d if k == 0 else 0)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return signatures
+
+    def _signature_prefix(self):
+        """Returns u32str(L-1) || signed_pub_key[0] || ... || signed_pub_key[L-2], which only changes at a rollover."""
+        if self._prefix is None:
+            self._prefix = u32str(self.L-1) + b''.join(self.sig[i] + self.pub[i+1].get_pubkey() for i in range(self.L-1))
+        return self._prefix
+
+    def get_signature_length(self):
+        """Returns the length of a signature in bytes."""
+        length = 4 + LMS_Priv._signature_length(self.lmstypecodes[-1], self._otstypecode(self.L-1))
+        for i in range(self.L-1):
+            length += LMS_Priv._signature_length(self.lmstypecodes[i], self._otstypecode(i)) + 24 + self.lmstypecodes[i+1].m
+        return length
+
+    def sign_batch(self, messages):
+        """Batch Signature Generation
+
+        Signs a batch of messages with a single leaf of the lowest LMS tree,
+        see `hsslms.batch`. The signatures are verified by `HSS_Pub.verify_batch`.
+
+        Args:
+            messages (:obj:`list` of :obj:`bytes`): Messages to be signed
+
+        Raises:
+            FAILURE: If the batch is empty, or a signature cannot be computed.
+
+        Returns:
+            :obj:`list` of :obj:`bytes`: The signatures in the order of the messages.
+        """
+        return batch.sign_batch(self, messages)
+
+    def _rollover(self):
+        """Regenerates the exhausted lower levels.
+        
+        Raises:
+            FAILURE: If all levels are exhausted.
+        
+        Returns:
+            int: The first regenerated level, L if there was no rollover.
+        """
+        self._join_materializer()
+        if self.pub[-1] is None:
+            self._materialize()
         d = self.L
         while self.priv[d-1].get_avail_signatures() == 0:
             d -= 1
             if d == 0:
                 raise FAILURE("Private keys exhausted.")
+        if d < self.L:
+            with phase('rollover'):
+                self._regenerate(d)
+        return d
+
+    def _otstypecode(self, i):
+        """Returns the LMOTS algorithm type of level `i`."""
+        if self.otstypecodes is None:  # keys saved before per-level types
+            return self.otstypecode
+        return self.otstypecodes[i]
+
+    def _keygen_level(self, i, num_cores=None, progress=None, checkpoint=None, build=True):
+        """Generates the LMS tree of level `i`, which is signed by the next leaf of its parent.
+        
+        If `build` is False, the nodes are computed later by `LMS_Priv._build_all`.
+        """
+        SEED = I = None
+        if self.deterministic and i > 0:
+            SEED, I = self.priv[i-1].derive_child(self.priv[i-1].q, self.lmstypecodes[i])
+        if i == self.L-1 and self.next_tree is not None:
+            priv, self.next_tree = self.next_tree, None
+            if I is None or priv.I == I:
+                return priv
+        priv = LMS_Priv(self.lmstypecodes[i], self._otstypecode(i), num_cores, *_level_keygen_args(i, progress, checkpoint), SEED, I, build)
+        priv.compact = self.deterministic and i > 0
+        return priv
+
+    def precompute(self, num_cores=None):
+        """Precomputes the LMS tree of the lowest level used after its next rollover.
+        
+        The rollover of the lowest level then only needs one signature of its
+        parent. Nothing is done if there is only one level or the parent of the
+        lowest level is exhausted.
+        
+        Args:
+            num_cores (int, None, optional): the number of CPU cores used for key generation, None=all cores
+        """
+        self._join_materializer()
+        if self.L < 2 or self.next_tree is not None or self.priv[-2] is None or self.priv[-2].get_avail_signatures() == 0:
+            return
+        SEED = I = None
+        if self.deterministic:
+            SEED, I = self.priv[-2].derive_child(self.priv[-2].q, self.lmstypecodes[-1])
+        next_tree = LMS_Priv(self.lmstypecodes[-1], self._otstypecode(self.L-1), num_cores, SEED=SEED, I=I)
+        next_tree.compact = self.deterministic
+        self.next_tree = next_tree
+
+    def _regenerate(self, d, num_cores=None):
+        """Generates new LMS trees for the levels `d`, ..., L-1, each signed by its parent."""
         for i in range(d, self.L):
-            self.priv[i] = LMS_Priv(self.lmstypecodes[i], self.otstypecode)
-            self.pub[i] = self.priv[i].gen_pub()
-            self.sig[i-1] = self.priv[i-1].sign(self.pub[i].get_pubkey())
-        signature = u32str(self.L-1)
-        for i in range(self.L-1):
-            signature += self.sig[i] + self.pub[i+1].get_pubkey()  # signed_pub_key
-        self.avail_signatures -= 1
-        return signature + self.priv[-1].sign(message)
+            self.priv[i] = self.pub[i] = None
+        self._materialize(num_cores)
+
+    def _count_avail_signatures(self):
+        """Counts the remaining signatures from the states of the LMS trees of all levels."""
+        avail, N = 0, 1
+        for i in range(self.L-1, -1, -1):
+            # a level which has not been generated yet is accounted by the leafs of its parent
+            if self.priv[i] is not None:
+                avail += self.priv[i].get_avail_signatures() * N
+            N *= 2**self.lmstypecodes[i].h
+        return avail
+
+    def split(self, n, num_cores=None):
+        """Splits the key into shards which own disjoint ranges of the top-level leafs.
+        
+        All shards verify under the same public key and can be used
+        independently. The first shard takes over the current lower levels, the
+        other shards generate new lower levels signed by the first leaf of their
+        range. Afterwards this key is exhausted.
+        
+        Args:
+            n (int): number of shards
+            num_cores (int, None, optional): the number of CPU cores used for the generation of the lower levels, None=all cores
+        
+        Raises:
+            FAILURE: If less than `n` top-level leafs are left.
+        
+        Returns:
+            :obj:`list` of :obj:`HSS_Priv`: The shards.
+        """
+        self._join_materializer()
+        top = self.priv[0]
+        leafs = top.q_end - top.q
+        if n < 1 or leafs < n:
+            raise FAILURE("Not enough signatures left to split into %d shards." % n)
+        bounds = [top.q + (k*leafs) // n for k in range(n+1)]
+        shards = []
+        for k in range(n):
+            shard = deepcopy(self)
+            shard.priv[0].q, shard.priv[0].q_end = bounds[k], bounds[k+1]
+            if k > 0 and self.L > 1:
+                shard.next_tree = None
+                shard._regenerate(1, num_cores)
+            shard.avail_signatures = shard._count_avail_signatures()
+            shards.append(shard)
+        # this key must not be used anymore
+        for priv in self.priv:
+            if priv is not None:
+                priv.q = priv.q_end
+        self.avail_signatures = 0
+        return shards
 
     def gen_pub(self):
         """Computes the public key associated with the private key in this class.
@@ -138,11 +592,42 @@ class HSS_Priv:
         Returns:
             int: The remaining number of signatures that can be generated.
         """
+        if self.metrics is not None:
+            self.metrics.set_avail_signatures(self.avail_signatures, self.get_avail_signatures_levels())
         return self.avail_signatures
+
+    def get_avail_signatures_levels(self):
+        """Computes the numbers of availalbe signatures of the LMS tree of each level.
+        
+        Returns:
+            :obj:`list` of :obj:`int`: The remaining number of signatures of each level.
+        """
+        return [2**typecode.h if priv is None else priv.get_avail_signatures() for priv, typecode in zip(self.priv, self.lmstypecodes)]
+
+    def set_metrics(self, metrics):
+        """Attaches metrics which are fed by this key.
+        
+        The metrics are not saved with the key.
+        
+        Args:
+            metrics (:obj:`hsslms.metrics.Metrics`, None): metrics, None detaches the metrics
+        """
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.set_avail_signatures(self.avail_signatures, self.get_avail_signatures_levels())
+
+    def __getstate__(self):
+        self._join_materializer()  # the levels must not be pickled half-built
+        state = self.__dict__.copy()
+        state.pop('metrics', None)
+        state.pop('materializer', None)
+        state.pop('checkpoint', None)
+        state.pop('_prefix', None)
+        return state
     
     def info(self):
         return f"""\
-lmotstype = {self.otstypecode.name}
+lmotstypes = {[self._otstypecode(i).name for i in range(self.L)]}
 lmstypes = {[t.name for t in self.lmstypecodes]}
 available signatures = {self.get_avail_signatures()}
 """
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""Instrumentation of the hot paths
+
+The instrumentation counts the invocations of the hash function, the
+compression function (SHA-256) or permutation (SHAKE256) calls and the hashed
+bytes, and measures the time spent
+in the phases of key generation, signing and persistence:
+
+  * leaf_generation: computation of the leafs of a LMS tree
+  * tree_merge: computation of the inner nodes of a LMS tree
+  * ots_sign: LM-OTS signature generation
+  * auth_path: assembly of the authentication path of a LMS signature
+  * rollover: regeneration of the lower levels of a HSS key
+  * save: saving a ``PersHSS_Priv`` key
+  * kdf: derivation of the key encryption key from the password
+  * unpickle: loading the pickled private key
+
+The instrumentation is disabled by default, then it costs one function call
+per instrumented function.
+
+Example:
+    Counting the hash work of a signature::
+
+        from hsslms import instrumentation
+
+        instrumentation.enable(hook=lambda name, duration: print(name, duration))
+        signature = sk.sign(b'abc')
+        print(instrumentation.get_stats())
+        instrumentation.disable()
+"""
+import time
+
+
+class Stats:
+    """A class used to hold the collected counters and timers.
+
+    Attributes:
+        hash_calls (int): number of computed hash values
+        hash_blocks (int): number of compression function or permutation calls
+        hash_bytes (int): number of hashed bytes
+        phases (dict): maps the name of a phase to the list [count, total time in seconds]
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Sets all counters and timers to zero."""
+        self.hash_calls = 0
+        self.hash_blocks = 0
+        self.hash_bytes = 0
+        self.phases = {}
+
+    def add_phase(self, name, duration):
+        entry = self.phases.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += duration
+
+    def as_dict(self):
+        """Returns the counters and timers as dictionary."""
+        return {
+            'hash_calls': self.hash_calls,
+            'hash_blocks': self.hash_blocks,
+            'hash_bytes': self.hash_bytes,
+            'phases': {name: {'count': count, 'time': total} for name, (count, total) in self.phases.items()},
+        }
+
+    def __repr__(self):
+        lines = [f"hash calls = {self.hash_calls}", f"hash blocks = {self.hash_blocks}", f"hash bytes = {self.hash_bytes}"]
+        for name, (count, total) in self.phases.items():
+            lines.append(f"{name} = {count} x, {total:.6f} s")
+        return '\n'.join(lines)
+
+
+_enabled = False
+_hook = None
+_stats = Stats()
+
+
+def enable(hook=None):
+    """Enables the instrumentation.
+
+    Args:
+        hook (callable, None, optional): function called with the name and the
+            duration in seconds at the end of every phase
+    """
+    global _enabled, _hook
+    _enabled = True
+    _hook = hook
+
+
+def disable():
+    """Disables the instrumentation, the collected statistics are kept."""
+    global _enabled, _hook
+    _enabled = False
+    _hook = None
+
+
+def is_enabled():
+    return _enabled
+
+
+def get_stats():
+    """Returns the statistics collected so far.
+
+    Returns:
+        Stats: The counters and timers.
+    """
+    return _stats
+
+
+def reset():
+    """Sets all counters and timers to zero."""
+    _stats.reset()
+
+
+# minimal number of padding bytes: 0x80 and the 64 bit length for the
+# Merkle-Damgard construction, the pad10*1 with the domain bits for the sponge
+PADDING = {'sha256': 9, 'shake_256': 1}
+
+
+class _CountingHash:
+    """Hash object which counts the hashed bytes and compression function calls."""
+    __slots__ = ('_h', '_len')
+
+    def __init__(self, H, data):
+        self._h = H(data)
+        self._len = len(data)
+
+    def update(self, data):
+        self._h.update(data)
+        self._len += len(data)
+
+    def digest(self):
+        _stats.hash_calls += 1
+        _stats.hash_bytes += self._len
+        block_size = self._h.block_size
+        _stats.hash_blocks += (self._len + PADDING[self._h.name] + block_size - 1) // block_size
+        return self._h.digest()
+
+
+def counting(H):
+    """Returns the hash function `H`, or a counting wrapper if the instrumentation is enabled.
+
+    Args:
+        H: hash function, e.g. hashlib.sha256
+
+    Returns:
+        callable: Hash function with the same interface as `H`.
+    """
+    if not _enabled:
+        return H
+    return lambda data=b'': _CountingHash(H, data)
+
+
+class _Phase:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    """Context manager measuring the time of a phase if the instrumentation is enabled.
+
+    Args:
+        name (str): name of the phase
+    """
+    if not _enabled:
+        return _NO_PHASE
+    return _Phase(name)
+
+
+def record(name, duration):
+    """Records the duration of a phase measured by the caller if the instrumentation is enabled.
+    
+    Args:
+        name (str): name of the phase
+        duration (float): duration in seconds
+    """
+    if not _enabled:
+        return
+    _stats.add_phase(name, duration)
+    if _hook is not None:
+        _hook(name, duration)
+
+
+def _call_counted(func, args):
+    # runs in a worker process, the counters are sent back to the parent
+    global _enabled
+    _enabled = True
+    _stats.reset()
+    result = func(*args)
+    return result, (_stats.hash_calls, _stats.hash_blocks, _stats.hash_bytes)
+
+
+def starmap(pool, func, iterable):
+    """Like `pool.starmap`, but the hash counters of the workers are collected if enabled.
+
+    Args:
+        pool (multiprocessing.pool.Pool, None): pool of worker processes, None=computation in this process
+        func (callable): function applied to every argument tuple
+        iterable: argument tuples
+
+    Returns:
+        list: The results of `func`.
+    """
+    if pool is None:
+        return [func(*args) for args in iterable]
+    if not _enabled:
+        return pool.starmap(func, iterable)
+    results = []
+    for result, (calls, blocks, nbytes) in pool.starmap(_call_counted, ((func, args) for args in iterable)):
+        _stats.hash_calls += calls
+        _stats.hash_blocks += blocks
+        _stats.hash_bytes += nbytes
+        results.append(result)
+    return results
+
+
+def _apply(task):
+    return task[0](*task[1])
+
+
+def _apply_counted(task):
+    return _call_counted(*task)
+
+
+def imap_unordered(pool, func, iterable):
+    """Like `pool.imap_unordered` for argument tuples, but the hash counters of the workers are collected if enabled.
+
+    Args:
+        pool (multiprocessing.pool.Pool, None): pool of worker processes, None=computation in this process
+        func (callable): function applied to every argument tuple
+        iterable: argument tuples
+
+    Yields:
+        The results of `func` in the order of their completion.
+    """
+    if pool is None:
+        for args in iterable:
+            yield func(*args)
+    elif not _enabled:
+        yield from pool.imap_unordered(_apply, ((func, args) for args in iterable))
+    else:
+        for result, (calls, blocks, nbytes) in pool.imap_unordered(_apply_counted, ((func, args) for args in iterable)):
+            _stats.hash_calls += calls
+            _stats.hash_blocks += blocks
+            _stats.hash_bytes += nbytes
+            yield result
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Keyring of HSS public keys
+
+A keyring holds many parsed HSS public keys, e.g. all ``.pub`` files of a
+directory or a bundle file, and verifies signatures without the caller
+knowing the key in advance. The keys are indexed by the identifier `I` and
+the root `T[1]` of their top level LMS tree.
+
+A HSS signature does not contain the identifier of the top level tree (RFC
+8554, section 6.2), and every hash of its verification depends on that
+identifier. So a signature can only be routed by what has been learned from
+earlier signatures:
+
+  * by the identifier or root of the key, if the caller knows it
+  * by the identifier of the signed lower level LMS tree, which is learned
+    from the first valid signature of that tree
+  * otherwise the keys with the same number of levels, LMS and LMOTS
+    algorithm type as the signature are tried. Keys which have already used
+    the top level leaf `q` of the signature for another tree are skipped,
+    since every leaf signs only once. The key whose last seen leaf is q-1,
+    i.e. which has just rolled over, is tried first, then the keys whose last
+    seen leaf is smaller than q, then all others. The number of tried keys
+    can be bounded.
+
+A bundle is the concatenation of HSS public keys, which are self-delimiting.
+
+Example:
+    Verifying signatures of many keys::
+
+        from hsslms.keyring import Keyring
+
+        keyring = Keyring()
+        keyring.load_dir('/etc/hsslms/keys')
+        vk = keyring.verify(message, signature)
+"""
+import os
+from .hss import HSS_Pub
+from .lms import LMS_Pub
+from .utils import LMOTS_ALGORITHM_TYPE
+from .utils import INVALID, FAILURE
+from .utils import strTou32
+
+
+class Keyring:
+    """A class used to hold and index many HSS public keys.
+
+    Args:
+        cache (bool, optional): if True, the caches of verified nodes of the keys
+            are enabled, see `HSS_Pub.enable_cache`
+        max_routes (int, optional): maximal number of learned identifiers of lower level trees
+        max_trials (int, None, optional): maximal number of keys tried for a
+            signature without learned route, None=all matching keys
+    """
+    def __init__(self, cache=False, max_routes=2**16, max_trials=None):
+        self.cache = cache
+        self.max_routes = max_routes
+        self.max_trials = max_trials
+        self.by_I = {}
+        self.by_root = {}
+        self.by_structure = {}  # (L, LMS type, LMOTS type) -> list of keys
+        self.routes = {}  # I of a level 1 tree -> key
+        self.leafs = {}  # (I of a key, top level leaf q) -> I of the signed level 1 tree, None if L=1
+        self.last_q = {}  # I of a key -> last seen top level leaf q
+
+    def __len__(self):
+        return len(self.by_I)
+
+    def add(self, pubkey):
+        """Adds a public key.
+
+        Args:
+            pubkey (bytes, HSS_Pub): the public key
+
+        Raises:
+            INVALID: If the public key is invalid.
+
+        Returns:
+            HSS_Pub: The key held by the keyring, an already known key is not added twice.
+        """
+        if not isinstance(pubkey, HSS_Pub):
+            pubkey = HSS_Pub(pubkey)
+        known = self.by_I.get(pubkey.pub.I)
+        if known is not None and known.get_pubkey() == pubkey.get_pubkey():
+            return known
+        if self.cache:
+            pubkey.enable_cache()
+        self.by_I[pubkey.pub.I] = pubkey
+        self.by_root[pubkey.pub.T1] = pubkey
+        self.by_structure.setdefault((pubkey.L, pubkey.pub.pubtype.value, pubkey.pub.otspubtype.value), []).append(pubkey)
+        return pubkey
+
+    def load_dir(self, directory, suffix='.pub'):
+        """Adds the public keys of all files of a directory with the given suffix.
+
+        Raises:
+            FAILURE: If a file cannot be read or holds no valid public key.
+
+        Returns:
+            int: The number of loaded keys.
+        """
+        count = 0
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(suffix):
+                filename = os.path.join(directory, name)
+                try:
+                    with open(filename, 'rb') as fin:
+                        self.add(fin.read())
+                except IOError:
+                    raise FAILURE("File %s cannot be read." % filename)
+                except INVALID:
+                    raise FAILURE("File %s holds no valid public key." % filename)
+                count += 1
+        return count
+
+    def load_bundle(self, filename):
+        """Adds the public keys of a bundle file.
+
+        Raises:
+            FAILURE: If the file cannot be read or is malformed.
+
+        Returns:
+            int: The number of loaded keys.
+        """
+        try:
+            with open(filename, 'rb') as fin:
+                data = fin.read()
+        except IOError:
+            raise FAILURE("File %s cannot be read." % filename)
+        count = 0
+        try:
+            while len(data) > 0:
+                l = 4 + LMS_Pub._len_pubkey(data[4:])
+                self.add(data[:l])
+                data = data[l:]
+                count += 1
+        except INVALID:
+            raise FAILURE("Malformed bundle %s." % filename)
+        return count
+
+    def save_bundle(self, filename):
+        """Saves all public keys into a bundle file."""
+        try:
+            with open(filename, 'wb') as fout:
+                for key in self.by_I.values():
+                    fout.write(key.get_pubkey())
+        except IOError:
+            raise FAILURE("File %s cannot be saved." % filename)
+
+    def get(self, key_id):
+        """Returns the key with the identifier `I` or the root `T[1]` given by `key_id`, None if unknown."""
+        key = self.by_I.get(key_id)
+        if key is None:
+            key = self.by_root.get(key_id)
+        return key
+
+    def _level1_I(self, signature):
+        """Returns the identifier of the level 1 tree embedded in the signature, None if L=1.
+
+        Raises:
+            INVALID: If the signature is malformed.
+        """
+        if strTou32(signature[:4]) == 0:
+            return None
+        l = 4 + LMS_Pub._len_signature(signature[4:])
+        if len(signature) < l+24:
+            raise INVALID
+        return signature[l+8:l+24]
+
+    def candidates(self, signature):
+        """Returns the keys which may have generated a signature, the most likely key first.
+
+        Raises:
+            INVALID: If the signature is malformed.
+        """
+        if len(signature) < 12:
+            raise INVALID
+        I = self._level1_I(signature)
+        learned = self.routes.get(I) if I is not None else None
+        if learned is not None:
+            return [learned]
+        # u32str(Nspk) || u32str(q) || u32str(otstype) || C || y || u32str(lmstype) || path
+        try:
+            otstype = LMOTS_ALGORITHM_TYPE(strTou32(signature[8:12]))
+        except ValueError:
+            raise INVALID
+        lmstype = strTou32(signature[12+otstype.n*(otstype.p+1):16+otstype.n*(otstype.p+1)])
+        keys = self.by_structure.get((strTou32(signature[:4]) + 1, lmstype, otstype.value), [])
+        q = strTou32(signature[4:8])
+        ranked = []
+        for key in keys:
+            used = self.leafs.get((key.pub.I, q), False)
+            if used is not False and used != I:
+                continue  # the leaf q of this key has signed another tree
+            last = self.last_q.get(key.pub.I)
+            ranked.append((0 if used is not False or last == q-1 else 1 if last is None or last < q else 2, key))
+        ranked.sort(key=lambda entry: entry[0])
+        keys = [key for _, key in ranked]
+        return keys if self.max_trials is None else keys[:self.max_trials]
+
+    def _learn(self, key, signature):
+        I = self._level1_I(signature)
+        q = strTou32(signature[4:8])
+        if I is not None and self.routes.get(I) is not key:
+            if len(self.routes) >= self.max_routes:
+                self.routes.pop(next(iter(self.routes)))
+            self.routes[I] = key
+        if (key.pub.I, q) not in self.leafs:
+            if len(self.leafs) >= self.max_routes:
+                self.leafs.pop(next(iter(self.leafs)))
+            self.leafs[key.pub.I, q] = I
+        if self.last_q.get(key.pub.I, -1) < q:
+            self.last_q[key.pub.I] = q
+
+    def verify(self, message, signature, key_id=None):
+        """Verifies a signature with the matching key of the keyring.
+
+        Args:
+            message (bytes): Message to be verified with `signature`
+            signature (bytes): Signature belonging to the `message`
+            key_id (bytes, None, optional): identifier `I` or root `T[1]` of the
+                key, None=the key is looked up by `candidates`
+
+        Raises:
+            INVALID: If the signature is invalid or no key matches.
+
+        Returns:
+            HSS_Pub: The key which verified the signature.
+        """
+        if key_id is not None:
+            key = self.get(key_id)
+            keys = [] if key is None else [key]
+        else:
+            keys = self.candidates(signature)
+        for key in keys:
+            try:
+                key.verify(message, signature)
+            except INVALID:
+                continue
+            self._learn(key, signature)
+            return key
+        raise INVALID
@@ -4,11 +4,12 @@
 For reference see RFC 8554, section 4.
 """
 import io
-from secrets import token_bytes
+from os import urandom
 from .utils import LMOTS_ALGORITHM_TYPE
 from .utils import INVALID, FAILURE
 from .utils import D_MESG, D_PBLC
 from .utils import coef, cksm, u16str, u8str, u32str
+from .instrumentation import counting, phase
 
 
 class LM_OTS_Pub:
@@ -39,7 +40,7 @@ class LM_OTS_Pub:
         sigtype = LMOTS_ALGORITHM_TYPE(int.from_bytes(signature[:4], 'big'))
         if self.pubtype != sigtype:
             raise INVALID
-        H, n, w, p, ls = sigtype.H, sigtype.n, sigtype.w, sigtype.p, sigtype.ls
+        H, n, w, p, ls = counting(sigtype.H), sigtype.n, sigtype.w, sigtype.p, sigtype.ls
         if len(signature) != 4 + n * (p+1):
             raise INVALID
         C = signature[4:4+n]
@@ -110,7 +111,8 @@ class LM_OTS_Priv:
         self.q = q
         self.H, self.n, self.w, self.p, self.ls = typecode.H, typecode.n, typecode.w, typecode.p, typecode.ls
         self.typecode = u32str(typecode.value)
-        self.x = [self.H(self.I + u32str(self.q) + u16str(i) + b'\xff' + SEED).digest()[:self.n] for i in range(self.p)]
+        H = counting(self.H)
+        self.x = [H(self.I + u32str(self.q) + u16str(i) + b'\xff' + SEED).digest()[:self.n] for i in range(self.p)]
         self.used = False
 
     def sign(self, message):
@@ -128,45 +130,80 @@ class LM_OTS_Priv:
         Returns:
             bytes: The signature to `message`.
         """
+        signature = bytearray(self.get_signature_length())
+        self.sign_into(message, signature)
+        return bytes(signature)
+
+    def sign_into(self, message, buffer, offset=0):
+        """Signature Generation of LMOTS into a buffer
+        
+        Signs a message like `sign`, the signature is written into `buffer`.
+        
+        Args:
+            message (bytes, BufferedReader): Message to be signed
+            buffer (bytearray, memoryview): writable buffer of at least
+                `offset` + `get_signature_length()` bytes
+            offset (int, optional): position of the signature in `buffer`
+        
+        Raises:
+            FAILURE: If a signature has already been computed, the buffer is too
+                small, or for other technical reason
+        
+        Returns:
+            int: The length of the signature.
+        """
         if self.used == True:
             raise FAILURE("Private key has already been used for signing.")
-        C = token_bytes(self.n)
-        signature = self.typecode + C;
-        if type(message) is bytes:
-            Q = self.H(self.I + u32str(self.q) + D_MESG + C + message)
-        elif type(message) is io.BufferedReader:
-            Q = self.H(self.I + u32str(self.q) + D_MESG + C)
-            try:
-                while True:
-                    buffer = message.read(1024**2)
-                    Q.update(buffer)
-                    if len(buffer) < 1024**2:
-                        break
-                message.close()
-            except IOError:
-                raise FAILURE("Error. Cannot read message.")
-        else:
-            raise FAILURE("Invalid message type.")
-        Q = Q.digest()[:self.n]
-        Qa = Q + cksm(Q, self.w, self.n, self.ls)
-        for i in range(self.p):
-            a = coef(Qa, i, self.w)
-            tmp = self.x[i]
-            for j in range(a):
-                tmp = self.H(self.I + u32str(self.q) + u16str(i) + u8str(j) + tmp).digest()[:self.n]
-            signature += tmp  # y
+        if len(buffer) - offset < self.get_signature_length():
+            raise FAILURE("The buffer is too small for the signature.")
+        n = self.n
+        with phase('ots_sign'):
+            H = counting(self.H)
+            C = urandom(n)
+            buffer[offset:offset+4] = self.typecode
+            buffer[offset+4:offset+4+n] = C
+            pos = offset + 4 + n
+            if type(message) is bytes:
+                Q = H(self.I + u32str(self.q) + D_MESG + C + message)
+            elif type(message) is io.BufferedReader:
+                Q = H(self.I + u32str(self.q) + D_MESG + C)
+                try:
+                    while True:
+                        chunk = message.read(1024**2)
+                        Q.update(chunk)
+                        if len(chunk) < 1024**2:
+                            break
+                    message.close()
+                except IOError:
+                    raise FAILURE("Error. Cannot read message.")
+            else:
+                raise FAILURE("Invalid message type.")
+            Q = Q.digest()[:self.n]
+            Qa = Q + cksm(Q, self.w, self.n, self.ls)
+            for i in range(self.p):
+                a = coef(Qa, i, self.w)
+                tmp = self.x[i]
+                for j in range(a):
+                    tmp = H(self.I + u32str(self.q) + u16str(i) + u8str(j) + tmp).digest()[:self.n]
+                buffer[pos:pos+n] = tmp  # y
+                pos += n
         self.used = True
-        return signature
+        return pos - offset
+
+    def get_signature_length(self):
+        """Returns the length of a signature in bytes."""
+        return 4 + self.n*(self.p+1)
 
     def gen_pub_K(self):
+        H = counting(self.H)
         u32str_q = u32str(self.q)
-        K = self.H(self.I + u32str_q + D_PBLC)
+        K = H(self.I + u32str_q + D_PBLC)
         u8str_j = [u8str(j) for j in range(2**self.w - 1)]
         for i in range(self.p):
             tmp = self.x[i]
             Iqi = self.I + u32str_q + u16str(i)
             for j in u8str_j:
-                tmp = self.H(Iqi + j + tmp).digest()[:self.n]
+                tmp = H(Iqi + j + tmp).digest()[:self.n]
             K.update(tmp)
         return K.digest()[:self.n]
     
@@ -3,14 +3,15 @@
 
 For reference see RFC 8554, section 5.
 """
-from os import cpu_count
-from secrets import token_bytes
-from multiprocessing import Pool
+from os import cpu_count, urandom
+from time import perf_counter
 from .utils import LMOTS_ALGORITHM_TYPE, LMS_ALGORITHM_TYPE
 from .utils import INVALID, FAILURE
-from .utils import D_LEAF, D_INTR
+from .utils import D_LEAF, D_INTR, D_CHILD_SEED, D_CHILD_I
 from .utils import u32str, strTou32
 from .lmots import LM_OTS_Priv, LM_OTS_Pub
+from . import instrumentation
+from .instrumentation import counting, phase
 
 
 class LMS_Pub:
@@ -24,6 +25,9 @@ class LMS_Pub:
     Raises:
         INVALID: If the public is invalid.
     """
+    node_cache = None  # node number -> value of verified internal nodes, see enable_cache
+    max_cache_nodes = 0
+
     def __init__(self, pubkey):
         if len(pubkey) < 8:
             raise INVALID
@@ -61,35 +65,64 @@ class LMS_Pub:
         except:
             raise INVALID('Malformed public key.')
         
-    def _algo6b(self, message, signature):
+    def enable_cache(self, max_nodes=2**16):
+        """Enables the cache of verified internal nodes.
+
+        The internal nodes computed by a successful verification are correct,
+        they are stored in the cache. A later verification stops as soon as it
+        reaches a cached node, i.e. for many signatures of the same tree only
+        the lower part of the authentication path is hashed.
+
+        Args:
+            max_nodes (int, optional): maximal number of cached nodes
+        """
+        self.node_cache = {}
+        self.max_cache_nodes = max_nodes
+
+    def _algo6b(self, message, signature, nodes=None):
         if len(signature) < 8:
             raise INVALID
         q = strTou32(signature[:4])
-        otssigtype = LMOTS_ALGORITHM_TYPE(strTou32(signature[4:4+4]))
+        try:
+            otssigtype = LMOTS_ALGORITHM_TYPE(strTou32(signature[4:4+4]))
+        except ValueError:
+            raise INVALID
         if self.otspubtype != otssigtype:
             raise INVALID
         n, p = otssigtype.n, otssigtype.p
         if len(signature) < 12 + n*(p+1):
             raise INVALID
         lmots_signature = signature[4:8 + n*(p+1)]
-        sigtype = LMS_ALGORITHM_TYPE(strTou32(signature[8+n*(p+1):12+n*(p+1)]))
+        try:
+            sigtype = LMS_ALGORITHM_TYPE(strTou32(signature[8+n*(p+1):12+n*(p+1)]))
+        except ValueError:
+            raise INVALID
         if self.pubtype != sigtype:
             raise INVALID
         if q >= 2**self.h or len(signature) != 12+n*(p+1)+self.m*self.h:
             raise INVALID
         OTS_PUB = LM_OTS_Pub(lmots_signature[:4] + self.I + u32str(q)  + b'\x00'*n)
         Kc = OTS_PUB._algo4b(message, lmots_signature)
+        H = counting(self.H)
         node_num = 2**self.h + q
-        tmp = self.H(self.I + u32str(node_num) + D_LEAF + Kc).digest()[:self.m]
+        tmp = H(self.I + u32str(node_num) + D_LEAF + Kc).digest()[:self.m]
+        cache = self.node_cache
         i = 0
         while node_num > 1:
             path = signature[12+n*(p+1)+i*self.m:12+n*(p+1)+(i+1)*self.m]
             if node_num % 2 == 1:
-                tmp = self.H(self.I + u32str(node_num//2) + D_INTR + path + tmp).digest()[:self.m]
+                tmp = H(self.I + u32str(node_num//2) + D_INTR + path + tmp).digest()[:self.m]
             else:
-                tmp = self.H(self.I + u32str(node_num//2) + D_INTR + tmp + path).digest()[:self.m]
+                tmp = H(self.I + u32str(node_num//2) + D_INTR + tmp + path).digest()[:self.m]
             node_num >>= 1
             i += 1
+            if cache is not None:
+                cached = cache.get(node_num)
+                if cached is not None:
+                    # the path above a verified node leads to T[1]
+                    return self.T1 if cached == tmp else None
+                if nodes is not None:
+                    nodes.append((node_num, tmp))
         return tmp  # Tc
         
     def verify(self, message, signature):
@@ -105,9 +138,19 @@ class LMS_Pub:
         Raises:
             INVALID: If signature is invalid.
         """
-        Tc = self._algo6b(message, signature)
+        if self.node_cache is None:
+            Tc = self._algo6b(message, signature)
+            if Tc != self.T1:
+                raise INVALID
+            return
+        nodes = []
+        Tc = self._algo6b(message, signature, nodes)
         if Tc != self.T1:
             raise INVALID
+        for node_num, value in reversed(nodes):  # upper nodes first
+            if len(self.node_cache) >= self.max_cache_nodes:
+                break
+            self.node_cache[node_num] = value
             
     def _len_signature(signature):
         """Computes the correct length of a signature in an even longer byte string
@@ -122,11 +165,17 @@ class LMS_Pub:
         """
         if len(signature) < 8:
             raise INVALID
-        otssigtype = LMOTS_ALGORITHM_TYPE(strTou32(signature[4:4+4]))
+        try:
+            otssigtype = LMOTS_ALGORITHM_TYPE(strTou32(signature[4:4+4]))
+        except ValueError:
+            raise INVALID
         n, p = otssigtype.n, otssigtype.p
         if len(signature) < 12+n*(p+1):
             raise INVALID
-        sigtype = LMS_ALGORITHM_TYPE(strTou32(signature[8+n*(p+1):12+n*(p+1)]))
+        try:
+            sigtype = LMS_ALGORITHM_TYPE(strTou32(signature[8+n*(p+1):12+n*(p+1)]))
+        except ValueError:
+            raise INVALID
         if len(signature) < 12 + n*(p+1) + sigtype.m * sigtype.h:
             raise INVALID
         return 12 + n*(p+1) + sigtype.m * sigtype.h
@@ -153,27 +202,213 @@ class LMS_Priv:
         typecode (LMS_ALGORITHM_TYPE): Enumeration of Leighton-Micali Signatures (LMS) algorithm types
         otstypecode (LMOTS_ALGORITHM_TYPE): Enumeration of Leighton-Micali One-Time-Signatures (LMOTS) algorithm types
         num_cores (int, None, optional): the number of CPU cores used for key generation, None=all cores
+        progress (callable, None, optional): called after every finished subtree with the
+            number of computed leafs, the total number of leafs and the estimated
+            remaining time in seconds (None if unknown)
+        checkpoint (:obj:`hsslms.checkpoint.KeyGenCheckpoint`, None, optional): the finished
+            subtrees are stored in the checkpoint, and the key generation resumes
+            from the checkpoint if it holds any subtrees
+        SEED (bytes, None, optional): seed of the key, None=random
+        I (bytes, None, optional): identifier of the key, None=random
+    
+    Attributes:
+        compact (bool): if True, the nodes of the tree are not pickled but
+            recomputed from `SEED` when the key is used after unpickling
+    
+    Raises:
+        FAILURE: If the checkpoint belongs to other parameter sets.
     """
-    def _calc_leafs(H, I, r, h, otstypecode, SEED):
+    SUBTREE_HEIGHT = 10
+    compact = False
+    
+    def _calc_leafs(H, I, r, h, otstypecode, SEED, m):
         OTS_PRIV = LM_OTS_Priv(otstypecode, I, r-2**h, SEED)
-        return H(I + u32str(r) + D_LEAF + OTS_PRIV.gen_pub_K()).digest()[:otstypecode.n]
+        return counting(H)(I + u32str(r) + D_LEAF + OTS_PRIV.gen_pub_K()).digest()[:m]
     def _calc_knots(H, I, r, Tl, Tr, m):
-        return H(I + u32str(r) + D_INTR + Tl + Tr).digest()[:m]
+        return counting(H)(I + u32str(r) + D_INTR + Tl + Tr).digest()[:m]
     
-    def __init__(self, typecode, otstypecode, num_cores=None):
-        if num_cores is None:
-            num_cores = cpu_count()
+    def __init__(self, typecode, otstypecode, num_cores=None, progress=None, checkpoint=None, SEED=None, I=None, build=True):
         self.typecode = typecode
         self.otstypecode = otstypecode
         self.H, self.m, self.h = self.typecode.H, self.typecode.m, self.typecode.h
-        self.SEED = token_bytes(self.m)
-        self.I = token_bytes(16)
-        with Pool(num_cores) as p:
-            self.T = [None]*(2**(self.h+1))
-            self.T[2**self.h : 2**(self.h+1)] = p.starmap(LMS_Priv._calc_leafs, ((self.H, self.I, r, self.h, self.otstypecode, self.SEED) for r in range(2**self.h, 2**(self.h+1))))
-            for i in range(self.h-1, -1, -1):
-                self.T[2**i : 2**(i+1)] = p.starmap(LMS_Priv._calc_knots, ((self.H, self.I, r, self.T[2*r], self.T[2*r+1], self.m) for r in range(2**i, 2**(i+1))))
+        state = None if checkpoint is None else checkpoint.load()
+        if state is None:
+            self.SEED = urandom(self.m) if SEED is None else SEED
+            self.I = urandom(16) if I is None else I
+            self._prepare(progress, checkpoint)
+        else:
+            typecode, otstypecode, self.SEED, self.I, s, blocks = state
+            if typecode != self.typecode or otstypecode != self.otstypecode:
+                raise FAILURE("Checkpoint does not match the parameter sets.")
+            self._prepare(progress, checkpoint, s, blocks)
         self.q = 0
+        self.q_end = 2**self.h
+        if build:
+            LMS_Priv._build_all([self], num_cores)
+    
+    def _prepare(self, progress=None, checkpoint=None, s=None, blocks=None):
+        """Prepares the computation of the nodes by `_build_all`, `blocks` holds already computed subtrees of height `s`."""
+        self.T = [None]*(2**(self.h+1))
+        if blocks is None:
+            s = min(self.h, LMS_Priv.SUBTREE_HEIGHT)
+            blocks = {}
+            if checkpoint is not None:
+                checkpoint.start(self.typecode, self.otstypecode, self.SEED, self.I, s)
+        else:
+            for j, block in blocks.items():
+                self._set_subtree(j, s, block)
+        self._pending = (s, blocks, progress, checkpoint)
+    
+    def _build(self, num_cores=None):
+        """Recomputes the nodes of the tree from `SEED` and `I`."""
+        self._prepare()
+        LMS_Priv._build_all([self], num_cores)
+    
+    def _calc_leaf_chunk(H, I, h, otstypecode, SEED, m, k, j, r, count):
+        return k, j, r, [LMS_Priv._calc_leafs(H, I, r+i, h, otstypecode, SEED, m) for i in range(count)]
+    
+    def _build_all(trees, num_cores=None):
+        """Computes the nodes of several trees, the leafs of all trees are computed by one pool.
+        
+        Trees which are not prepared by `_prepare` are skipped.
+        
+        Args:
+            trees (:obj:`list` of :obj:`LMS_Priv`): the trees
+            num_cores (int, None, optional): the number of CPU cores used, None=all cores
+        """
+        trees = [tree for tree in trees if getattr(tree, '_pending', None) is not None]
+        if len(trees) == 0:
+            return
+        if num_cores is None:
+            num_cores = cpu_count()
+        tasks, missing, done = [], {}, []
+        for k, tree in enumerate(trees):
+            s, blocks, progress, checkpoint = tree._pending
+            # chunks of leafs, such that a subtree is spread over all cores
+            chunk = max(1, 2**s // (4*num_cores))
+            for j in range(2**(tree.h-s)):
+                if j in blocks:
+                    continue
+                first = 2**tree.h + j*2**s
+                missing[k, j] = {}
+                for r in range(first, first + 2**s, chunk):
+                    tasks.append((tree.H, tree.I, tree.h, tree.otstypecode, tree.SEED, tree.m, k, j, r, min(chunk, first + 2**s - r)))
+            done.append(len(blocks))
+            if progress is not None and len(blocks) > 0:
+                progress(len(blocks) * 2**s, 2**tree.h, None)
+        resumed = list(done)
+        start, merge = perf_counter(), 0.0
+        from multiprocessing import Pool  # not needed for verification
+        with Pool(num_cores) as p:
+            for k, j, r, leafs in instrumentation.imap_unordered(p, LMS_Priv._calc_leaf_chunk, tasks):
+                tree = trees[k]
+                s, blocks, progress, checkpoint = tree._pending
+                chunks = missing[k, j]
+                chunks[r] = leafs
+                if sum(map(len, chunks.values())) < 2**s:
+                    continue
+                del missing[k, j]
+                t = perf_counter()
+                nodes = [leaf for r in sorted(chunks) for leaf in chunks[r]]
+                block = LMS_Priv._merge_subtree(tree.H, tree.I, tree.h, tree.m, j, s, nodes)
+                tree._set_subtree(j, s, block)
+                merge += perf_counter() - t
+                if checkpoint is not None:
+                    checkpoint.add(j, block)
+                done[k] += 1
+                if progress is not None:
+                    eta = (perf_counter() - start) / (done[k] - resumed[k]) * (2**(tree.h-s) - done[k])
+                    progress(done[k] * 2**s, 2**tree.h, eta)
+        instrumentation.record('leaf_generation', perf_counter() - start - merge)
+        instrumentation.record('tree_merge', merge)
+        for tree in trees:
+            tree._calc_top(tree._pending[0])
+            del tree._pending
+    
+    def _calc_subtree(p, H, I, h, otstypecode, SEED, m, j, s):
+        """Computes the nodes of the `j`-th subtree of height `s`.
+        
+        Args:
+            p (multiprocessing.pool.Pool, None): pool used for the leafs, None=computation in this process
+        
+        Returns:
+            bytes: The nodes level by level starting at the leafs.
+        """
+        first = 2**h + j*2**s
+        with phase('leaf_generation'):
+            nodes = instrumentation.starmap(p, LMS_Priv._calc_leafs, ((H, I, r, h, otstypecode, SEED, m) for r in range(first, first+2**s)))
+        with phase('tree_merge'):
+            return LMS_Priv._merge_subtree(H, I, h, m, j, s, nodes)
+    
+    def _merge_subtree(H, I, h, m, j, s, nodes):
+        """Computes the inner nodes of the `j`-th subtree of height `s` from its leafs `nodes`.
+        
+        Returns:
+            bytes: The nodes level by level starting at the leafs.
+        """
+        first, k = 2**h + j*2**s, 0
+        for i in range(1, s+1):
+            for r in range(first >> i, (first >> i) + 2**(s-i)):
+                nodes.append(LMS_Priv._calc_knots(H, I, r, nodes[k], nodes[k+1], m))
+                k += 2
+        return b''.join(nodes)
+    
+    def _verify_subtree(H, I, h, m, j, s, block):
+        """Checks that the inner nodes of a serialized subtree match its leafs.
+        
+        Returns:
+            bool: True if the subtree is consistent.
+        """
+        if len(block) != (2**(s+1) - 1) * m:
+            return False
+        first, k, l = 2**h + j*2**s, 0, 2**s * m
+        for i in range(1, s+1):
+            for r in range(first >> i, (first >> i) + 2**(s-i)):
+                if LMS_Priv._calc_knots(H, I, r, block[k:k+m], block[k+m:k+2*m], m) != block[l:l+m]:
+                    return False
+                k += 2*m
+                l += m
+        return True
+    
+    def _set_subtree(self, j, s, block):
+        """Sets the nodes of the `j`-th subtree of height `s` from its serialization."""
+        if len(block) != (2**(s+1) - 1) * self.m:
+            raise FAILURE("Invalid subtree.")
+        first, k = 2**self.h + j*2**s, 0
+        for i in range(s+1):
+            for r in range(first >> i, (first >> i) + 2**(s-i)):
+                self.T[r] = block[k : k+self.m]
+                k += self.m
+    
+    def _calc_top(self, s):
+        """Computes the nodes above the subtrees of height `s`."""
+        if s < self.h:
+            with phase('tree_merge'):
+                for r in range(2**(self.h-s)-1, 0, -1):
+                    self.T[r] = LMS_Priv._calc_knots(self.H, self.I, r, self.T[2*r], self.T[2*r+1], self.m)
+    
+    def _from_subtrees(typecode, otstypecode, SEED, I, s, blocks):
+        """Assembles a private key from all its serialized subtrees of height `s`.
+        
+        Args:
+            blocks (dict): maps the number of a subtree to its serialization
+        
+        Returns:
+            LMS_Priv: The private key.
+        """
+        sk = LMS_Priv.__new__(LMS_Priv)
+        sk.typecode = typecode
+        sk.otstypecode = otstypecode
+        sk.H, sk.m, sk.h = typecode.H, typecode.m, typecode.h
+        sk.SEED = SEED
+        sk.I = I
+        sk.T = [None]*(2**(sk.h+1))
+        for j in range(2**(sk.h-s)):
+            sk._set_subtree(j, s, blocks[j])
+        sk._calc_top(s)
+        sk.q = 0
+        sk.q_end = 2**sk.h
+        return sk
         
     def sign(self, message):
         """Signature Generation of LMS
@@ -190,23 +425,133 @@ class LMS_Priv:
         Returns:
             bytes: The signature to `message`.
         """
-        if self.q >= 2**self.h:
+        signature = bytearray(self.get_signature_length())
+        self.sign_into(message, signature)
+        return bytes(signature)
+
+    def sign_into(self, message, buffer, offset=0):
+        """Signature Generation of LMS into a buffer
+        
+        Signs a message like `sign`, the signature is written into `buffer`.
+        
+        Args:
+            message (bytes, BufferedReader): Message to be signed
+            buffer (bytearray, memoryview): writable buffer of at least
+                `offset` + `get_signature_length()` bytes
+            offset (int, optional): position of the signature in `buffer`
+        
+        Raises:
+            FAILURE: If a signature has already been computed, the buffer is too
+                small, or for other technical reason
+        
+        Returns:
+            int: The length of the signature.
+        """
+        if self.q >= self.q_end:
             raise FAILURE("Private keys exhausted.")
-        lmots_signature = LM_OTS_Priv(self.otstypecode, self.I, self.q, self.SEED).sign(message)
-        signature = u32str(self.q) + lmots_signature + u32str(self.typecode.value)
-        r = 2**self.h + self.q
-        for i in range(self.h):
-            signature += self.T[r ^ 1]
-            r >>= 1
+        if len(buffer) - offset < self.get_signature_length():
+            raise FAILURE("The buffer is too small for the signature.")
+        if self.T is None:
+            self._build()
+        buffer[offset:offset+4] = u32str(self.q)
+        pos = offset + 4
+        pos += LM_OTS_Priv(self.otstypecode, self.I, self.q, self.SEED).sign_into(message, buffer, pos)
+        with phase('auth_path'):
+            buffer[pos:pos+4] = u32str(self.typecode.value)
+            pos += 4
+            m = self.m
+            r = 2**self.h + self.q
+            for i in range(self.h):
+                buffer[pos:pos+m] = self.T[r ^ 1]
+                pos += m
+                r >>= 1
         self.q += 1
-        return signature
+        return pos - offset
+
+    def _sign_ots(otstypecode, I, q, SEED, message):
+        return LM_OTS_Priv(otstypecode, I, q, SEED).sign(message)
+
+    def sign_many(self, messages, pool=None):
+        """Signature Generation of LMS for several messages
+        
+        The messages are signed by consecutive leafs, the LM-OTS signatures
+        are computed concurrently by the worker processes of `pool`.
+        
+        Args:
+            messages (:obj:`list` of :obj:`bytes`): Messages to be signed
+            pool (multiprocessing.pool.Pool, None, optional): pool of worker
+                processes, None=computation in this process
+        
+        Raises:
+            FAILURE: If not enough signatures are left.
+        
+        Returns:
+            :obj:`list` of :obj:`bytes`: The signatures in the order of the messages.
+        """
+        if self.q + len(messages) > self.q_end:
+            raise FAILURE("Private keys exhausted.")
+        if self.T is None:
+            self._build()
+        q = self.q
+        lmots_signatures = instrumentation.starmap(pool, LMS_Priv._sign_ots, [(self.otstypecode, self.I, q+k, self.SEED, message) for k, message in enumerate(messages)])
+        signatures = []
+        with phase('auth_path'):
+            for k, lmots_signature in enumerate(lmots_signatures):
+                path = []
+                r = 2**self.h + q + k
+                for i in range(self.h):
+                    path.append(self.T[r ^ 1])
+                    r >>= 1
+                signatures.append(u32str(q+k) + lmots_signature + u32str(self.typecode.value) + b''.join(path))
+        self.q += len(messages)
+        return signatures
+
+    def get_signature_length(self):
+        """Returns the length of a signature in bytes."""
+        return LMS_Priv._signature_length(self.typecode, self.otstypecode)
+
+    def _signature_length(typecode, otstypecode):
+        return 12 + otstypecode.n*(otstypecode.p+1) + typecode.m*typecode.h
+        
+    def derive_child(self, q, typecode):
+        """Derives the seed and the identifier of a child key signed by the leaf `q`.
+        
+        The derivation follows the pseudorandom key generation of RFC 8554,
+        Appendix A, with the indices 0xfffe and 0xffff, which are never used by
+        LM-OTS.
+        
+        Args:
+            q (int): number of the leaf signing the child key
+            typecode (LMS_ALGORITHM_TYPE): LMS algorithm type of the child key
         
+        Returns:
+            tuple: The seed and the identifier of the child key.
+        """
+        H = counting(self.H)
+        prefix = self.I + u32str(q)
+        SEED = H(prefix + D_CHILD_SEED + b'\xff' + self.SEED).digest()[:typecode.m]
+        I = H(prefix + D_CHILD_I + b'\xff' + self.SEED).digest()[:16]
+        return SEED, I
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.compact:
+            state['T'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'q_end' not in state:  # keys saved before shards
+            self.q_end = 2**self.h
+
     def gen_pub(self):
         """Computes the public key associated with the private key in this class.
         
         Returns:
             LMS_Pub: The public key belonging to this private key.
         """
+        if self.T is None:
+            self._build()
         return LMS_Pub(u32str(self.typecode.value) + u32str(self.otstypecode.value) + self.I + self.T[1])
     
     def get_avail_signatures(self):
@@ -217,5 +562,5 @@ class LMS_Priv:
         Returns:
             int: The remaining number of signatures that can be generated.
         """
-        return 2**self.h - self.q
+        return self.q_end - self.q
     
@@ -1,6 +1,8 @@
 import os
 import io
+import mmap
 from os import cpu_count
+from concurrent.futures import ThreadPoolExecutor
 import pickle
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
@@ -11,11 +13,50 @@ from .utils import FAILURE
 from hashlib import sha384
 
 version = '0.1'
+CHUNK_SIZE = 2**20
 
 def kdf(salt, password):
     return PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=390000).derive(password)
 
 
+def prehash(message, chunk_size=CHUNK_SIZE):
+    """
+    Computes the SHA-384 pre-hash of a message without loading it into memory.
+
+    Regular files are mapped into memory, other file objects are read in chunks.
+    A file object is hashed from its current position to its end.
+
+    Args:
+        message (bytes, file object, iterable): the message, a binary file object or an iterable of bytes chunks
+        chunk_size (int, optional): size of the chunks read from file objects
+
+    Returns:
+        bytes: The SHA-384 digest of the message.
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return sha384(message).digest()
+    h = sha384()
+    if hasattr(message, 'read'):
+        try:
+            pos = message.tell()
+            mm = mmap.mmap(message.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            # no regular file or empty file
+            mm = None
+        if mm is not None:
+            with mm:
+                with memoryview(mm) as view:
+                    h.update(view[pos:])
+            message.seek(0, io.SEEK_END)
+        else:
+            for chunk in iter(lambda: message.read(chunk_size), b''):
+                h.update(chunk)
+    else:
+        for chunk in message:
+            h.update(chunk)
+    return h.digest()
+
+
 class LMS_Wrapper_Priv(LMS_Priv):
     """
     Class derived from LMS_Priv.
@@ -50,7 +91,7 @@ class LMS_Wrapper_Priv(LMS_Priv):
         The key is automatically stored to disk after frequence signatures.
 
         Args:
-            message (bytes, BufferedReader): Message to be signed
+            message (bytes, BufferedReader, iterable): Message to be signed, see `prehash`
         
         Raises:
             FAILURE: If a signature has already been computed, or for other technical reason
@@ -58,9 +99,9 @@ class LMS_Wrapper_Priv(LMS_Priv):
         Returns:
             bytes: The signature to `message`.
         """
-        # sha384 of the message.
-        message_digest = sha384(message).digest()
+        return self._sign_digest(prehash(message))
 
+    def _sign_digest(self, message_digest):
         signature = super().sign(message_digest)
         self.sign_count += 1
 
@@ -70,6 +111,25 @@ class LMS_Wrapper_Priv(LMS_Priv):
         
         return signature
 
+    def sign_many(self, messages, num_threads=None):
+        """
+        Signs several messages.
+
+        The messages are pre-hashed in parallel by worker threads, afterwards the
+        digests are signed in the order of the messages.
+
+        Args:
+            messages (list): Messages to be signed, see `prehash`
+            num_threads (int, None, optional): number of worker threads, None=number of CPU cores
+
+        Raises:
+            FAILURE: If there are not enough signatures left, or for other technical reason
+
+        Returns:
+            :obj:`list` of :obj:`bytes`: The signatures in the order of the messages.
+        """
+        return [self._sign_digest(message_digest) for message_digest in _prehash_many(messages, num_threads)]
+
     def save(self):
         """
         This method is to save the key.
@@ -151,11 +211,46 @@ class LMS_Wrapper_Priv(LMS_Priv):
         Returns:
             True if signature is correct else False
         """
-        # sha384 of the message
-        message_digest = sha384(message).digest()
+        return self._verify_digest(prehash(message), signature, public_key)
 
+    @staticmethod
+    def _verify_digest(message_digest, signature, public_key):
         try:
             public_key.verify(message_digest, signature)
             return True
         except:
             return False
+
+    def verify_many(self, messages, signatures, public_key, num_threads=None):
+        """
+        Signatures of several messages are verified using public key.
+
+        The messages are pre-hashed in parallel by worker threads.
+
+        Args:
+            messages (list): Messages, see `prehash`
+            signatures (list): Signatures in the order of the messages
+            public_key
+            num_threads (int, None, optional): number of worker threads, None=number of CPU cores
+
+        Raises:
+            FAILURE: If the numbers of messages and signatures differ.
+
+        Returns:
+            :obj:`list` of :obj:`bool`: True for every correct signature else False
+        """
+        messages, signatures = list(messages), list(signatures)
+        if len(messages) != len(signatures):
+            raise FAILURE("%d messages but %d signatures." % (len(messages), len(signatures)))
+        return [self._verify_digest(message_digest, signature, public_key) for message_digest, signature in zip(_prehash_many(messages, num_threads), signatures)]
+
+
+def _prehash_many(messages, num_threads):
+    # hashlib releases the GIL while hashing large buffers
+    messages = list(messages)
+    if num_threads is None:
+        num_threads = cpu_count()
+    if num_threads == 1 or len(messages) < 2:
+        return [prehash(message) for message in messages]
+    with ThreadPoolExecutor(min(num_threads, len(messages))) as executor:
+        return list(executor.map(prehash, messages))
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Metrics of signing services
+
+A metrics object can be attached to a private key, e.g. ``HSS_Priv`` or
+``PersHSS_Priv``, by ``set_metrics``. It is informed about every signature,
+the remaining signatures per level and every save of the key.
+
+``Metrics`` is the interface and does nothing. ``PrometheusMetrics`` keeps
+counters, gauges and latency histograms and exports them in the Prometheus
+text format, either to a file (e.g. for the textfile collector of the node
+exporter) or via HTTP on localhost.
+
+Example:
+    Exporting the metrics of a persistent key::
+
+        from hsslms import PersHSS_Priv
+        from hsslms.metrics import PrometheusMetrics
+
+        metrics = PrometheusMetrics()
+        sk = PersHSS_Priv.from_file('key', b'password')
+        sk.set_metrics(metrics)
+        server = metrics.serve(9464)
+        signature = sk.sign(b'abc')
+        metrics.write('/var/lib/node_exporter/hsslms.prom')
+"""
+import os
+import threading
+from bisect import bisect_left
+
+
+class Metrics:
+    """Interface of metrics fed by a private key.
+
+    All methods do nothing, derived classes override them.
+    """
+    def observe_sign(self, duration, rollover_levels):
+        """Called after a signature has been generated.
+
+        Args:
+            duration (float): duration of the signature generation in seconds
+            rollover_levels (int): number of regenerated lower levels, 0 if
+                there was no rollover
+        """
+        pass
+
+    def observe_save(self, duration):
+        """Called after the key has been saved.
+
+        Args:
+            duration (float): duration of saving in seconds
+        """
+        pass
+
+    def set_avail_signatures(self, total, levels):
+        """Called with the numbers of remaining signatures.
+
+        Args:
+            total (int): remaining signatures of the key
+            levels (:obj:`list` of :obj:`int`): remaining signatures of the LMS
+                tree of each level
+        """
+        pass
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, lines):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum {self.sum}')
+        lines.append(f'{name}_count {self.count}')
+
+
+class PrometheusMetrics(Metrics):
+    """Metrics exported in the Prometheus text format.
+
+    Args:
+        prefix (str, optional): prefix of all metric names
+        buckets (tuple, None, optional): upper bounds of the latency histograms in seconds
+    """
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, prefix='hsslms', buckets=None):
+        if buckets is None:
+            buckets = PrometheusMetrics.BUCKETS
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.sign_duration = _Histogram(tuple(sorted(buckets)))
+        self.save_duration = _Histogram(tuple(sorted(buckets)))
+        self.signatures = 0
+        self.rollovers = {}  # level -> number of regenerations
+        self.avail_signatures = None
+        self.avail_signatures_levels = []
+
+    def observe_sign(self, duration, rollover_levels):
+        with self.lock:
+            self.sign_duration.observe(duration)
+            self.signatures += 1
+            # a rollover of d levels regenerates the lowest d levels
+            L = len(self.avail_signatures_levels)
+            for level in range(L - rollover_levels, L):
+                self.rollovers[level] = self.rollovers.get(level, 0) + 1
+
+    def observe_save(self, duration):
+        with self.lock:
+            self.save_duration.observe(duration)
+
+    def set_avail_signatures(self, total, levels):
+        with self.lock:
+            self.avail_signatures = total
+            self.avail_signatures_levels = list(levels)
+
+    def render(self):
+        """Renders the metrics.
+
+        Returns:
+            str: The metrics in the Prometheus text format.
+        """
+        p = self.prefix
+        lines = []
+        with self.lock:
+            lines.append(f'# HELP {p}_sign_duration_seconds Duration of signature generation.')
+            lines.append(f'# TYPE {p}_sign_duration_seconds histogram')
+            self.sign_duration.render(f'{p}_sign_duration_seconds', lines)
+            lines.append(f'# HELP {p}_save_duration_seconds Duration of saving the private key.')
+            lines.append(f'# TYPE {p}_save_duration_seconds histogram')
+            self.save_duration.render(f'{p}_save_duration_seconds', lines)
+            lines.append(f'# HELP {p}_signatures_total Number of generated signatures.')
+            lines.append(f'# TYPE {p}_signatures_total counter')
+            lines.append(f'{p}_signatures_total {self.signatures}')
+            lines.append(f'# HELP {p}_rollovers_total Number of regenerations of the LMS tree of a level.')
+            lines.append(f'# TYPE {p}_rollovers_total counter')
+            for level in sorted(self.rollovers):
+                lines.append(f'{p}_rollovers_total{{level="{level}"}} {self.rollovers[level]}')
+            if self.avail_signatures is not None:
+                lines.append(f'# HELP {p}_available_signatures Remaining signatures of the private key.')
+                lines.append(f'# TYPE {p}_available_signatures gauge')
+                lines.append(f'{p}_available_signatures {self.avail_signatures}')
+                lines.append(f'# HELP {p}_level_available_signatures Remaining signatures of the LMS tree of a level.')
+                lines.append(f'# TYPE {p}_level_available_signatures gauge')
+                for level, avail in enumerate(self.avail_signatures_levels):
+                    lines.append(f'{p}_level_available_signatures{{level="{level}"}} {avail}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """Writes the metrics atomically to a file.
+
+        Args:
+            filename (str): name of the file
+        """
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as fout:
+            fout.write(self.render())
+        os.replace(tmp, filename)
+
+    def serve(self, port, address='127.0.0.1'):
+        """Serves the metrics via HTTP in a daemon thread.
+
+        Args:
+            port (int): TCP port, 0 selects a free port
+            address (str, optional): address to bind to, by default localhost
+
+        Returns:
+            http.server.HTTPServer: The server, ``server.shutdown()`` stops it.
+        """
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = HTTPServer((address, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -7,6 +7,12 @@ Created on Sat Jan  1 20:00:55 2022
 """
 import os
 import pickle
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows
+    import msvcrt
+from time import perf_counter
 from .restricted_unpickler import restricted_loads
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
@@ -14,11 +20,13 @@ from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.exceptions import InvalidTag
 from .hss import HSS_Priv
 from .utils import FAILURE
+from .instrumentation import phase
 from . import __version__
 
 
 def kdf(salt, password):
-    return PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=390000).derive(password)
+    with phase('kdf'):
+        return PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=390000).derive(password)
 
 
 class PersHSS_Priv(HSS_Priv):
@@ -30,19 +38,29 @@ class PersHSS_Priv(HSS_Priv):
 
     Args:
         lmstypecodes: List of LMS_ALGORITHM_TYPE
-        otstypecode: LMOTS_ALGORITHM_TYPE
+        otstypecode: LMOTS_ALGORITHM_TYPE, or list of LMOTS_ALGORITHM_TYPE with one type per level
         filename (str): holds the name of the file to store the key
         password (bytes): password to sign and encrypt the file
         frequence (int): frequnce at which the key is stored to a file
+        num_cores (int, None): the number of CPU cores used for key generation, None=all cores
+        progress (callable, None, optional): progress callback of the key generation, see `HSS_Priv`
+        checkpoint (:obj:`hsslms.checkpoint.KeyGenCheckpoint`, None, optional): checkpoint
+            to resume an interrupted key generation, it is removed after the
+            key has been saved the first time
+        deterministic (bool, optional): derive the lower levels from their parent
+            and save only their seeds and counters, see `HSS_Priv`
+        lazy (bool, optional): generate the lower levels by the first signature, see `HSS_Priv`
     """
     FILEHEADER = b'PersHSS_Priv_v\x00' + __version__.encode('utf-8')
-    def __init__(self, lmstypecodes, otstypecode, filename, password, frequence, num_cores):
-        super().__init__(lmstypecodes, otstypecode, num_cores)
+    checkpoint = None  # removed by the first save, not pickled
+    def __init__(self, lmstypecodes, otstypecode, filename, password, frequence, num_cores, progress=None, checkpoint=None, deterministic=False, lazy=False):
+        super().__init__(lmstypecodes, otstypecode, num_cores, progress, checkpoint, deterministic, lazy)
         self.filename = filename
         self.frequence = frequence
         self.sign_count = 0
         self.salt = os.urandom(16);
         self.key = kdf(self.salt, password)
+        self.checkpoint = checkpoint
         
     def sign(self, message):
         """Signs the message with the private key associated with the class.
@@ -60,41 +78,143 @@ class PersHSS_Priv(HSS_Priv):
             bytes: The signature to `message`.
         """
         signature = super().sign(message)
+        self._signed()
+        return signature
+
+    def _sign_batch_root(self, message):
+        signature = super()._sign_batch_root(message)
+        self._signed()
+        return signature
+
+    def sign_into(self, message, buffer, offset=0):
+        """Signs the message into a buffer, see `HSS_Priv.sign_into`.
+        
+        The key is automatically stored to disk after frequnce signatures.
+        
+        Returns:
+            int: The length of the signature.
+        """
+        length = super().sign_into(message, buffer, offset)
+        self._signed()
+        return length
+
+    def sign_many(self, messages, num_cores=None):
+        """Signs several messages, see `HSS_Priv.sign_many`.
+        
+        The key is saved once after all messages have been signed, before the
+        signatures are returned.
+        
+        Returns:
+            :obj:`list` of :obj:`bytes`: The signatures in the order of the messages.
+        """
+        signatures = super().sign_many(messages, num_cores)
+        self.sign_count += len(signatures)
+        self.save()
+        return signatures
+
+    def _signed(self):
         self.sign_count += 1
         if self.sign_count % self.frequence == 0:
             self.save()
-        return signature
         
     def save(self):
         """The key is saved.
         """
-        try:
-            os.rename(self.filename, self.filename + '.bak')
-        except FileNotFoundError:
-            pass
-        data = pickle.dumps(self)
-        aesgcm = AESGCM(self.key)
-        nonce = os.urandom(12)
-        try:
-            with open(self.filename, 'wb') as fout:
-                fout.write(PersHSS_Priv.FILEHEADER)
-                fout.write(self.salt)
-                fout.write(nonce)
-                fout.write(aesgcm.encrypt(nonce, data, PersHSS_Priv.FILEHEADER))
-        except IOError:
-            raise FAILURE("File %s cannot be saved." % self.filename)
-        try:
-            os.remove(self.filename + '.bak')
-        except OSError:
-            pass
+        if self.metrics is not None:
+            start = perf_counter()
+        with phase('save'):
+            try:
+                os.rename(self.filename, self.filename + '.bak')
+            except FileNotFoundError:
+                pass
+            data = pickle.dumps(self)
+            aesgcm = AESGCM(self.key)
+            nonce = os.urandom(12)
+            try:
+                with open(self.filename, 'wb') as fout:
+                    fout.write(PersHSS_Priv.FILEHEADER)
+                    fout.write(self.salt)
+                    fout.write(nonce)
+                    fout.write(aesgcm.encrypt(nonce, data, PersHSS_Priv.FILEHEADER))
+            except IOError:
+                raise FAILURE("File %s cannot be saved." % self.filename)
+            try:
+                os.remove(self.filename + '.bak')
+            except OSError:
+                pass
+            if self.checkpoint is not None:
+                # the key is stored, a key generation must not resume from the checkpoint
+                self.checkpoint.remove()
+                self.checkpoint = None
+        if self.metrics is not None:
+            self.metrics.observe_save(perf_counter() - start)
             
         
+    def split(self, n, filenames=None, num_cores=None):
+        """Splits the key into shards which own disjoint ranges of the top-level leafs.
+        
+        This key is exhausted and saved first, afterwards the shards are saved
+        with the same password. See `HSS_Priv.split`.
+        
+        Args:
+            n (int): number of shards
+            filenames (:obj:`list` of :obj:`str`, None, optional): names of the files
+                of the shards, by default the filename of this key with ".shard<k>" appended
+            num_cores (int, None, optional): the number of CPU cores used for the generation of the lower levels, None=all cores
+        
+        Raises:
+            FAILURE: If the key cannot be split or saved.
+        
+        Returns:
+            :obj:`list` of :obj:`PersHSS_Priv`: The shards.
+        """
+        if filenames is None:
+            filenames = ['%s.shard%d' % (self.filename, k) for k in range(n)]
+        if len(filenames) != n:
+            raise FAILURE("Number of filenames does not match the number of shards.")
+        shards = super().split(n, num_cores)
+        self.save()
+        for shard, filename in zip(shards, filenames):
+            shard.filename = filename
+            shard.sign_count = 0
+            shard.save()
+        return shards
+
+    def split_file(filename, password, n, filenames=None, num_cores=None):
+        """Splits a key file into shards, see `split`.
+        
+        The key file is locked from loading the key until it is saved, so no
+        process can reserve signatures, see `reserve`, which are also owned by
+        the first shard.
+        
+        Args:
+            filename (str): name of the file
+            password (bytes): password of the file
+            n (int): number of shards
+            filenames (:obj:`list` of :obj:`str`, None, optional): names of the files of the shards
+            num_cores (int, None, optional): the number of CPU cores used for the generation of the lower levels, None=all cores
+        
+        Raises:
+            FAILURE: If the key cannot be loaded, split or saved.
+        
+        Returns:
+            :obj:`list` of :obj:`PersHSS_Priv`: The shards.
+        """
+        with _KeyFileLock(filename):
+            sk = PersHSS_Priv.from_file(filename, password)
+            return sk.split(n, filenames, num_cores)
+        
     def from_file(filename, password):
         """A key, HSS_Priv, is loaded from a password-protected file.
         
         Frequnce signatures are skipped to ensure that no private key is used
         more than once.
         
+        The key file is not locked, i.e. the loaded key must not be used for
+        signing while other processes use the same file, e.g. by `reserve` or
+        the command line script. Such processes would sign with the same
+        leafs, use `reserve` or `split_file` instead.
+        
         Args:
             filename (str): name of the file
             password (bytes): password of the file
@@ -105,6 +225,14 @@ class PersHSS_Priv(HSS_Priv):
         Returns:
             HSS_Priv
         """
+        sk = PersHSS_Priv._load(filename, password)
+        # skip next signatures
+        for _ in range(sk.frequence-1):
+            sk.sign(b'')
+        return sk
+    
+    def _load(filename, password, key=None):
+        """Loads the key from the file without skipping signatures, `key` replaces the derivation from `password`."""
         try:
             with open(filename, 'rb') as fin:
                 fh = fin.read(len(PersHSS_Priv.FILEHEADER))
@@ -113,13 +241,15 @@ class PersHSS_Priv(HSS_Priv):
                 salt = fin.read(16)
                 if len(salt) < 16:
                     raise FAILURE("Invalid file.")
-                key = kdf(salt, password)
+                if key is None:
+                    key = kdf(salt, password)
                 aesgcm = AESGCM(key)
                 nonce = fin.read(12)
                 if len(nonce) < 12:
                     raise FAILURE("Invalid file.")
                 data = aesgcm.decrypt(nonce, fin.read(), fh)
-                sk = restricted_loads(data)
+                with phase('unpickle'):
+                    sk = restricted_loads(data)
                 if not type(sk) is PersHSS_Priv:
                     raise FAILURE("Wrong Object Type.")
         except InvalidTag:
@@ -129,10 +259,187 @@ class PersHSS_Priv(HSS_Priv):
         except pickle.PickleError as e:
             print(e)
             raise FAILURE("Cannot load private key.")
-        # skip next signatures
-        for _ in range(sk.frequence-1):
-            sk.sign(b'')
         return sk
+    
+    def reserve(filename, password, count):
+        """Reserves a block of signatures of a key file for this process.
+        
+        The key file is locked only while the block is taken from the key and
+        the key is saved, so several processes can sign with the same key file
+        in parallel. A block never spans two LMS trees of the lowest level, so
+        it may hold less than `count` signatures. If the lowest level is
+        exhausted, the rollover is done while the lock is held.
+        
+        Like `from_file`, frequence-1 signatures are skipped first, since a
+        process which has loaded the key by `from_file` may have used them
+        without saving the key. Afterwards the key is saved with frequence 1.
+        
+        Args:
+            filename (str): name of the file
+            password (bytes): password of the file
+            count (int): number of signatures to reserve
+        
+        Raises:
+            FAILURE: If the key cannot be loaded or saved, or is exhausted.
+        
+        Returns:
+            Reservation: The reserved signatures.
+        """
+        if count < 1:
+            raise FAILURE("At least one signature must be reserved.")
+        with _KeyFileLock(filename):
+            sk = PersHSS_Priv._load(filename, password)
+            for _ in range(sk.frequence-1):
+                sk._rollover()
+                sk.priv[-1].q += 1
+                sk.avail_signatures -= 1
+            sk.frequence = 1
+            sk._rollover()
+            bottom = sk.priv[-1]
+            start, end = bottom.q, min(bottom.q + count, bottom.q_end)
+            bottom.q = end
+            sk.avail_signatures -= end - start
+            sk.save()
+        bottom.q, bottom.q_end = start, end
+        # the reservation must not roll over to leafs of the upper levels
+        for priv in sk.priv[:-1]:
+            priv.q = priv.q_end
+        sk.avail_signatures = end - start
+        return Reservation(sk)
+
+
+class _KeyFileLock:
+    """Advisory lock of a key file.
+    
+    The lock is held on the separate file "<filename>.lock", since the key file
+    itself is replaced whenever the key is saved.
+    """
+    def __init__(self, filename):
+        self.filename = filename + '.lock'
+        self.fd = None
+        
+    def __enter__(self):
+        try:
+            self.fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o600)
+            if msvcrt is not None:
+                while True:
+                    try:
+                        msvcrt.locking(self.fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:  # LK_LOCK gives up after 10 seconds
+                        pass
+            else:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except OSError:
+            if self.fd is not None:
+                os.close(self.fd)
+            raise FAILURE("File %s cannot be locked." % self.filename)
+        return self
+    
+    def __exit__(self, *exc):
+        if msvcrt is not None:
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+        return False
+
+
+class Reservation:
+    """A block of signatures reserved from a key file by `PersHSS_Priv.reserve`.
+    
+    The signatures are generated without access to the key file. Unused
+    signatures are given back by `release`, which is called at the end of a
+    with statement. They are only given back if no other process has reserved
+    signatures of the same LMS tree in the meantime, otherwise they are lost.
+    
+    Args:
+        sk (PersHSS_Priv): the key restricted to the reserved signatures
+    """
+    def __init__(self, sk):
+        self.sk = sk
+        self.signature_length = sk.get_signature_length()
+        
+    def sign(self, message):
+        """Signs the message with the next reserved signature.
+        
+        Args:
+            message (bytes, BufferedReader): Message to be signed
+        
+        Raises:
+            FAILURE: If the reserved signatures are exhausted or released.
+        
+        Returns:
+            bytes: The signature to `message`.
+        """
+        if self.sk is None:
+            raise FAILURE("Reservation has been released.")
+        return HSS_Priv.sign(self.sk, message)
+
+    def sign_into(self, message, buffer, offset=0):
+        """Signs the message into a buffer with the next reserved signature, see `HSS_Priv.sign_into`.
+        
+        Raises:
+            FAILURE: If the reserved signatures are exhausted or released.
+        
+        Returns:
+            int: The length of the signature.
+        """
+        if self.sk is None:
+            raise FAILURE("Reservation has been released.")
+        return HSS_Priv.sign_into(self.sk, message, buffer, offset)
+
+    def sign_many(self, messages, num_cores=None):
+        """Signs several messages with the next reserved signatures, see `HSS_Priv.sign_many`.
+        
+        Raises:
+            FAILURE: If not enough reserved signatures are left or they are released.
+        
+        Returns:
+            :obj:`list` of :obj:`bytes`: The signatures in the order of the messages.
+        """
+        if self.sk is None:
+            raise FAILURE("Reservation has been released.")
+        return HSS_Priv.sign_many(self.sk, messages, num_cores)
+
+    def get_signature_length(self):
+        """Returns the length of a signature in bytes."""
+        return self.signature_length
+    
+    def get_avail_signatures(self):
+        """Returns the number of reserved signatures which are left."""
+        if self.sk is None:
+            return 0
+        return self.sk.priv[-1].get_avail_signatures()
+    
+    def release(self):
+        """Gives the unused signatures back to the key file if possible.
+        
+        Raises:
+            FAILURE: If the key file cannot be loaded or saved.
+        """
+        if self.sk is None:
+            return
+        bottom = self.sk.priv[-1]
+        unused = bottom.q_end - bottom.q
+        if unused > 0:
+            with _KeyFileLock(self.sk.filename):
+                sk = PersHSS_Priv._load(self.sk.filename, None, self.sk.key)
+                persisted = sk.priv[-1]
+                if persisted.I == bottom.I and persisted.q == bottom.q_end:
+                    persisted.q = bottom.q
+                    sk.avail_signatures += unused
+                    sk.save()
+        self.sk = None
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.release()
+        return False
 
 
 
@@ -12,7 +12,7 @@ class RestrictedUnpickler(pickle.Unpickler):
     def find_class(self, module, name):
         safe_hsslms_pershss = ('PersHSS_Priv', )
         safe_hsslms_hss = ('HSS_Priv', )
-        safe_hsslms_utils = ('LMS_ALGORITHM_TYPE', 'LMOTS_ALGORITHM_TYPE')
+        safe_hsslms_utils = ('LMS_ALGORITHM_TYPE', 'LMOTS_ALGORITHM_TYPE', 'shake256')
         safe_hsslms_lms = ('LMS_Priv', 'LMS_Pub')
         safe_hsslms_lmots = ('LM_OTS_Priv', )
         if module == 'hsslms.pershss' and name in safe_hsslms_pershss:
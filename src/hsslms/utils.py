@@ -6,7 +6,7 @@ Created on Sat Jan  1 11:48:07 2022
 @author: mvr
 """
 from enum import Enum
-from hashlib import sha256
+from hashlib import sha256, shake_256
 
 class INVALID(Exception):
     """Exception for an invalid signature."""
@@ -39,6 +39,38 @@ D_PBLC = u16str(0x8080)
 D_MESG = u16str(0x8181)
 D_LEAF = u16str(0x8282)
 D_INTR = u16str(0x8383)
+# pseudorandom derivation of child keys, the indices are never used by LM-OTS (p < 0xfffe)
+D_CHILD_SEED = u16str(0xfffe)
+D_CHILD_I = u16str(0xffff)
+# Merkle trees of batch signatures
+D_BATCH_LEAF = u16str(0x8484)
+D_BATCH_INTR = u16str(0x8585)
+D_BATCH_ROOT = u16str(0x8686)
+
+
+class _SHAKE256:
+    """SHAKE256 with the interface of hashlib.sha256, the digest has 32 bytes."""
+    __slots__ = ('_h',)
+    name = 'shake_256'
+    block_size = 136
+    
+    def __init__(self, data=b''):
+        self._h = shake_256(data)
+        
+    def update(self, data):
+        self._h.update(data)
+        
+    def digest(self):
+        return self._h.digest(32)
+
+
+def shake256(data=b''):
+    """SHAKE256 as used by the parameter sets of NIST SP 800-208.
+    
+    The output with 24 bytes is the prefix of the output with 32 bytes, so
+    the digest is truncated like the one of SHA-256/192.
+    """
+    return _SHAKE256(data)
 
 
 class LMOTS_ALGORITHM_TYPE(Enum):
@@ -60,9 +92,22 @@ class LMOTS_ALGORITHM_TYPE(Enum):
     LMOTS_SHA256_N24_W2  = 6
     LMOTS_SHA256_N24_W4  = 7
     LMOTS_SHA256_N24_W8  = 8
+    
+    # NIST SP 800-208
+    LMOTS_SHAKE_N32_W1  = 9
+    LMOTS_SHAKE_N32_W2  = 10
+    LMOTS_SHAKE_N32_W4  = 11
+    LMOTS_SHAKE_N32_W8  = 12
+    
+    LMOTS_SHAKE_N24_W1  = 13
+    LMOTS_SHAKE_N24_W2  = 14
+    LMOTS_SHAKE_N24_W4  = 15
+    LMOTS_SHAKE_N24_W8  = 16
 
     @property
     def H(self):
+        if 'SHAKE' in self.name:
+            return shake256
         return sha256
     @property
     def n(self):
@@ -72,13 +117,13 @@ class LMOTS_ALGORITHM_TYPE(Enum):
             return 24
     @property
     def w(self):
-        return {1:1, 2:2, 3:4, 4:8, 5:1, 6:2, 7:4, 8:8}[self.value]
+        return {1:1, 2:2, 3:4, 0:8}[self.value % 4]
     @property
     def p(self):
-        return {1:265, 2:133, 3:67, 4:34, 5:200, 6:101, 7:51, 8:26}[self.value]
+        return {(32, 1):265, (32, 2):133, (32, 4):67, (32, 8):34, (24, 1):200, (24, 2):101, (24, 4):51, (24, 8):26}[self.n, self.w]
     @property
     def ls(self):
-        return {1:7, 2:6, 3:4, 4:0, 5:8, 6:6, 7:4, 8:0}[self.value]
+        return {(32, 1):7, (32, 2):6, (32, 4):4, (32, 8):0, (24, 1):8, (24, 2):6, (24, 4):4, (24, 8):0}[self.n, self.w]
 
 
 class LMS_ALGORITHM_TYPE(Enum):
@@ -100,9 +145,24 @@ class LMS_ALGORITHM_TYPE(Enum):
     LMS_SHA256_M24_H15 = 12
     LMS_SHA256_M24_H20 = 13
     LMS_SHA256_M24_H25 = 14
+    
+    # NIST SP 800-208
+    LMS_SHAKE_M32_H5 = 15
+    LMS_SHAKE_M32_H10 = 16
+    LMS_SHAKE_M32_H15 = 17
+    LMS_SHAKE_M32_H20 = 18
+    LMS_SHAKE_M32_H25 = 19
+    
+    LMS_SHAKE_M24_H5 = 20
+    LMS_SHAKE_M24_H10 = 21
+    LMS_SHAKE_M24_H15 = 22
+    LMS_SHAKE_M24_H20 = 23
+    LMS_SHAKE_M24_H25 = 24
 
     @property
     def H(self):
+        if 'SHAKE' in self.name:
+            return shake256
         return sha256
 
     @property
@@ -113,4 +173,4 @@ class LMS_ALGORITHM_TYPE(Enum):
             return 24
     @property
     def h(self):
-        return {5:5, 6:10, 7:15, 8:20, 9:25, 10:5, 11:10, 12:15, 13:20, 14:25}[self.value]
+        return 5 * ((self.value - 5) % 5 + 1)
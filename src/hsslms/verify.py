@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Verification of signatures
+
+A lightweight entry point for applications which only verify signatures,
+e.g. short-lived processes. It imports the parsing and verification code of
+HSS, LMS and LM-OTS, but neither ``multiprocessing`` nor ``cryptography``.
+
+Example:
+    Verification of a HSS signature::
+
+        from hsslms.verify import verify
+
+        if not verify(pubkey, message, signature):
+            print("Invalid signature.")
+"""
+from .utils import INVALID
+from .utils import LMOTS_ALGORITHM_TYPE, LMS_ALGORITHM_TYPE
+from .lmots import LM_OTS_Pub
+from .lms import LMS_Pub
+from .hss import HSS_Pub
+from .verifycache import VerificationCache
+
+__all__ = ['INVALID', 'LMOTS_ALGORITHM_TYPE', 'LMS_ALGORITHM_TYPE', 'LM_OTS_Pub', 'LMS_Pub', 'HSS_Pub', 'VerificationCache', 'verify']
+
+
+def verify(pubkey, message, signature, cache=None):
+    """Verifies a HSS signature.
+
+    Args:
+        pubkey (bytes, HSS_Pub): the HSS public key
+        message (bytes): the message
+        signature (bytes): the signature of the message
+        cache (VerificationCache, None, optional): cache of verification results, see `hsslms.verifycache`
+
+    Returns:
+        bool: True if the signature is valid, otherwise False.
+    """
+    try:
+        if not isinstance(pubkey, HSS_Pub):
+            pubkey = HSS_Pub(pubkey)
+        if cache is not None:
+            pubkey.set_verification_cache(cache)
+        pubkey.verify(message, signature)
+    except INVALID:
+        return False
+    return True
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Cache of verification results
+
+Repeated verifications of the same signature of the same message, e.g. of
+unchanged artifacts in a CI pipeline, can be answered from a cache. A cache
+entry is the HMAC-SHA-256 of the public key, the SHA-256 hash of the message
+and the SHA-256 hash of the signature. Only valid signatures are stored, a cache
+hit costs one hash pass over the message instead of a verification.
+
+The entries are kept in memory, the least recently used entry is dropped. With
+a filename they are additionally stored in a SQLite database, which is shared by
+all processes using the same file.
+
+A cache hit is trusted without verification. The entries of a database are
+therefore keyed with a local secret, which is stored with the permissions 0600
+in the file `<filename>.key` unless it is passed explicitly. Whoever can write
+the secret, or can read it and write the database, can make `verify` accept
+forged signatures. The database and its secret must only be writable by the
+users who are trusted to verify.
+
+Example:
+    Verification of artifacts with a persistent cache::
+
+        from hsslms.verifycache import VerificationCache
+
+        with VerificationCache('verify.db') as cache:
+            vk.set_verification_cache(cache)
+            vk.verify(open('artifact.tar', 'rb'), signature)
+"""
+import io
+import os
+import hmac
+from hashlib import sha256
+from .utils import FAILURE
+from .utils import u32str
+
+
+CHUNK_SIZE = 1024**2
+
+
+def digest_message(message):
+    """Computes the SHA-256 hash of a message, a file is read in chunks.
+
+    Args:
+        message (bytes, BufferedReader): the message
+
+    Raises:
+        FAILURE: If the message cannot be read.
+
+    Returns:
+        tuple: The hash of the message and the message for the verification,
+        i.e. the file rewound to its start or the read bytes if the file is not
+        seekable.
+    """
+    if type(message) is bytes:
+        return sha256(message).digest(), message
+    if type(message) is not io.BufferedReader:
+        raise FAILURE("Invalid message type.")
+    h = sha256()
+    try:
+        seekable = message.seekable()
+        start = message.tell() if seekable else None
+        chunks = []
+        while True:
+            chunk = message.read(CHUNK_SIZE)
+            h.update(chunk)
+            if not seekable:
+                chunks.append(chunk)
+            if len(chunk) < CHUNK_SIZE:
+                break
+        if seekable:
+            message.seek(start)
+        else:
+            message = b''.join(chunks)
+    except IOError:
+        raise FAILURE("Error. Cannot read message.")
+    return h.digest(), message
+
+
+def _load_secret(filename):
+    try:
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        raise FAILURE("Secret %s cannot be created: %s" % (filename, e))
+    else:
+        with os.fdopen(fd, 'wb') as fout:
+            fout.write(os.urandom(32))
+    try:
+        with open(filename, 'rb') as fin:
+            secret = fin.read()
+    except OSError as e:
+        raise FAILURE("Secret %s cannot be read: %s" % (filename, e))
+    if len(secret) != 32:
+        raise FAILURE("Secret %s is corrupted." % filename)
+    return secret
+
+
+class VerificationCache:
+    """A class used to hold the results of verifications.
+
+    Args:
+        filename (str, None, optional): name of the SQLite database, None=memory only
+        max_entries (int, optional): maximal number of entries in memory
+        max_disk_entries (int, optional): maximal number of entries in the database
+        secret (bytes, None, optional): secret of the entries, None=the secret
+            stored in `<filename>.key`, which is created if needed, or a random
+            secret without database
+
+    Raises:
+        FAILURE: If the database or its secret cannot be opened.
+    """
+    def __init__(self, filename=None, max_entries=2**16, max_disk_entries=2**20, secret=None):
+        if secret is None:
+            secret = os.urandom(32) if filename is None else _load_secret(filename + '.key')
+        self.secret = secret
+        self.entries = {}  # in the order of their last use
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.db = None
+        if filename is not None:
+            import sqlite3  # only needed for the persistent cache
+            self._dberror = sqlite3.Error
+            try:
+                self.db = sqlite3.connect(filename, timeout=30)
+                self.db.execute('CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, used INTEGER NOT NULL)')
+                self.db.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+                self.db.commit()
+                self.disk_entries = self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            except sqlite3.Error as e:
+                raise FAILURE("Cache %s cannot be opened: %s" % (filename, e))
+
+    def key(self, pubkey, message_digest, signature):
+        """Returns the key of an entry, which is authenticated by the secret of the cache.
+
+        Args:
+            pubkey (bytes): the public key
+            message_digest (bytes): hash of the message as returned by `digest_message`
+            signature (bytes): the signature
+        """
+        return hmac.new(self.secret, u32str(len(pubkey)) + pubkey + message_digest + sha256(signature).digest(), sha256).digest()
+
+    def _touch(self, key):
+        self.entries.pop(key, None)
+        if len(self.entries) >= self.max_entries:
+            self.entries.pop(next(iter(self.entries)))
+        self.entries[key] = True
+
+    def _execute(self, *args):
+        try:
+            with self.db:
+                return self.db.execute(*args)
+        except self._dberror as e:
+            raise FAILURE("Cache cannot be accessed: %s" % e)
+
+    def __contains__(self, key):
+        if key in self.entries:
+            self._touch(key)
+            return True
+        if self.db is None:
+            return False
+        if self._execute('UPDATE entries SET used = (SELECT COALESCE(MAX(used), 0) + 1 FROM entries) WHERE key = ?', (key,)).rowcount == 0:
+            return False
+        self._touch(key)
+        return True
+
+    def add(self, key):
+        """Adds the key of a valid signature."""
+        self._touch(key)
+        if self.db is None:
+            return
+        self._execute('INSERT OR REPLACE INTO entries VALUES (?, (SELECT COALESCE(MAX(used), 0) + 1 FROM entries))', (key,))
+        self.disk_entries += 1
+        if self.disk_entries > self.max_disk_entries:
+            # the count is only an estimate if several processes share the database
+            self._execute('DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_disk_entries,))
+            self.disk_entries = self._execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def __len__(self):
+        if self.db is None:
+            return len(self.entries)
+        return self._execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def clear(self):
+        """Removes all entries."""
+        self.entries = {}
+        if self.db is not None:
+            self._execute('DELETE FROM entries')
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load generator of hsslms.
+
+Several clients sign and verify messages concurrently, at a fixed total rate
+or as fast as possible, against one key. The latencies are collected per
+operation and the throughput, the percentiles (p50, p99, max) and a histogram
+are printed and can be written to a JSON file, e.g.::
+
+    python3 loadtest.py --target library --clients 4 --rate 50 --operations 500
+    python3 loadtest.py --target cli --clients 2 --operation both --out cli.json
+
+The clients are threads of this process. The targets are:
+
+  * library: one ``HSS_Priv`` in memory, which is shared by all clients and
+    guarded by a lock
+  * persistent: one ``PersHSS_Priv`` key file, every client reserves blocks of
+    signatures with ``PersHSS_Priv.reserve``, which loads and saves the key
+  * cli: every operation runs the command line script ``hsslms`` in a new
+    process, i.e. every signature loads, locks and saves the key file
+
+With a fixed rate every client follows its own schedule, the latency is
+measured from the scheduled start, so waiting for a busy key is included. The
+defaults use two levels of height 5, such that the lowest level rolls over
+every 32 signatures. A signature whose upper levels differ from all earlier
+signatures is annotated as rollover, signatures of the persistent target
+which reserved a new block are annotated as reserve.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+import hsslms
+from hsslms import LMOTS_ALGORITHM_TYPE, LMS_ALGORITHM_TYPE, HSS_Priv, PersHSS_Priv, FAILURE
+from hsslms.bundle import split_signature
+
+TARGETS = ('library', 'persistent', 'cli')
+OPERATIONS = ('sign', 'verify', 'both')
+PASSWORD = b'loadtest'
+
+
+class LibraryTarget:
+    """All clients share one key in memory."""
+    def __init__(self, args, tmpdir):
+        self.sk = HSS_Priv(args.lms, args.lmots, args.cores)
+        self.vk = self.sk.gen_pub()
+        self.lock = threading.Lock()
+
+    def client(self, i):
+        return self
+
+    def sign(self, message):
+        with self.lock:
+            return self.sk.sign(message), []
+
+    def verify(self, message, signature):
+        self.vk.verify(message, signature)
+
+    def close(self):
+        pass
+
+
+class PersistentTarget:
+    """All clients reserve signatures of one key file."""
+    def __init__(self, args, tmpdir):
+        self.filename = os.path.join(tmpdir, 'key')
+        sk = PersHSS_Priv(args.lms, args.lmots, self.filename, PASSWORD, 1, args.cores)
+        sk.save()
+        self.vk = sk.gen_pub()
+        self.reserve = args.reserve
+
+    def client(self, i):
+        return PersistentClient(self)
+
+    def verify(self, message, signature):
+        self.vk.verify(message, signature)
+
+
+class PersistentClient:
+    def __init__(self, target):
+        self.target = target
+        self.reservation = None
+
+    def sign(self, message):
+        notes = []
+        if self.reservation is None or self.reservation.get_avail_signatures() == 0:
+            self.reservation = PersHSS_Priv.reserve(self.target.filename, PASSWORD, self.target.reserve)
+            notes.append('reserve')
+        return self.reservation.sign(message), notes
+
+    def verify(self, message, signature):
+        self.target.verify(message, signature)
+
+    def close(self):
+        """Gives the unused signatures of the reservation back to the key file."""
+        if self.reservation is not None:
+            self.reservation.release()
+            self.reservation = None
+
+
+class CliTarget:
+    """Every operation runs the command line script."""
+    def __init__(self, args, tmpdir):
+        self.tmpdir = tmpdir
+        self.key = os.path.join(tmpdir, 'key')
+        self.cmd = [sys.executable, '-m', 'hsslms']
+        self._run(['key-gen', '--lmots', args.lmots.name, '--lms'] + [t.name for t in args.lms] + ['-o', self.key, '-p', PASSWORD.decode(), '-c', str(args.cores)])
+
+    def _run(self, cmd):
+        ret = subprocess.run(self.cmd + cmd, capture_output=True)
+        if ret.returncode != 0:
+            raise FAILURE(ret.stderr.decode().strip())
+
+    def client(self, i):
+        return CliClient(self, i)
+
+
+class CliClient:
+    def __init__(self, target, i):
+        self.target = target
+        self.message = os.path.join(target.tmpdir, 'message%d' % i)
+        self.signature = os.path.join(target.tmpdir, 'signature%d' % i)
+
+    def _write(self, message, signature=None):
+        with open(self.message, 'wb') as fout:
+            fout.write(message)
+        if os.path.exists(self.signature):
+            os.remove(self.signature)
+        if signature is not None:
+            with open(self.signature, 'wb') as fout:
+                fout.write(signature)
+
+    def sign(self, message):
+        self._write(message)
+        self.target._run(['sign', '-k', self.target.key, '-m', self.message, '-s', self.signature, '-p', PASSWORD.decode()])
+        with open(self.signature, 'rb') as fin:
+            return fin.read(), []
+
+    def verify(self, message, signature):
+        self._write(message, signature)
+        self.target._run(['verify', '-k', self.target.key + '.pub', '-m', self.message, '-s', self.signature])
+
+    def close(self):
+        pass
+
+
+class LoadGenerator:
+    """Runs the clients and collects the samples.
+
+    A sample is a dict with the operation, the client, the scheduled start and
+    the end relative to the start of the run in seconds, the latency, the
+    annotations and for signatures the prefix of the upper levels.
+    """
+    def __init__(self, target, args):
+        self.target = target
+        self.args = args
+        self.samples = []
+        self.errors = []
+        self.lock = threading.Lock()
+        self.issued = 0
+        self.signatures = []  # pairs of message and signature verified by the operation verify
+
+    def _next(self):
+        with self.lock:
+            if self.issued >= self.args.operations:
+                return None
+            self.issued += 1
+            return self.issued - 1
+
+    def _record(self, op, i, scheduled, start, end, notes, signature=None):
+        sample = {
+            'op': op,
+            'client': i,
+            'start': scheduled - self.t0,
+            'end': end - self.t0,
+            'latency': end - scheduled,
+            'service': end - start,
+            'notes': notes,
+        }
+        if signature is not None:
+            sample['prefix'] = split_signature(signature)[0]
+        with self.lock:
+            self.samples.append(sample)
+
+    def _client(self, i):
+        args = self.args
+        client = self.target.client(i)
+        interval = args.clients / args.rate if args.rate > 0 else 0.0
+        k = 0
+        try:
+            while True:
+                scheduled = self.t0 + (k + i / args.clients) * interval
+                k += 1
+                now = time.perf_counter()
+                if now - self.t0 > args.duration:
+                    break
+                if scheduled > now:
+                    time.sleep(scheduled - now)
+                else:
+                    scheduled = now if interval == 0 else scheduled
+                n = self._next()
+                if n is None:
+                    break
+                message = b'message %d' % n
+                try:
+                    if args.operation in ('sign', 'both'):
+                        start = time.perf_counter()
+                        signature, notes = client.sign(message)
+                        end = time.perf_counter()
+                        self._record('sign', i, min(scheduled, start), start, end, notes, signature)
+                        if args.operation == 'both':
+                            start = time.perf_counter()
+                            client.verify(message, signature)
+                            self._record('verify', i, start, start, time.perf_counter(), [])
+                    else:
+                        message, signature = self.signatures[n % len(self.signatures)]
+                        start = time.perf_counter()
+                        client.verify(message, signature)
+                        self._record('verify', i, min(scheduled, start), start, time.perf_counter(), [])
+                except Exception as e:  # e.g. the key is exhausted
+                    with self.lock:
+                        self.errors.append('client %d: %s' % (i, e))
+                        self.issued = args.operations
+                    break
+        finally:
+            client.close()
+
+    def run(self):
+        if self.args.operation == 'verify':
+            client = self.target.client(0)
+            try:
+                for n in range(16):
+                    message = b'message %d' % n
+                    self.signatures.append((message, client.sign(message)[0]))
+            finally:
+                client.close()
+        self.t0 = time.perf_counter()
+        threads = [threading.Thread(target=self._client, args=(i,)) for i in range(self.args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - self.t0
+        annotate_rollovers(self.samples)
+        return self.samples
+
+
+def annotate_rollovers(samples):
+    """Annotates the first signature of every new prefix, except the first prefix, as rollover."""
+    seen = None
+    for sample in sorted((s for s in samples if 'prefix' in s), key=lambda s: s['end']):
+        if seen is None:
+            seen = {sample['prefix']}
+        elif sample['prefix'] not in seen:
+            seen.add(sample['prefix'])
+            sample['notes'].append('rollover')
+
+
+def percentile(s, p):
+    """Returns the percentile `p` of the sorted list `s` (nearest rank)."""
+    return s[max(0, min(len(s) - 1, -(-len(s) * p // 100) - 1))]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(s['latency'] for s in samples)
+    return {
+        'n': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1],
+        'mean_service': sum(s['service'] for s in samples) / len(samples),
+    }
+
+
+def histogram(samples, buckets=None):
+    """Counts the latencies per bucket, the upper bounds double from 1 ms."""
+    if buckets is None:
+        buckets = [0.001 * 2**k for k in range(20)]
+    counts = [0] * len(buckets)
+    for s in samples:
+        k = next((k for k, bound in enumerate(buckets) if s['latency'] <= bound), len(buckets) - 1)
+        counts[k] += 1
+    while len(counts) > 1 and counts[-1] == 0:
+        counts.pop()
+        buckets = buckets[:-1]
+    return list(zip(buckets, counts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator of hsslms')
+    parser.add_argument('--target', choices=TARGETS, default='library', help='interface under load (default: library)')
+    parser.add_argument('--operation', choices=OPERATIONS, default='sign', help='sign, verify pre-computed signatures, or verify every new signature (default: sign)')
+    parser.add_argument('--clients', '-n', type=int, default=4, help='number of concurrent clients (default=4)')
+    parser.add_argument('--rate', '-r', type=float, default=0, help='total operations per second, 0 means as fast as possible (default=0)')
+    parser.add_argument('--operations', type=int, default=200, help='total number of operations (default=200)')
+    parser.add_argument('--duration', type=float, default=600, help='maximal duration of the run in seconds (default=600)')
+    parser.add_argument('--lms', nargs='+', choices=[t.name for t in LMS_ALGORITHM_TYPE], default=['LMS_SHA256_M32_H5']*2, help='lms parameter sets of the levels')
+    parser.add_argument('--lmots', choices=[t.name for t in LMOTS_ALGORITHM_TYPE], default='LMOTS_SHA256_N32_W4', help='lmots parameter set')
+    parser.add_argument('--cores', '-c', type=int, default=1, help='number of cpu cores of the key generation (default=1)')
+    parser.add_argument('--reserve', type=int, default=8, help='signatures reserved at once by the clients of the persistent target (default=8)')
+    parser.add_argument('--out', '-o', help='filename of the JSON results')
+    args = parser.parse_args()
+    args.lms = [LMS_ALGORITHM_TYPE[t] for t in args.lms]
+    args.lmots = LMOTS_ALGORITHM_TYPE[args.lmots]
+    if args.clients < 1:
+        parser.error('at least one client is required')
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        target = {'library': LibraryTarget, 'persistent': PersistentTarget, 'cli': CliTarget}[args.target](args, tmpdir)
+        generator = LoadGenerator(target, args)
+        samples = generator.run()
+
+    print('target %s, %d clients, %s, %d operations in %.2f s' % (args.target, args.clients, 'rate %g/s' % args.rate if args.rate > 0 else 'closed loop', len(samples), generator.elapsed))
+    for error in generator.errors:
+        print('stopped: %s' % error)
+    results = {}
+    print("%-8s %8s %12s %10s %10s %10s" % ('Op', 'n', 'ops/s', 'p50[s]', 'p99[s]', 'max[s]'))
+    for op in ('sign', 'verify'):
+        op_samples = [s for s in samples if s['op'] == op]
+        if len(op_samples) == 0:
+            continue
+        stats = results[op] = summarize(op_samples, generator.elapsed)
+        stats['histogram'] = histogram(op_samples)
+        print("%-8s %8d %12.1f %10.4f %10.4f %10.4f" % (op, stats['n'], stats['throughput'], stats['p50'], stats['p99'], stats['max']))
+    for op, stats in results.items():
+        print()
+        print('latency histogram of %s' % op)
+        width = max(count for _, count in stats['histogram'])
+        for bound, count in stats['histogram']:
+            print('  <= %10.3f ms %6d %s' % (1000 * bound, count, '#' * (50 * count // width)))
+    events = [s for s in samples if s['notes']]
+    if len(events) > 0:
+        print()
+        print("%-10s %8s %10s %s" % ('Time[s]', 'Client', 'Latency[s]', 'Events'))
+        for s in sorted(events, key=lambda s: s['start']):
+            print("%-10.3f %8d %10.4f %s" % (s['start'], s['client'], s['latency'], ', '.join(s['notes'])))
+
+    if args.out is not None:
+        meta = {
+            'hsslms': hsslms.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'date': datetime.now(timezone.utc).isoformat(),
+            'argv': sys.argv[1:],
+        }
+        for s in samples:
+            s.pop('prefix', None)
+        with open(args.out, 'w') as fout:
+            json.dump({'meta': meta, 'results': results, 'errors': generator.errors, 'samples': samples}, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
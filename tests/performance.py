@@ -6,67 +6,376 @@ Created on Thu Dec 23 09:14:46 2021
 @author: mvr
 
 https://www.rfc-editor.org/rfc/rfc8554.html
-"""
 
+Benchmark suite of hsslms.
+
+Every benchmark is repeated several times and timed with ``time.perf_counter``,
+the distribution of the timings (min, median, mean, p90, max) is printed and
+can be written to a JSON file. Two JSON files can be compared to flag
+regressions, e.g.::
+
+    python3 performance.py --out base.json
+    python3 performance.py --out new.json --compare base.json --threshold 0.1
+
+The benchmarks are grouped into suites:
+
+  * keygen: key generation per (LMS, LMOTS) parameter set and number of cores
+  * sign: latency of HSS signature generation, rollover signatures are
+    recorded separately
+  * verify: latency of HSS signature verification, sequential and with the
+    levels verified concurrently by a pool (``HSS_Pub.verify_parallel``)
+  * persist: saving and loading of ``PersHSS_Priv`` (including the KDF)
+  * cli: end-to-end runs of the command line script ``hsslms``
+  * import: time to import the verify-only module ``hsslms.verify``, the
+    package and the persistent keys, every import runs in a fresh process
+  * memory: peak RSS and ``tracemalloc`` peaks of key generation, saving and
+    loading per tree height, every measurement runs in a fresh process
+  * scaling: speedup of the key generation over 1..N cores
+
+The suites memory and scaling are slow and have to be selected explicitly,
+e.g.::
+
+    python3 performance.py --suite memory scaling --out mem.json
+"""
+import os
+import gc
+import sys
+import json
 import time
-from hsslms import LMOTS_ALGORITHM_TYPE, HSS_Priv, LMS_ALGORITHM_TYPE
-
-def perf_keygen(lmstypecodes, otstypecode, num_cores):
-    start = time.time()
-    _ = HSS_Priv(lmstypecodes, otstypecode, num_cores)
-    return time.time() - start
-    
-
-# Testing Performance of HSS
-num_cores = 6
-for lmots_alg in LMOTS_ALGORITHM_TYPE:
-    w = lmots_alg.w
-    print("Performance of HSS-LMS with w=%d:" % w)
-    print("--------------------------------")
-    
-    print("  Performance of Key Generation:")
-    print("           %10s %15s" %('Time[s]', '#Signatures'))
-    
-    duration = perf_keygen([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5], lmots_alg, num_cores)
-    print("      H5: %11.2f %15d" % (duration, 2**5))
-    duration = perf_keygen([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H10], lmots_alg, num_cores)
-    print("      H10: %10.2f %15d" % (duration, 2**10))
-    duration = perf_keygen([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H15], lmots_alg, num_cores)
-    print("      H15: %10.2f %15d" % (duration, 2**15))
-    duration = perf_keygen([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H20], lmots_alg, num_cores)
-    print("      H20: %10.2f %15d" % (duration, 2**20))
-    duration = perf_keygen([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H10,LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H10], lmots_alg, num_cores)
-    print("  H10/H10: %10.2f %15d" % (duration, 2**10 * 2**10))
-    duration = perf_keygen([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H10,LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H15], lmots_alg, num_cores)
-    print("  H10/H15: %10.2f %15d" % (duration, 2**10 * 2**15))
-    duration = perf_keygen([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H15,LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H15], lmots_alg, num_cores)
-    print("  H15/H15: %10.2f %15d" % (duration, 2**15 * 2**15))
-    
-    print()
-    print("  Performance of Signature Generation:")
-    print("           %10s" % 'Time[s]')
-    sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H15], lmots_alg, num_cores)
-    duration = 0.0
-    for _ in range(100):
-        start = time.time()
-        _ = sk.sign(b'abc')
-        duration += time.time() - start
-    duration /= 100
-    print("      H15: %10.3f" % duration)
-    
-    print()
-    print("  Performance of Signature Verification:")
-    print("           %10s" % 'Time[s]')
-    sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H15], lmots_alg, num_cores)
-    vk = sk.gen_pub()
-    duration = 0.0
-    for _ in range(100):
-        signature = sk.sign(b'abc')
-        start = time.time()
-        vk.verify(b'abc', signature)
-        duration += time.time() - start
-    duration /= 100
-    print("      H15: %10.3f" % duration)
-    print()
-    print()
-    
\ No newline at end of file
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import multiprocessing
+from datetime import datetime, timezone
+import hsslms
+from hsslms import LMOTS_ALGORITHM_TYPE, LMS_ALGORITHM_TYPE, HSS_Priv, PersHSS_Priv
+from hsslms.advisor import compatible
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+SUITES = ('keygen', 'sign', 'verify', 'persist', 'cli', 'import', 'memory', 'scaling')
+DEFAULT_SUITES = ('keygen', 'sign', 'verify', 'persist', 'cli', 'import')
+IMPORT_MODULES = ('hsslms.verify', 'hsslms', 'hsslms.pershss')
+
+
+def parameter_sets(lmstypes, lmotstypes):
+    """Yields all pairs of compatible LMS and LMOTS types."""
+    for lmstype in lmstypes:
+        for lmotstype in lmotstypes:
+            if compatible(lmstype, lmotstype):
+                yield lmstype, lmotstype
+
+
+def summarize(samples):
+    """Computes the statistics of a list of timings in seconds."""
+    s = sorted(samples)
+    return {
+        'n': len(s),
+        'min': s[0],
+        'median': statistics.median(s),
+        'mean': statistics.mean(s),
+        'p90': s[min(len(s)-1, (9*len(s)) // 10)],
+        'max': s[-1],
+        'stdev': statistics.stdev(s) if len(s) > 1 else 0.0,
+    }
+
+
+def timeit(func, repeat, warmup=0):
+    """Calls `func` `warmup`+`repeat` times and returns the timings of the last `repeat` calls."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_keygen(args, results):
+    for lmstype, lmotstype in parameter_sets(args.lms, args.lmots):
+        for num_cores in args.cores:
+            samples = timeit(lambda: HSS_Priv([lmstype], lmotstype, num_cores), args.repeat)
+            results['keygen/%s/%s/c%d' % (lmstype.name, lmotstype.name, num_cores)] = summarize(samples)
+
+
+def bench_sign_verify(args, results, suites):
+    # two levels of the first tree, such that rollovers of the lower level
+    # occur every 2**h signatures
+    for lmotstype in args.lmots:
+        lmstype = next((t for t in args.lms if compatible(t, lmotstype)), None)
+        if lmstype is None:
+            continue
+        sk = HSS_Priv([lmstype, lmstype], lmotstype, args.cores[-1])
+        vk = sk.gen_pub()
+        n = min(args.signatures, sk.get_avail_signatures())
+        regular, rollover, verify, verify_parallel = [], [], [], []
+        pool = multiprocessing.Pool(2) if 'verify' in suites else None
+        for i in range(n):
+            message = i.to_bytes(8, 'big')
+            is_rollover = sk.priv[-1].get_avail_signatures() == 0
+            start = time.perf_counter()
+            signature = sk.sign(message)
+            duration = time.perf_counter() - start
+            (rollover if is_rollover else regular).append(duration)
+            if 'verify' in suites:
+                start = time.perf_counter()
+                vk.verify(message, signature)
+                verify.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                vk.verify_parallel(message, signature, pool)
+                verify_parallel.append(time.perf_counter() - start)
+        if pool is not None:
+            pool.close()
+            pool.join()
+        name = '%s/%s' % ('_'.join([lmstype.name]*2), lmotstype.name)
+        if 'sign' in suites:
+            results['sign/%s' % name] = summarize(regular)
+            if len(rollover) > 0:
+                results['sign_rollover/%s' % name] = summarize(rollover)
+        if 'verify' in suites:
+            results['verify/%s' % name] = summarize(verify)
+            results['verify_parallel/%s' % name] = summarize(verify_parallel)
+
+
+def bench_persist(args, results):
+    # the first parameter set of every hash function and output length
+    families = {}
+    for lmstype, lmotstype in parameter_sets(args.lms, args.lmots):
+        families.setdefault((lmstype.H, lmstype.m), (lmstype, lmotstype))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for lmstype, lmotstype in families.values():
+            filename = os.path.join(tmpdir, 'key')
+            sk = PersHSS_Priv([lmstype], lmotstype, filename, b'abc', 1, args.cores[-1])
+            name = '%s/%s' % (lmstype.name, lmotstype.name)
+            results['persist/save/%s' % name] = summarize(timeit(sk.save, args.repeat))
+            results['persist/load/%s' % name] = summarize(timeit(lambda: PersHSS_Priv.from_file(filename, b'abc'), args.repeat))
+
+
+def bench_cli(args, results):
+    lmstype, lmotstype = next(parameter_sets(args.lms, args.lmots))
+    hsslms_cmd = [sys.executable, '-m', 'hsslms']
+    keygen, sign, verify = [], [], []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        key = os.path.join(tmpdir, 'key')
+        message = os.path.join(tmpdir, 'message')
+        signature = os.path.join(tmpdir, 'signature')
+        with open(message, 'wb') as fout:
+            fout.write(b'abc')
+        for _ in range(args.repeat):
+            for fn in (key, key + '.pub', signature):
+                if os.path.exists(fn):
+                    os.remove(fn)
+            for samples, cmd in ((keygen, ['key-gen', '--lmots', lmotstype.name, '--lms', lmstype.name, '-o', key, '-p', 'abc', '-c', str(args.cores[-1])]),
+                                 (sign, ['sign', '-k', key, '-m', message, '-s', signature, '-p', 'abc']),
+                                 (verify, ['verify', '-k', key + '.pub', '-m', message, '-s', signature])):
+                start = time.perf_counter()
+                ret = subprocess.run(hsslms_cmd + cmd, capture_output=True)
+                samples.append(time.perf_counter() - start)
+                if ret.returncode != 0:
+                    raise RuntimeError(ret.stderr.decode())
+    name = '%s/%s' % (lmstype.name, lmotstype.name)
+    results['cli/key-gen/%s' % name] = summarize(keygen)
+    results['cli/sign/%s' % name] = summarize(sign)
+    results['cli/verify/%s' % name] = summarize(verify)
+
+
+def bench_import(args, results):
+    for module in IMPORT_MODULES:
+        code = 'import time; start = time.perf_counter(); import %s; print(time.perf_counter() - start)' % module
+        samples = []
+        for _ in range(args.repeat):
+            ret = subprocess.run([sys.executable, '-c', code], capture_output=True)
+            if ret.returncode != 0:
+                raise RuntimeError(ret.stderr.decode())
+            samples.append(float(ret.stdout))
+        results['import/%s' % module] = summarize(samples)
+
+
+def peak_rss():
+    """Peak resident set sizes in KiB of this process and its (waited for) children."""
+    if resource is None:
+        return None, None
+    scale = 1024 if sys.platform == 'darwin' else 1  # bytes on macOS, KiB elsewhere
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale)
+
+
+def probe_keygen_save(lmstype, lmotstype, num_cores, filename):
+    """Generates and saves a key, runs in a fresh process."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    sk = PersHSS_Priv([lmstype], lmotstype, filename, b'abc', 1, num_cores)
+    keygen_time = time.perf_counter() - start
+    _, keygen_peak = tracemalloc.get_traced_memory()
+    rss, rss_children = peak_rss()
+    tracemalloc.stop()
+    tracemalloc.start()
+    start = time.perf_counter()
+    sk.save()
+    save_time = time.perf_counter() - start
+    _, save_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'keygen': {'time': keygen_time, 'tracemalloc_peak_kib': keygen_peak // 1024, 'peak_rss_kib': rss, 'peak_rss_children_kib': rss_children},
+        'save': {'time': save_time, 'tracemalloc_peak_kib': save_peak // 1024, 'file_size_kib': os.path.getsize(filename) // 1024},
+    }
+
+
+def probe_load(filename):
+    """Loads a key, runs in a fresh process."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    PersHSS_Priv.from_file(filename, b'abc')
+    load_time = time.perf_counter() - start
+    _, load_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss, _ = peak_rss()
+    return {'load': {'time': load_time, 'tracemalloc_peak_kib': load_peak // 1024, 'peak_rss_kib': rss}}
+
+
+def _run_probe(queue, func, args):
+    queue.put(func(*args))
+
+
+def run_in_fresh_process(func, *args):
+    """Runs `func` in a freshly spawned process and returns its result."""
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_probe, args=(queue, func, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def bench_memory(args, memory):
+    for lmstype in args.memory_lms:
+        lmotstype = next((t for t in args.lmots if compatible(lmstype, t)), None)
+        if lmotstype is None:
+            continue
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'key')
+            result = run_in_fresh_process(probe_keygen_save, lmstype, lmotstype, args.cores[-1], filename)
+            result.update(run_in_fresh_process(probe_load, filename))
+        for op, values in result.items():
+            memory['memory/%s/%s/%s' % (op, lmstype.name, lmotstype.name)] = values
+
+
+def bench_scaling(args, scaling):
+    lmstype, lmotstype = next(parameter_sets(args.scaling_lms, args.lmots))
+    curve = []
+    for num_cores in range(1, args.max_cores+1):
+        median = statistics.median(timeit(lambda: HSS_Priv([lmstype], lmotstype, num_cores), args.repeat))
+        curve.append({'cores': num_cores, 'time': median, 'speedup': curve[0]['time'] / median if curve else 1.0})
+        curve[-1]['efficiency'] = curve[-1]['speedup'] / num_cores
+    scaling['scaling/%s/%s' % (lmstype.name, lmotstype.name)] = curve
+
+
+def compare(results, baseline, threshold, field='median'):
+    """Compares one field of two result sets, by default the medians.
+
+    Returns:
+        list: Tuples (name, baseline value, value, ratio) of all regressions.
+    """
+    regressions = []
+    for name, stats in results.items():
+        if name not in baseline or not baseline[name].get(field):
+            continue
+        ratio = stats[field] / baseline[name][field]
+        print("%-70s %10.4f %10.4f %7.2f%s" % (name, baseline[name][field], stats[field], ratio, '  <-- regression' if ratio > 1+threshold else ''))
+        if ratio > 1+threshold:
+            regressions.append((name, baseline[name][field], stats[field], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite of hsslms')
+    parser.add_argument('--suite', nargs='+', choices=SUITES, default=list(DEFAULT_SUITES), help='benchmarks to run (default: %s)' % ' '.join(DEFAULT_SUITES))
+    parser.add_argument('--lms', nargs='+', choices=[t.name for t in LMS_ALGORITHM_TYPE], default=['LMS_SHA256_M32_H5', 'LMS_SHA256_M32_H10', 'LMS_SHA256_M24_H5', 'LMS_SHA256_M24_H10', 'LMS_SHAKE_M32_H5', 'LMS_SHAKE_M32_H10', 'LMS_SHAKE_M24_H5', 'LMS_SHAKE_M24_H10'], help='lms parameter sets, every set is combined with all compatible lmots parameter sets')
+    parser.add_argument('--lmots', nargs='+', choices=[t.name for t in LMOTS_ALGORITHM_TYPE], default=[t.name for t in LMOTS_ALGORITHM_TYPE], help='lmots parameter sets')
+    parser.add_argument('--cores', '-c', nargs='+', type=int, default=[1, os.cpu_count()], help='numbers of cpu cores used for key generation')
+    parser.add_argument('--memory-lms', nargs='+', choices=[t.name for t in LMS_ALGORITHM_TYPE], default=['LMS_SHA256_M32_H5', 'LMS_SHA256_M32_H10', 'LMS_SHA256_M32_H15', 'LMS_SHA256_M32_H20'], help='lms parameter sets of the memory benchmark', dest='memory_lms')
+    parser.add_argument('--scaling-lms', choices=[t.name for t in LMS_ALGORITHM_TYPE], default='LMS_SHA256_M32_H10', help='lms parameter set of the scaling benchmark', dest='scaling_lms')
+    parser.add_argument('--max-cores', type=int, default=os.cpu_count(), help='maximal number of cpu cores of the scaling benchmark', dest='max_cores')
+    parser.add_argument('--repeat', '-r', type=int, default=3, help='number of repetitions of each measurement')
+    parser.add_argument('--signatures', '-n', type=int, default=100, help='number of signatures for the sign and verify benchmarks')
+    parser.add_argument('--out', '-o', help='filename of the JSON results')
+    parser.add_argument('--compare', help='filename of JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown of the median which is flagged as regression (default=0.1)')
+    args = parser.parse_args()
+    args.lms = [LMS_ALGORITHM_TYPE[t] for t in args.lms]
+    args.lmots = [LMOTS_ALGORITHM_TYPE[t] for t in args.lmots]
+    args.memory_lms = [LMS_ALGORITHM_TYPE[t] for t in args.memory_lms]
+    args.scaling_lms = [LMS_ALGORITHM_TYPE[args.scaling_lms]]
+    args.cores = sorted(set(args.cores))
+    if next(parameter_sets(args.lms, args.lmots), None) is None:
+        parser.error('no matching pair of lms and lmots parameter sets')
+
+    results = {}
+    if 'keygen' in args.suite:
+        bench_keygen(args, results)
+    if 'sign' in args.suite or 'verify' in args.suite:
+        bench_sign_verify(args, results, args.suite)
+    if 'persist' in args.suite:
+        bench_persist(args, results)
+    if 'cli' in args.suite:
+        bench_cli(args, results)
+    if 'import' in args.suite:
+        bench_import(args, results)
+    memory = {}
+    if 'memory' in args.suite:
+        bench_memory(args, memory)
+    scaling = {}
+    if 'scaling' in args.suite:
+        bench_scaling(args, scaling)
+
+    if len(results) > 0:
+        print("%-70s %10s %10s %10s %10s" % ('Benchmark', 'min[s]', 'median[s]', 'p90[s]', 'max[s]'))
+        for name, stats in results.items():
+            print("%-70s %10.4f %10.4f %10.4f %10.4f" % (name, stats['min'], stats['median'], stats['p90'], stats['max']))
+    if len(memory) > 0:
+        print("%-70s %10s %10s %10s" % ('Memory', 'time[s]', 'traced[KiB]', 'RSS[KiB]'))
+        for name, values in memory.items():
+            print("%-70s %10.4f %10d %10s" % (name, values['time'], values['tracemalloc_peak_kib'], values.get('peak_rss_kib', '-')))
+    for name, curve in scaling.items():
+        print("%-70s %10s %10s %10s" % (name, 'time[s]', 'speedup', 'efficiency'))
+        for point in curve:
+            print("%70d %10.4f %10.2f %10.2f" % (point['cores'], point['time'], point['speedup'], point['efficiency']))
+
+    if args.out is not None:
+        meta = {
+            'hsslms': hsslms.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'date': datetime.now(timezone.utc).isoformat(),
+            'argv': sys.argv[1:],
+        }
+        with open(args.out, 'w') as fout:
+            json.dump({'meta': meta, 'results': results, 'memory': memory, 'scaling': scaling}, fout, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as fin:
+            baseline = json.load(fin)
+        print()
+        regressions = []
+        if len(results) > 0:
+            print("%-70s %10s %10s %7s" % ('Comparison of medians', 'base[s]', 'new[s]', 'ratio'))
+            regressions += compare(results, baseline['results'], args.threshold)
+        if len(memory) > 0:
+            print("%-70s %10s %10s %7s" % ('Comparison of traced memory peaks', 'base[KiB]', 'new[KiB]', 'ratio'))
+            regressions += compare(memory, baseline.get('memory', {}), args.threshold, 'tracemalloc_peak_kib')
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,22 +7,58 @@ Created on Thu Dec 23 09:14:46 2021
 
 """
 import unittest
+import os
+import io
+import sys
+import subprocess
+import pickle
+import tempfile
+import threading
+from urllib.request import urlopen
 from itertools import product
 from secrets import token_bytes
 from binascii import a2b_hex
-from hsslms import LM_OTS_Priv, LMOTS_ALGORITHM_TYPE, LMS_Priv, HSS_Priv, HSS_Pub, LMS_ALGORITHM_TYPE, INVALID, FAILURE
+from hsslms import LM_OTS_Priv, LMOTS_ALGORITHM_TYPE, LMS_Priv, LMS_Pub, HSS_Priv, HSS_Pub, LMS_ALGORITHM_TYPE, INVALID, FAILURE
+from hsslms import PersHSS_Priv, LMS_Wrapper_Priv
+from hsslms.pershss import _KeyFileLock
+from hsslms.lmswrapper import prehash
+from hsslms.utils import u32str
+from hsslms import instrumentation
+from hsslms.metrics import PrometheusMetrics
+from hsslms.checkpoint import KeyGenCheckpoint
+from hsslms.distkeygen import KeyGenCoordinator, run_job, run_local
+from hsslms.keyring import Keyring
+from hsslms.bundle import BundleWriter, BundleReader
+from hsslms import advisor
+from hsslms import batch
+from hsslms.verifycache import VerificationCache, digest_message
+from multiprocessing import Pool
+
+# the parameter sets of RFC 8554, see Test_Cases_Sp800208 for the other sets
+SHA256_N32_OTS_TYPES = [t for t in LMOTS_ALGORITHM_TYPE if t.name.startswith('LMOTS_SHA256_N32_')]
+
+def sign_reserved(filename, count):
+    with PersHSS_Priv.reserve(filename, b'abc', count) as sk:
+        return [sk.sign(b'abc') for _ in range(count)]
+
+def verify_hash_calls(vk, message, signature):
+    instrumentation.reset()
+    instrumentation.enable()
+    vk.verify(message, signature)
+    instrumentation.disable()
+    return instrumentation.get_stats().hash_calls
 
 class Test_LMS_OTS(unittest.TestCase):
 
     def test_lm_ots_typecodes_pass(self):
-        for typecode in LMOTS_ALGORITHM_TYPE:
+        for typecode in SHA256_N32_OTS_TYPES:
             sk = LM_OTS_Priv(typecode, token_bytes(16), 0, token_bytes(32))
             signature = sk.sign(b'abc')
             vk = sk.gen_pub()
             self.assertIsNone(vk.verify(b'abc', signature), "Verify is not None.")
         
     def test_lm_ots_typecodes_fail(self):
-        for typecode in LMOTS_ALGORITHM_TYPE:
+        for typecode in SHA256_N32_OTS_TYPES:
             sk = LM_OTS_Priv(typecode, token_bytes(16), 0, token_bytes(32))
             signature = sk.sign(b'abc')
             vk = sk.gen_pub()
@@ -41,14 +77,14 @@ class Test_LMS(unittest.TestCase):
     lms_algorithm_type = (LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H10)
 
     def test_lm_typecodes_pass(self):
-        for otstypecode, typecode in product(LMOTS_ALGORITHM_TYPE, Test_LMS.lms_algorithm_type):
+        for otstypecode, typecode in product(SHA256_N32_OTS_TYPES, Test_LMS.lms_algorithm_type):
             sk = LMS_Priv(typecode, otstypecode)
             signature = sk.sign(b'abc')
             vk = sk.gen_pub()
             self.assertIsNone(vk.verify(b'abc', signature), "Verify is not None.")
 
     def test_lm_typecodes_fail(self):
-        for otstypecode, typecode in product(LMOTS_ALGORITHM_TYPE, Test_LMS.lms_algorithm_type):
+        for otstypecode, typecode in product(SHA256_N32_OTS_TYPES, Test_LMS.lms_algorithm_type):
             sk = LMS_Priv(typecode, otstypecode)
             signature = sk.sign(b'abc')
             vk = sk.gen_pub()
@@ -68,28 +104,28 @@ class Test_HSS(unittest.TestCase):
     lms_algorithm_type = (LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H10)
     
     def test_hss_typecodes_l1_pass(self):
-        for otstypecode, lmstypecode in product(LMOTS_ALGORITHM_TYPE, Test_HSS.lms_algorithm_type):
+        for otstypecode, lmstypecode in product(SHA256_N32_OTS_TYPES, Test_HSS.lms_algorithm_type):
             sk = HSS_Priv([lmstypecode], otstypecode)
             signature = sk.sign(b'abc')
             vk = sk.gen_pub()
             self.assertIsNone(vk.verify(b'abc', signature), "Verify is not None.")
 
     def test_hss_typecodes_l2_pass(self):
-        for otstypecode, lmstypecode1, lmstypecode2 in product(LMOTS_ALGORITHM_TYPE, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type):
+        for otstypecode, lmstypecode1, lmstypecode2 in product(SHA256_N32_OTS_TYPES, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type):
             sk = HSS_Priv([lmstypecode1, lmstypecode2], otstypecode)
             signature = sk.sign(b'abc')
             vk = sk.gen_pub()
             self.assertIsNone(vk.verify(b'abc', signature), "Verify is not None.")
 
     def test_hss_typecodes_l3_pass(self):
-        for otstypecode, lmstypecode1, lmstypecode2, lmstypecode3 in product(LMOTS_ALGORITHM_TYPE, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type):
+        for otstypecode, lmstypecode1, lmstypecode2, lmstypecode3 in product(SHA256_N32_OTS_TYPES, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type):
             sk = HSS_Priv([lmstypecode1, lmstypecode2, lmstypecode3], otstypecode)
             signature = sk.sign(b'abc')
             vk = sk.gen_pub()
             self.assertIsNone(vk.verify(b'abc', signature), "Verify is not None.")
 
     def test_hss_typecodes_l1_fail(self):
-        for otstypecode, lmstypecode in product(LMOTS_ALGORITHM_TYPE, Test_HSS.lms_algorithm_type):
+        for otstypecode, lmstypecode in product(SHA256_N32_OTS_TYPES, Test_HSS.lms_algorithm_type):
             sk = HSS_Priv([lmstypecode], otstypecode)
             signature = sk.sign(b'abc')
             vk = sk.gen_pub()
@@ -97,7 +133,7 @@ class Test_HSS(unittest.TestCase):
                 vk.verify(b'', signature)
 
     def test_hss_typecodes_l2_fail(self):
-        for otstypecode, lmstypecode1, lmstypecode2 in product(LMOTS_ALGORITHM_TYPE, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type):
+        for otstypecode, lmstypecode1, lmstypecode2 in product(SHA256_N32_OTS_TYPES, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type):
             sk = HSS_Priv([lmstypecode1, lmstypecode2], otstypecode)
             signature = sk.sign(b'abc')
             vk = sk.gen_pub()
@@ -105,7 +141,7 @@ class Test_HSS(unittest.TestCase):
                 vk.verify(b'', signature)
 
     def test_hss_typecodes_l3_fail(self):
-        for otstypecode, lmstypecode1, lmstypecode2, lmstypecode3 in product(LMOTS_ALGORITHM_TYPE, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type):
+        for otstypecode, lmstypecode1, lmstypecode2, lmstypecode3 in product(SHA256_N32_OTS_TYPES, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type, Test_HSS.lms_algorithm_type):
             sk = HSS_Priv([lmstypecode1, lmstypecode2, lmstypecode3], otstypecode)
             signature = sk.sign(b'abc')
             vk = sk.gen_pub()
@@ -137,6 +173,1021 @@ class Test_Cases_Rfc8554(unittest.TestCase):
         self.assertIsNone(vk.verify(message, signature), "Verify is not None.")
 
 
+class Test_Cases_Sp800208(unittest.TestCase):
+    # Test Cases 1-3, draft-fluhrer-lms-more-parm-sets: the private keys are
+    # given by SEED and I, the known answers are the HSS public keys
+
+    def check(self, lmstype, otstype, SEED, I, pubkey):
+        sk = LMS_Priv(lmstype, otstype, 1, SEED=SEED, I=I)
+        vk = HSS_Pub(u32str(1) + sk.gen_pub().get_pubkey())
+        self.assertEqual(vk.get_pubkey(), a2b_hex(pubkey))
+        vk.verify(b'abc', u32str(0) + sk.sign(b'abc'))
+
+    def test_typecodes(self):
+        # every LMOTS type of SP 800-208 with a LMS type of the same family
+        for otstype in LMOTS_ALGORITHM_TYPE:
+            if otstype in SHA256_N32_OTS_TYPES:
+                continue
+            ots = LM_OTS_Priv(otstype, token_bytes(16), 0, token_bytes(otstype.n))
+            signature = ots.sign(b'abc')
+            ots.gen_pub().verify(b'abc', signature)
+            with self.assertRaises(INVALID):
+                ots.gen_pub().verify(b'', signature)
+            lmstype = next(t for t in LMS_ALGORITHM_TYPE if t.h == 5 and advisor.compatible(t, otstype))
+            sk = HSS_Priv([lmstype]*2, otstype, 1)
+            vk = sk.gen_pub()
+            signature = sk.sign(b'abc')
+            vk.verify(b'abc', signature)
+            with self.assertRaises(INVALID):
+                vk.verify(b'', signature)
+
+    def test_case_1(self):
+        # SHA-256/192
+        self.check(LMS_ALGORITHM_TYPE.LMS_SHA256_M24_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N24_W8, bytes(range(0x00, 0x18)), bytes(range(0x20, 0x30)),
+                   '000000010000000a00000008202122232425262728292a2b2c2d2e2f2c571450aed99cfb4f4ac285da14882796618314508b12d2')
+
+    def test_case_2(self):
+        # SHAKE256/192
+        self.check(LMS_ALGORITHM_TYPE.LMS_SHAKE_M24_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHAKE_N24_W8, bytes(range(0x30, 0x48)), bytes(range(0x50, 0x60)),
+                   '000000010000001400000010505152535455565758595a5b5c5d5e5fdb54a4509901051c01e26d9990e550347986da87924ff0b1')
+
+    def test_case_3(self):
+        # SHAKE256/256
+        self.check(LMS_ALGORITHM_TYPE.LMS_SHAKE_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHAKE_N32_W8, bytes(range(0x60, 0x80)), bytes(range(0x80, 0x90)),
+                   '000000010000000f0000000c808182838485868788898a8b8c8d8e8f9bb7faee411cae806c16a466c3191a8b65d0ac31932bbf0c2d07c7a4a36379fe')
+
+
+class Test_Instrumentation(unittest.TestCase):
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_disabled(self):
+        self.assertIs(instrumentation.counting(LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W2.H), LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W2.H)
+        sk = LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W2)
+        sk.sign(b'abc')
+        self.assertEqual(instrumentation.get_stats().hash_calls, 0)
+        self.assertEqual(instrumentation.get_stats().phases, {})
+
+    def test_lm_ots_hash_calls(self):
+        instrumentation.enable()
+        otstype = LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W2
+        sk = LM_OTS_Priv(otstype, token_bytes(16), 0, token_bytes(32))
+        self.assertEqual(instrumentation.get_stats().hash_calls, otstype.p)
+        sk.gen_pub_K()
+        self.assertEqual(instrumentation.get_stats().hash_calls, otstype.p + otstype.p*(2**otstype.w - 1) + 1)
+        # I || q || i || j || tmp fits into a single block, K hashes I || q || D_PBLC || z
+        self.assertEqual(instrumentation.get_stats().hash_blocks, otstype.p + otstype.p*(2**otstype.w - 1) + (22 + 32*otstype.p + 9 + 63) // 64)
+
+    def test_shake_hash_blocks(self):
+        instrumentation.enable()
+        otstype = LMOTS_ALGORITHM_TYPE.LMOTS_SHAKE_N32_W2
+        sk = LM_OTS_Priv(otstype, token_bytes(16), 0, token_bytes(32))
+        sk.gen_pub_K()
+        # SHAKE256 has a rate of 136 bytes and appends at least one padding byte
+        self.assertEqual(instrumentation.get_stats().hash_blocks, otstype.p + otstype.p*(2**otstype.w - 1) + (22 + 32*otstype.p + 1 + 135) // 136)
+        instrumentation.reset()
+        H = instrumentation.counting(otstype.H)
+        for length, blocks in ((0, 1), (135, 1), (136, 2), (271, 2), (272, 3)):
+            H(bytes(length)).digest()
+            self.assertEqual(instrumentation.get_stats().hash_blocks, blocks)
+            instrumentation.reset()
+
+    def test_lms_keygen_hash_calls(self):
+        durations = []
+        instrumentation.enable(hook=lambda name, duration: durations.append(name))
+        otstype = LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W2
+        sk = LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, otstype, 2)
+        per_leaf = otstype.p + otstype.p*(2**otstype.w - 1) + 2
+        self.assertEqual(instrumentation.get_stats().hash_calls, 2**5 * per_leaf + 2**5 - 1)
+        sk.sign(b'abc')
+        self.assertEqual(durations, ['leaf_generation', 'tree_merge', 'ots_sign', 'auth_path'])
+        self.assertEqual(set(instrumentation.get_stats().phases), set(durations))
+
+    def test_hss_rollover(self):
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*2, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4)
+        instrumentation.enable()
+        for _ in range(2**5 + 1):
+            sk.sign(b'abc')
+        self.assertEqual(instrumentation.get_stats().phases['rollover'][0], 1)
+        self.assertEqual(instrumentation.get_stats().phases['ots_sign'][0], 2**5 + 2)
+
+
+class Test_Metrics(unittest.TestCase):
+
+    def test_prometheus_metrics(self):
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*2, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4)
+        metrics = PrometheusMetrics()
+        sk.set_metrics(metrics)
+        for _ in range(2**5 + 1):
+            sk.sign(b'abc')
+        text = metrics.render()
+        self.assertIn('hsslms_signatures_total 33\n', text)
+        self.assertIn('hsslms_sign_duration_seconds_count 33\n', text)
+        self.assertIn('hsslms_rollovers_total{level="1"} 1\n', text)
+        self.assertIn('hsslms_available_signatures %d\n' % (2**10 - 33), text)
+        self.assertIn('hsslms_level_available_signatures{level="0"} 30\n', text)
+        self.assertIn('hsslms_level_available_signatures{level="1"} 31\n', text)
+        # the metrics are not pickled
+        self.assertIsNone(pickle.loads(pickle.dumps(sk)).metrics)
+
+    def test_prometheus_http(self):
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4)
+        metrics = PrometheusMetrics()
+        sk.set_metrics(metrics)
+        sk.sign(b'abc')
+        server = metrics.serve(0)
+        try:
+            with urlopen('http://127.0.0.1:%d/metrics' % server.server_address[1]) as response:
+                self.assertEqual(response.read().decode('utf-8'), metrics.render())
+        finally:
+            server.shutdown()
+
+
+class Test_Checkpoint(unittest.TestCase):
+
+    class Interrupt(Exception):
+        pass
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'key.ckpt')
+        self.subtree_height = LMS_Priv.SUBTREE_HEIGHT
+        LMS_Priv.SUBTREE_HEIGHT = 2
+
+    def tearDown(self):
+        LMS_Priv.SUBTREE_HEIGHT = self.subtree_height
+        self.tmpdir.cleanup()
+
+    def interrupted_keygen(self, after):
+        def progress(done, total, eta):
+            if done >= after:
+                raise Test_Checkpoint.Interrupt
+        with self.assertRaises(Test_Checkpoint.Interrupt):
+            LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, progress, KeyGenCheckpoint(self.filename, b'abc'))
+
+    def test_resume(self):
+        self.interrupted_keygen(12)
+        calls = []
+        checkpoint = KeyGenCheckpoint(self.filename, b'abc')
+        SEED, I = checkpoint.load()[2:4]
+        self.assertEqual(len(checkpoint.load()[5]), 3)
+        sk = LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, lambda *args: calls.append(args), checkpoint)
+        self.assertEqual((sk.SEED, sk.I), (SEED, I))
+        self.assertEqual(calls[0], (12, 32, None))
+        self.assertEqual([c[0] for c in calls[1:]], [16, 20, 24, 28, 32])
+        # compare with the tree computed from scratch
+        leafs = [LMS_Priv._calc_leafs(sk.H, I, r, 5, sk.otstypecode, SEED, sk.m) for r in range(2**5, 2**6)]
+        self.assertEqual(sk.T[2**5:], leafs)
+        vk = sk.gen_pub()
+        vk.verify(b'abc', sk.sign(b'abc'))
+
+    def test_partial_record(self):
+        self.interrupted_keygen(8)
+        with open(self.filename, 'r+b') as fout:
+            fout.truncate(os.path.getsize(self.filename) - 10)
+        checkpoint = KeyGenCheckpoint(self.filename, b'abc')
+        self.assertEqual(len(checkpoint.load()[5]), 1)
+        sk = LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, None, checkpoint)
+        sk.gen_pub().verify(b'abc', sk.sign(b'abc'))
+
+    def test_wrong_password_and_parameters(self):
+        self.interrupted_keygen(4)
+        with self.assertRaises(FAILURE):
+            KeyGenCheckpoint(self.filename, b'abd').load()
+        with self.assertRaises(FAILURE):
+            LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W2, 1, None, KeyGenCheckpoint(self.filename, b'abc'))
+
+    def test_hss(self):
+        checkpoint = KeyGenCheckpoint(self.filename, b'abc')
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*2, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, None, checkpoint)
+        checkpoint = KeyGenCheckpoint(self.filename, b'abc')
+        self.assertEqual(checkpoint.load(0)[3], sk.priv[0].I)
+        self.assertEqual(checkpoint.load(1)[3], sk.priv[1].I)
+        checkpoint.remove()
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_persistent(self):
+        keyfile = os.path.join(self.tmpdir.name, 'missing', 'key')
+        sk = PersHSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, keyfile, b'abc', 1, 1, None, KeyGenCheckpoint(self.filename, b'abc'))
+        # the checkpoint is kept until the key has been saved
+        with self.assertRaises(FAILURE):
+            sk.save()
+        self.assertTrue(os.path.exists(self.filename))
+        resumed = PersHSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, keyfile, b'abc', 1, 1, None, KeyGenCheckpoint(self.filename, b'abc'))
+        self.assertEqual(resumed.gen_pub().get_pubkey(), sk.gen_pub().get_pubkey())
+        os.mkdir(os.path.dirname(keyfile))
+        resumed.save()
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertIsNone(PersHSS_Priv.from_file(keyfile, b'abc').checkpoint)
+        # a second key generation with the same checkpoint creates another key
+        other = PersHSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, keyfile, b'abc', 1, 1, None, KeyGenCheckpoint(self.filename, b'abc'))
+        self.assertNotEqual(other.gen_pub().get_pubkey(), sk.gen_pub().get_pubkey())
+
+
+class Test_Split(unittest.TestCase):
+
+    def test_split(self):
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4)
+        vk = sk.gen_pub()
+        sk.sign(b'abc')
+        avail = sk._count_avail_signatures()
+        shards = sk.split(3, 1)
+        self.assertEqual(sum(shard.get_avail_signatures() for shard in shards), avail)
+        ranges = [range(shard.priv[0].q, shard.priv[0].q_end) for shard in shards]
+        self.assertEqual(sum(map(len, ranges)), len(set().union(*ranges)))
+        for shard in shards:
+            self.assertEqual(shard.gen_pub().get_pubkey(), vk.get_pubkey())
+            vk.verify(b'abc', shard.sign(b'abc'))
+        with self.assertRaises(FAILURE):
+            sk.sign(b'abc')
+
+    def test_exhaust_shard(self):
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4)
+        vk = sk.gen_pub()
+        shards = sk.split(4)
+        self.assertEqual([shard.get_avail_signatures() for shard in shards], [8]*4)
+        for _ in range(8):
+            vk.verify(b'abc', shards[1].sign(b'abc'))
+        with self.assertRaises(FAILURE):
+            shards[1].sign(b'abc')
+        with self.assertRaises(FAILURE):
+            shards[0].split(9)
+
+    def test_old_format(self):
+        # key file saved by a version without leaf ranges of the LMS keys
+        with open('test_old_format_pubkey.bin', 'rb') as fin:
+            vk = HSS_Pub(fin.read())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'key')
+            with open('test_old_format_key.bin', 'rb') as fin, open(filename, 'wb') as fout:
+                fout.write(fin.read())
+            sk = PersHSS_Priv.from_file(filename, b'abc')
+            sk.filename = filename
+            self.assertEqual(sk.get_avail_signatures(), 2**10 - 1)
+            for _ in range(32):
+                vk.verify(b'abc', sk.sign(b'abc'))
+            self.assertEqual(PersHSS_Priv.from_file(filename, b'abc').get_avail_signatures(), 2**10 - 33)
+
+
+class Test_Reservation(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'key')
+        sk = PersHSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, self.filename, b'abc', 1, 1)
+        sk.save()
+        self.vk = sk.gen_pub()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def bottom_q(self):
+        return PersHSS_Priv._load(self.filename, b'abc').priv[-1].q
+
+    def test_release(self):
+        first = PersHSS_Priv.reserve(self.filename, b'abc', 5)
+        second = PersHSS_Priv.reserve(self.filename, b'abc', 5)
+        self.assertEqual(self.bottom_q(), 10)
+        self.vk.verify(b'abc', first.sign(b'abc'))
+        self.vk.verify(b'abc', second.sign(b'abc'))
+        # not given back, the second reservation follows
+        first.release()
+        self.assertEqual(self.bottom_q(), 10)
+        second.release()
+        self.assertEqual(self.bottom_q(), 6)
+        with self.assertRaises(FAILURE):
+            second.sign(b'abc')
+
+    def test_after_from_file(self):
+        sk = PersHSS_Priv._load(self.filename, b'abc')
+        sk.frequence = 10
+        sk.save()
+        sk = PersHSS_Priv.from_file(self.filename, b'abc')
+        used = []
+        for _ in range(5):
+            used.append(sk.priv[-1].q)
+            sk.sign(b'abc')
+        self.assertEqual(used, [9, 10, 11, 12, 13])
+        # the leafs after the last save may have been used
+        with PersHSS_Priv.reserve(self.filename, b'abc', 1) as reservation:
+            self.assertEqual(reservation.sk.priv[-1].q, 19)
+            self.vk.verify(b'abc', reservation.sign(b'abc'))
+        self.assertEqual(PersHSS_Priv._load(self.filename, b'abc').frequence, 1)
+        with PersHSS_Priv.reserve(self.filename, b'abc', 1) as reservation:
+            self.assertEqual(reservation.sk.priv[-1].q, 20)
+
+    def test_block_end(self):
+        with PersHSS_Priv.reserve(self.filename, b'abc', 40) as sk:
+            self.assertEqual(sk.get_avail_signatures(), 32)
+            for _ in range(32):
+                self.vk.verify(b'abc', sk.sign(b'abc'))
+            with self.assertRaises(FAILURE):
+                sk.sign(b'abc')
+        # rollover to the next tree of the lowest level
+        with PersHSS_Priv.reserve(self.filename, b'abc', 1) as sk:
+            self.vk.verify(b'abc', sk.sign(b'abc'))
+
+    def test_split_file(self):
+        reservation = PersHSS_Priv.reserve(self.filename, b'abc', 5)
+        shards = []
+        with _KeyFileLock(self.filename):
+            thread = threading.Thread(target=lambda: shards.extend(PersHSS_Priv.split_file(self.filename, b'abc', 2, [self.filename + '.0', self.filename + '.1'], 1)))
+            thread.start()
+            thread.join(1)
+            # the split waits for the lock
+            self.assertTrue(thread.is_alive())
+        thread.join()
+        # the first shard continues after the reserved signatures
+        self.assertEqual(shards[0].priv[-1].q, 5)
+        self.vk.verify(b'abc', reservation.sign(b'abc'))
+        self.vk.verify(b'abc', shards[0].sign(b'abc'))
+        self.assertEqual(PersHSS_Priv._load(self.filename, b'abc').get_avail_signatures(), 0)
+
+    def test_parallel(self):
+        with Pool(4) as p:
+            signatures = sum(p.starmap(sign_reserved, [(self.filename, 3)]*8), [])
+        for signature in signatures:
+            self.vk.verify(b'abc', signature)
+        # the signatures have to use distinct leafs of the lowest level
+        leafs = set()
+        for signature in signatures:
+            signature = signature[4+LMS_Pub._len_signature(signature[4:]):]
+            l = LMS_Pub._len_pubkey(signature)
+            leafs.add((signature[8:24], signature[l:l+4]))
+        self.assertEqual(len(leafs), len(signatures))
+
+
+class Test_Deterministic(unittest.TestCase):
+
+    typecodes = [LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]
+
+    def test_derivation(self):
+        sk = HSS_Priv(Test_Deterministic.typecodes, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, deterministic=True)
+        vk = sk.gen_pub()
+        self.assertEqual((sk.priv[1].SEED, sk.priv[1].I), sk.priv[0].derive_child(0, Test_Deterministic.typecodes[1]))
+        for _ in range(2**5 + 1):
+            vk.verify(b'abc', sk.sign(b'abc'))
+        self.assertEqual((sk.priv[1].SEED, sk.priv[1].I), sk.priv[0].derive_child(1, Test_Deterministic.typecodes[1]))
+
+    def test_compact_state(self):
+        sk = HSS_Priv(Test_Deterministic.typecodes, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, deterministic=True)
+        other = HSS_Priv(Test_Deterministic.typecodes, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1)
+        vk = sk.gen_pub()
+        sk.sign(b'abc')
+        data = pickle.dumps(sk)
+        self.assertLess(len(data), len(pickle.dumps(other)) - 2**6 * 32)
+        loaded = pickle.loads(data)
+        self.assertIsNone(loaded.priv[1].T)
+        vk.verify(b'abc', loaded.sign(b'abc'))
+        self.assertEqual(loaded.priv[1].T, sk.priv[1].T)
+
+    def test_precompute(self):
+        for deterministic in (False, True):
+            sk = HSS_Priv(Test_Deterministic.typecodes, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, deterministic=deterministic)
+            vk = sk.gen_pub()
+            sk.precompute(1)
+            next_tree = sk.next_tree
+            for _ in range(2**5 + 1):
+                vk.verify(b'abc', sk.sign(b'abc'))
+            self.assertIs(sk.priv[1], next_tree)
+            self.assertIsNone(sk.next_tree)
+
+
+class Test_Lazy(unittest.TestCase):
+
+    typecodes = [LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]
+
+    def test_first_signature(self):
+        sk = HSS_Priv(Test_Lazy.typecodes, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, lazy=True)
+        vk = sk.gen_pub()
+        self.assertEqual(sk.priv[1:], [None, None])
+        self.assertEqual(sk.get_avail_signatures(), 2**15)
+        self.assertEqual(sk._count_avail_signatures(), 2**15)
+        vk.verify(b'abc', sk.sign(b'abc'))
+        self.assertEqual(sk.get_avail_signatures_levels(), [31, 31, 31])
+
+    def test_background(self):
+        sk = HSS_Priv(Test_Lazy.typecodes, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, lazy=True)
+        vk = sk.gen_pub()
+        sk.materialize(1, background=True)
+        vk.verify(b'abc', sk.sign(b'abc'))
+        self.assertIsNone(sk.materializer)
+        sk = HSS_Priv(Test_Lazy.typecodes, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, lazy=True)
+        sk.materialize(1, background=True)
+        copy = pickle.loads(pickle.dumps(sk))  # waits for the materializer
+        self.assertIsNone(sk.materializer)
+        self.assertNotIn(None, copy.priv)
+        copy.gen_pub().verify(b'abc', copy.sign(b'abc'))
+        sk = pickle.loads(pickle.dumps(HSS_Priv(Test_Lazy.typecodes, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, lazy=True)))
+        sk.materialize(1)
+        vk = sk.gen_pub()
+        vk.verify(b'abc', sk.sign(b'abc'))
+
+    def test_split(self):
+        sk = HSS_Priv(Test_Lazy.typecodes, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1, lazy=True)
+        vk = sk.gen_pub()
+        shards = sk.split(2, 1)
+        self.assertEqual(sum(shard.get_avail_signatures() for shard in shards), 2**15)
+        for shard in shards:
+            vk.verify(b'abc', shard.sign(b'abc'))
+
+
+class Test_ConcurrentKeyGen(unittest.TestCase):
+
+    def test_build_all(self):
+        otstype = LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4
+        calls = []
+        trees = [LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, otstype, progress=lambda *args: calls.append(args), build=False),
+                 LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H10, otstype, build=False)]
+        LMS_Priv._build_all(trees, 2)
+        for tree in trees:
+            reference = LMS_Priv(tree.typecode, otstype, 1, SEED=tree.SEED, I=tree.I)
+            self.assertEqual(tree.T, reference.T)
+            self.assertFalse(hasattr(tree, '_pending'))
+        self.assertEqual(calls[-1][:2], (32, 32))
+
+    def test_hss_progress(self):
+        calls = []
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*3, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 2, lambda *args: calls.append(args))
+        self.assertEqual(sorted(c[0] for c in calls if c[1] == c[2]), [0, 1, 2])
+        vk = sk.gen_pub()
+        vk.verify(b'abc', sk.sign(b'abc'))
+
+
+class Test_PerLevelOTS(unittest.TestCase):
+
+    def test_levels(self):
+        otstypes = [LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W2]
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*2, otstypes, 1)
+        vk = sk.gen_pub()
+        for _ in range(2**5 + 1):
+            vk.verify(b'abc', sk.sign(b'abc'))
+        self.assertEqual([priv.otstypecode for priv in sk.priv], otstypes)
+        with self.assertRaises(FAILURE):
+            HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*3, otstypes, 1)
+
+
+class Test_ParameterSets(unittest.TestCase):
+
+    families = [(LMS_ALGORITHM_TYPE.LMS_SHA256_M24_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N24_W4),
+                (LMS_ALGORITHM_TYPE.LMS_SHAKE_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHAKE_N32_W4),
+                (LMS_ALGORITHM_TYPE.LMS_SHAKE_M24_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHAKE_N24_W4)]
+
+    def test_sizes(self):
+        self.assertEqual(LMOTS_ALGORITHM_TYPE.LMOTS_SHAKE_N24_W8.p, 26)
+        self.assertEqual(LMS_ALGORITHM_TYPE.LMS_SHAKE_M24_H25.h, 25)
+        sk = LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M24_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N24_W8, 1)
+        self.assertEqual(len(sk.sign(b'abc')), 12 + 24*27 + 24*5)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for lmstype, lmotstype in Test_ParameterSets.families:
+                filename = os.path.join(tmpdir, lmstype.name)
+                sk = PersHSS_Priv([lmstype, lmstype], lmotstype, filename, b'abc', 1, 1)
+                sk.save()
+                vk = sk.gen_pub()
+                vk.verify(b'abc', PersHSS_Priv.from_file(filename, b'abc').sign(b'abc'))
+                with self.assertRaises(INVALID):
+                    vk.verify(b'abd', sk.sign(b'abc'))
+
+    def test_mixed_output_length(self):
+        sk = LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N24_W4, 1)
+        sk.gen_pub().verify(b'abc', sk.sign(b'abc'))
+
+
+class Test_WrapperPrehash(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'key')
+        self.sk = LMS_Wrapper_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, self.filename, b'abc', 4, 1)
+        self.vk = self.sk.gen_pub()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_prehash(self):
+        message = token_bytes(3*1000 + 7)
+        msgfile = os.path.join(self.tmpdir.name, 'msg')
+        with open(msgfile, 'wb') as fout:
+            fout.write(message)
+        expected = prehash(message)
+        with open(msgfile, 'rb') as fin:
+            self.assertEqual(prehash(fin), expected)
+        with open(msgfile, 'rb') as fin:
+            fin.read(7)
+            self.assertEqual(prehash(fin), prehash(message[7:]))
+        with open(msgfile, 'rb', buffering=0) as fin:
+            self.assertEqual(prehash(fin, 1000), expected)
+        self.assertEqual(prehash(io.BytesIO(message), 1000), expected)
+        self.assertEqual(prehash(message[i:i+1000] for i in range(0, len(message), 1000)), expected)
+        with open(os.path.join(self.tmpdir.name, 'empty'), 'wb+') as fempty:
+            self.assertEqual(prehash(fempty), prehash(b''))
+
+    def test_sign_file(self):
+        signature = self.sk.sign(io.BytesIO(b'abc'))
+        self.assertTrue(self.sk.verify(b'abc', signature, self.vk))
+        self.assertTrue(self.sk.verify(io.BytesIO(b'abc'), signature, self.vk))
+        self.assertFalse(self.sk.verify(b'abd', signature, self.vk))
+
+    def test_many(self):
+        messages = [token_bytes(100) for _ in range(6)]
+        signatures = self.sk.sign_many(messages, 3)
+        self.assertEqual(self.sk.sign_count, 6)
+        self.assertTrue(os.path.exists(self.filename))
+        self.assertEqual(self.sk.verify_many(messages, signatures, self.vk, 3), [True]*6)
+        self.assertEqual(self.sk.verify_many(messages[1:] + messages[:1], signatures, self.vk), [False]*6)
+        with self.assertRaises(FAILURE):
+            self.sk.verify_many(messages, signatures[:-1], self.vk)
+        with self.assertRaises(FAILURE):
+            self.sk.verify_many(messages[:-1], signatures, self.vk)
+
+
+class Test_Batch(unittest.TestCase):
+
+    def test_batch(self):
+        for typecode, otstypecode in [(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8),
+                                      (LMS_ALGORITHM_TYPE.LMS_SHAKE_M24_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHAKE_N24_W8)]:
+            sk = HSS_Priv([typecode]*2, otstypecode, 1)
+            vk = sk.gen_pub()
+            for count in [1, 2, 7, 16]:
+                messages = [token_bytes(20) for _ in range(count)]
+                signatures = sk.sign_batch(messages)
+                for message, signature in zip(messages, signatures):
+                    vk.verify_batch(message, signature)
+            # one leaf per batch
+            self.assertEqual(sk.get_avail_signatures(), 2**10 - 4)
+
+    def test_invalid(self):
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, 1)
+        vk = sk.gen_pub()
+        messages = [b'a', b'b', b'c', b'd', b'e']
+        signatures = sk.sign_batch(messages)
+        with self.assertRaises(INVALID):
+            vk.verify_batch(b'b', signatures[0])
+        with self.assertRaises(INVALID):
+            vk.verify_batch(b'a', signatures[0][:4] + u32str(1) + signatures[0][8:])
+        with self.assertRaises(INVALID):
+            vk.verify_batch(b'a', u32str(4) + signatures[0][4:])
+        with self.assertRaises(INVALID):
+            vk.verify_batch(b'e', signatures[4][:8])
+        # the root signature is no signature of a message
+        with self.assertRaises(INVALID):
+            vk.verify(b'a', signatures[0][8+3*32:])
+        with self.assertRaises(FAILURE):
+            sk.sign_batch([])
+
+    def test_domain_separation(self):
+        # an ordinary signature of D_BATCH_ROOT || u32str(1) || leaf would be a batch signature
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, 1)
+        vk = sk.gen_pub()
+        crafted = batch._root_message(1, batch._leaf(vk.pub.H, vk.pub.m, vk.pub.I, 0, b'forged'))
+        for sign in (sk.sign, lambda message: sk.sign_many([message], 1)[0], lambda message: sk.sign_into(message, bytearray(sk.get_signature_length()))):
+            with self.assertRaises(FAILURE):
+                sign(crafted)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'message')
+            with open(filename, 'wb') as fout:
+                fout.write(crafted)
+            with self.assertRaises(FAILURE):
+                sk.sign(open(filename, 'rb'))
+        self.assertEqual(sk.get_avail_signatures(), 2**5)
+        for message in (io.BytesIO(b'abc'), io.TextIOWrapper(io.BytesIO(b'abc'))):  # e.g. sys.stdin
+            with self.assertRaises(FAILURE):
+                sk.sign(message)
+        # messages which merely contain the separator or a part of it are signed
+        vk.verify(b'x' + crafted, sk.sign(b'x' + crafted))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'message')
+            with open(filename, 'wb') as fout:
+                fout.write(crafted[:1])
+            vk.verify(crafted[:1], sk.sign(open(filename, 'rb')))
+        vk.verify(crafted[:1], sk.sign(crafted[:1]))
+
+
+class Test_VerifyOnly(unittest.TestCase):
+
+    def test_imports(self):
+        code = 'import sys, hsslms.verify; print(sorted(m for m in ("multiprocessing", "cryptography", "hsslms.pershss") if m in sys.modules))'
+        ret = subprocess.run([sys.executable, '-c', code], capture_output=True)
+        self.assertEqual(ret.stdout.strip(), b'[]')
+
+    def test_verify(self):
+        from hsslms.verify import verify
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, 1)
+        signature = sk.sign(b'abc')
+        self.assertTrue(verify(sk.gen_pub().get_pubkey(), b'abc', signature))
+        self.assertTrue(verify(sk.gen_pub(), b'abc', signature))
+        self.assertFalse(verify(sk.gen_pub().get_pubkey(), b'abd', signature))
+        self.assertFalse(verify(b'', b'abc', signature))
+
+
+class Test_NodeCache(unittest.TestCase):
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_lms(self):
+        sk = LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H10, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, 1)
+        signatures = [sk.sign(b'abc') for _ in range(4)]
+        vk, vk_cached = sk.gen_pub(), sk.gen_pub()
+        vk_cached.enable_cache()
+        vk_cached.verify(b'abc', signatures[0])
+        # the parent of the leafs 0 and 1 is cached
+        self.assertEqual(verify_hash_calls(vk, b'abc', signatures[1]) - verify_hash_calls(vk_cached, b'abc', signatures[1]), 10 - 1)
+        for signature in signatures:
+            vk_cached.verify(b'abc', signature)
+        with self.assertRaises(INVALID):
+            vk_cached.verify(b'abd', signatures[2])
+        l = len(signatures[3]) - 10*32
+        with self.assertRaises(INVALID):
+            vk_cached.verify(b'abc', signatures[3][:l] + bytes(32) + signatures[3][l+32:])
+
+    def test_max_nodes(self):
+        sk = LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, 1)
+        vk = sk.gen_pub()
+        vk.enable_cache(3)
+        vk.verify(b'abc', sk.sign(b'abc'))
+        self.assertEqual(sorted(vk.node_cache), [1, 2, 4])
+
+    def test_hss(self):
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*2, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, 1)
+        vk = sk.gen_pub()
+        vk.enable_cache(max_keys=1)
+        for _ in range(2**5 + 2):
+            vk.verify(b'abc', sk.sign(b'abc'))
+        self.assertEqual(len(vk.key_cache), 1)
+        with self.assertRaises(INVALID):
+            vk.verify(b'abd', sk.sign(b'abc'))
+
+
+class Test_SignInto(unittest.TestCase):
+
+    def test_lms(self):
+        sk = LMS_Priv(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W1, 1)
+        buffer = bytearray(3 + sk.get_signature_length())
+        self.assertEqual(sk.sign_into(b'abc', memoryview(buffer), 3), len(buffer) - 3)
+        sk.gen_pub().verify(b'abc', bytes(buffer[3:]))
+        self.assertEqual(len(sk.sign(b'abc')), sk.get_signature_length())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'message')
+            with open(filename, 'wb') as fout:
+                fout.write(b'abc')
+            with open(filename, 'rb') as fin:
+                sk.sign_into(fin, buffer, 3)
+        sk.gen_pub().verify(b'abc', bytes(buffer[3:]))
+
+    def test_hss(self):
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMS_ALGORITHM_TYPE.LMS_SHA256_M24_H5], [LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N24_W4], 1)
+        vk = sk.gen_pub()
+        length = sk.get_signature_length()
+        self.assertEqual(len(sk.sign(b'abc')), length)
+        buffer = bytearray(length)
+        # the cached prefix is renewed by the rollover
+        for _ in range(2**5):
+            self.assertEqual(sk.sign_into(b'abc', buffer), length)
+            vk.verify(b'abc', bytes(buffer))
+        avail = sk.get_avail_signatures()
+        with self.assertRaises(FAILURE):
+            sk.sign_into(b'abc', bytearray(length - 1))
+        self.assertEqual(sk.get_avail_signatures(), avail)
+
+
+class Test_Keyring(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        H5, W8 = LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8
+        cls.keys = [HSS_Priv([H5, H5], W8, 1) for _ in range(3)] + [HSS_Priv([H5], W8, 1), HSS_Priv([H5, H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1)]
+
+    def test_routing(self):
+        keyring = Keyring(cache=True)
+        for sk in self.keys:
+            keyring.add(sk.gen_pub().get_pubkey())
+        keyring.add(self.keys[0].gen_pub())
+        self.assertEqual(len(keyring), 5)
+        for sk in self.keys:
+            signature = sk.sign(b'abc')
+            self.assertEqual(keyring.verify(b'abc', signature).get_pubkey(), sk.gen_pub().get_pubkey())
+        # the level 1 tree of the signature has been learned
+        signature = self.keys[1].sign(b'abc')
+        self.assertIs(keyring.candidates(signature)[0], keyring.get(self.keys[1].gen_pub().pub.I))
+        self.assertEqual(len(keyring.candidates(self.keys[3].sign(b'abc'))), 1)
+        with self.assertRaises(INVALID):
+            keyring.verify(b'abd', signature)
+        # unknown LMOTS and LMS algorithm types of both levels
+        l = 8 + LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8.n*(LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8.p+1)
+        for offset in (8, 4+l, 4+l+4+32*5+56+4):
+            corrupted = signature[:offset] + u32str(99) + signature[offset+4:]
+            with self.assertRaises(INVALID):
+                keyring.verify(b'abc', corrupted)
+        with self.assertRaises(INVALID):
+            keyring.verify(b'abc', signature[:4+l+4+32*5+8])
+        vk = self.keys[1].gen_pub()
+        self.assertIs(keyring.verify(b'abc', signature, vk.pub.I), keyring.get(vk.pub.T1))
+        with self.assertRaises(INVALID):
+            keyring.verify(b'abc', signature, self.keys[2].gen_pub().pub.I)
+
+    def test_trials(self):
+        H5, W8 = LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8
+        keys = [HSS_Priv([H5], W8, 1) for _ in range(4)]
+        keyring = Keyring()
+        for sk in keys:
+            keyring.add(sk.gen_pub().get_pubkey())
+        for k, sk in enumerate(keys):
+            for _ in range(k):
+                sk.sign(b'abc')
+            keyring.verify(b'abc', sk.sign(b'abc'))
+        calls = []
+        verify = LMS_Pub.verify
+
+        def counting(pub, message, signature):
+            calls.append(pub)
+            return verify(pub, message, signature)
+
+        LMS_Pub.verify = counting
+        try:
+            # the key which has used the previous leaf is tried first
+            keyring.verify(b'abc', keys[2].sign(b'abc'))
+            self.assertEqual(len(calls), 1)
+            # a routed signature is verified once per level
+            del calls[:]
+            sk = self.keys[0]
+            keyring = Keyring()
+            for other in self.keys:
+                keyring.add(other.gen_pub().get_pubkey())
+            keyring.verify(b'abc', sk.sign(b'abc'))
+            del calls[:]
+            keyring.verify(b'abc', sk.sign(b'abc'))
+            self.assertEqual(len(calls), 2)
+        finally:
+            LMS_Pub.verify = verify
+        # a key whose leaf has signed another tree is not tried
+        signature = self.keys[1].sign(b'abc')
+        keyring = Keyring()
+        for other in self.keys[:3]:
+            keyring.add(other.gen_pub().get_pubkey())
+        keyring.leafs[self.keys[2].gen_pub().pub.I, int.from_bytes(signature[4:8], 'big')] = bytes(16)
+        self.assertEqual(len(keyring.candidates(signature)), 2)
+        keyring = Keyring(max_trials=1)
+        for sk in keys:
+            keyring.add(sk.gen_pub().get_pubkey())
+        self.assertEqual(len(keyring.candidates(keys[3].sign(b'abc'))), 1)
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for k, sk in enumerate(self.keys):
+                with open(os.path.join(tmpdir, 'key%d.pub' % k), 'wb') as fout:
+                    fout.write(sk.gen_pub().get_pubkey())
+            keyring = Keyring()
+            self.assertEqual(keyring.load_dir(tmpdir), 5)
+            bundle = os.path.join(tmpdir, 'bundle')
+            keyring.save_bundle(bundle)
+            keyring = Keyring()
+            self.assertEqual(keyring.load_bundle(bundle), 5)
+            keyring.verify(b'abc', self.keys[4].sign(b'abc'))
+            with open(bundle, 'ab') as fout:
+                fout.write(b'\x00'*3)
+            with self.assertRaises(FAILURE):
+                Keyring().load_bundle(bundle)
+
+
+class Test_ParallelVerify(unittest.TestCase):
+
+    def test(self):
+        H5 = LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5
+        sk = HSS_Priv([H5]*3, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, 1)
+        vk = sk.gen_pub()
+        signature = sk.sign(b'abc')
+        # without pool the levels are verified serially
+        vk.verify_parallel(b'abc', signature)
+        with self.assertRaises(INVALID):
+            vk.verify_parallel(b'abd', signature)
+        with Pool(2) as p:
+            vk.verify_parallel(b'abc', signature, p)
+            with self.assertRaises(INVALID):
+                vk.verify_parallel(b'abd', signature, p)
+            # a changed byte of the OTS signature of the top level
+            with self.assertRaises(INVALID):
+                vk.verify_parallel(b'abc', signature[:20] + bytes([signature[20] ^ 1]) + signature[21:], p)
+            with self.assertRaises(INVALID):
+                vk.verify_parallel(b'abc', u32str(1) + signature[4:], p)
+        sk = HSS_Priv([H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, 1)
+        sk.gen_pub().verify_parallel(b'abc', sk.sign(b'abc'))
+
+
+class Test_Bundle(unittest.TestCase):
+
+    def test(self):
+        H5 = LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5
+        sk = HSS_Priv([H5]*3, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W8, 1)
+        vk = sk.gen_pub()
+        messages = [b'%d' % i for i in range(40)]
+        signatures = [sk.sign(message) for message in messages]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'bundle')
+            with BundleWriter(filename) as writer:
+                for message, signature in zip(messages, signatures):
+                    writer.add(signature, message)
+            # one rollover of the lowest level
+            self.assertEqual(len(writer.segments), 2)
+            self.assertLess(os.path.getsize(filename), sum(map(len, signatures)) // 2)
+            with BundleReader(filename) as reader:
+                self.assertEqual(len(reader), 40)
+                self.assertEqual([reader[i] for i in range(40)], signatures)
+                self.assertEqual(reader.verify(vk, messages), [True]*40)
+                self.assertEqual(reader.verify(vk, lambda tag: bytes(tag)), [True]*40)
+                self.assertEqual(reader.verify(vk, messages[1:] + messages[:1]), [False]*40)
+            with open(filename, 'ab') as fout:
+                fout.write(b'\x01\x00')
+            with self.assertRaises(FAILURE):
+                BundleReader(filename)
+
+
+class Test_SignMany(unittest.TestCase):
+
+    def test_hss(self):
+        H5 = LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5
+        sk = HSS_Priv([H5, H5], LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1)
+        vk = sk.gen_pub()
+        sk.sign(b'abc')
+        messages = [b'%d' % i for i in range(40)]
+        # crosses the rollover of the lowest level
+        signatures = sk.sign_many(messages, 2)
+        for message, signature in zip(messages, signatures):
+            vk.verify(message, signature)
+        self.assertEqual(sk.get_avail_signatures(), 2**10 - 41)
+        self.assertEqual(sk.priv[-1].q, 9)
+        for message, signature in zip(messages, sk.sign_many(messages, 1)):
+            vk.verify(message, signature)
+        with self.assertRaises(FAILURE):
+            sk.sign_many([b'abc']*2**10)
+        self.assertEqual(sk.get_avail_signatures(), 2**10 - 81)
+
+    def test_persistent(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'key')
+            sk = PersHSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*2, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, filename, b'abc', 1, 1)
+            vk = sk.gen_pub()
+            signatures = sk.sign_many([b'abc']*5, 1)
+            self.assertEqual(PersHSS_Priv.from_file(filename, b'abc').get_avail_signatures(), 2**10 - 5)
+            with PersHSS_Priv.reserve(filename, b'abc', 3) as reservation:
+                signatures += reservation.sign_many([b'abc']*3, 1)
+                with self.assertRaises(FAILURE):
+                    reservation.sign_many([b'abc'])
+            for signature in signatures:
+                vk.verify(b'abc', signature)
+
+
+class Test_Advisor(unittest.TestCase):
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_hash_model(self):
+        lmstype, otstype = LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W2
+        instrumentation.enable()
+        sk = LMS_Priv(lmstype, otstype, 1)
+        self.assertEqual(instrumentation.get_stats().hash_calls, advisor.keygen_hashes(lmstype, otstype))
+        self.assertEqual(len(sk.sign(b'abc')), LMS_Priv._signature_length(lmstype, otstype))
+
+    def test_estimate(self):
+        profile = {'SHA256': {'chain': 1e-6, 'tree': 1e-6}, 'SHAKE': {'chain': 2e-6, 'tree': 2e-6}}
+        otstype = LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4
+        e = advisor.estimate([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H10]*2, otstype, profile, 1)
+        self.assertEqual(e['signatures'], 2**20)
+        sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*2, otstype, 1)
+        self.assertEqual(advisor.estimate([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*2, otstype, profile)['signature_size'], len(sk.sign(b'abc')))
+        self.assertAlmostEqual(e['keygen'], 2 * advisor.keygen_hashes(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H10, otstype) * 1e-6)
+        self.assertLess(e['rollover'], e['keygen'])
+        self.assertGreater(e['rollover'], 100 * e['sign'])
+        self.assertLess(advisor.estimate([LMS_ALGORITHM_TYPE.LMS_SHAKE_M32_H10]*2, LMOTS_ALGORITHM_TYPE.LMOTS_SHAKE_N32_W4, profile, 1)['rate'], e['rate'])
+
+    def test_advise(self):
+        profile = advisor.calibrate(0.01)
+        self.assertEqual(set(profile), {'SHA256', 'SHAKE'})
+        results = advisor.advise(2**20, 10, 1, profile, 1, max_keygen=3600, families=('SHA256_M32',), top=3)
+        self.assertEqual(len(results), 3)
+        for e in results:
+            self.assertGreaterEqual(e['signatures'], 2**20)
+            self.assertLessEqual(e['keygen'], 3600)
+            self.assertTrue(all('SHA256_M32' in t for t in e['lms']))
+        self.assertEqual([e['signature_size'] for e in results], sorted(e['signature_size'] for e in results))
+        self.assertEqual(advisor.advise(2**200, 1, 1, profile), [])
+
+
+class Test_VerificationCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sk = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*2, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1)
+        cls.signatures = [cls.sk.sign(b'abc') for _ in range(3)]
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_memory(self):
+        vk = self.sk.gen_pub()
+        cache = VerificationCache(max_entries=2)
+        vk.set_verification_cache(cache)
+        self.assertGreater(verify_hash_calls(vk, b'abc', self.signatures[0]), 0)
+        self.assertEqual(verify_hash_calls(vk, b'abc', self.signatures[0]), 0)
+        with self.assertRaises(INVALID):
+            vk.verify(b'abd', self.signatures[0])
+        with self.assertRaises(INVALID):
+            vk.verify(b'abd', self.signatures[0])
+        self.assertEqual(len(cache), 1)
+        vk.verify(b'abc', self.signatures[1])
+        vk.verify(b'abc', self.signatures[2])
+        self.assertEqual(len(cache), 2)
+        self.assertGreater(verify_hash_calls(vk, b'abc', self.signatures[0]), 0)
+        # the cache is shared, but the entries depend on the public key
+        vk2 = HSS_Priv([LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5]*2, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, 1).gen_pub()
+        vk2.set_verification_cache(cache)
+        with self.assertRaises(INVALID):
+            vk2.verify(b'abc', self.signatures[0])
+
+    def test_file(self):
+        vk = self.sk.gen_pub()
+        vk.set_verification_cache(VerificationCache())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'message')
+            with open(filename, 'wb') as fout:
+                fout.write(b'abc')
+            with open(filename, 'rb') as fin:
+                self.assertEqual(digest_message(fin)[0], digest_message(b'abc')[0])
+                self.assertEqual(fin.read(), b'abc')
+            vk.verify(open(filename, 'rb'), self.signatures[0])
+            with open(filename, 'rb') as fin:
+                self.assertEqual(verify_hash_calls(vk, fin, self.signatures[0]), 0)
+            with self.assertRaises(INVALID):
+                vk.verify(open(filename, 'rb'), self.signatures[0][:-1] + bytes([self.signatures[0][-1] ^ 1]))
+
+    def test_persistent(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'cache.db')
+            vk = self.sk.gen_pub()
+            with VerificationCache(filename, max_disk_entries=2) as cache:
+                vk.set_verification_cache(cache)
+                for signature in self.signatures:
+                    vk.verify(b'abc', signature)
+                self.assertEqual(len(cache), 2)
+            vk = HSS_Pub(vk.get_pubkey())
+            with VerificationCache(filename) as cache:
+                vk.set_verification_cache(cache)
+                self.assertEqual(verify_hash_calls(vk, b'abc', self.signatures[2]), 0)
+                self.assertGreater(verify_hash_calls(vk, b'abc', self.signatures[0]), 0)
+                cache.clear()
+                self.assertEqual(len(cache), 0)
+            from hsslms.verify import verify
+            with VerificationCache(filename) as cache:
+                self.assertTrue(verify(vk.get_pubkey(), b'abc', self.signatures[1], cache))
+            self.assertEqual(os.stat(filename + '.key').st_mode & 0o777, 0o600)
+            # entries written without the secret are not trusted
+            forged = self.signatures[0][:-1] + bytes([self.signatures[0][-1] ^ 1])
+            with VerificationCache(filename, secret=bytes(32)) as cache:
+                cache.add(cache.key(vk.get_pubkey(), digest_message(b'abc')[0], forged))
+            with VerificationCache(filename) as cache:
+                vk.set_verification_cache(cache)
+                with self.assertRaises(INVALID):
+                    vk.verify(b'abc', forged)
+
+
+class Test_DistKeyGen(unittest.TestCase):
+
+    def test_local(self):
+        coordinator = KeyGenCoordinator(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, b'abc', 4)
+        for result in run_local(coordinator.jobs(), b'abc', 2):
+            coordinator.add_result(result)
+        sk = coordinator.finish()
+        leafs = [LMS_Priv._calc_leafs(sk.H, sk.I, r, 5, sk.otstypecode, sk.SEED, sk.m) for r in range(2**5, 2**6)]
+        self.assertEqual(sk.T[2**5:], leafs)
+        sk.gen_pub().verify(b'abc', sk.sign(b'abc'))
+
+    def test_invalid_results(self):
+        coordinator = KeyGenCoordinator(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, b'abc', 2)
+        other = KeyGenCoordinator(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, b'abc', 2)
+        job = coordinator.jobs()[1]
+        with self.assertRaises(FAILURE):
+            run_job(job, b'abd')
+        with self.assertRaises(FAILURE):
+            coordinator.add_result(run_job(other.jobs()[1], b'abc'))
+        result = bytearray(run_job(job, b'abc'))
+        result[-1] ^= 1
+        with self.assertRaises(FAILURE):
+            coordinator.add_result(bytes(result))
+        with self.assertRaises(FAILURE):
+            coordinator.finish()
+        self.assertEqual(coordinator.missing(), [0, 1])
+        with self.assertRaises(FAILURE):
+            KeyGenCoordinator(LMS_ALGORITHM_TYPE.LMS_SHA256_M32_H5, LMOTS_ALGORITHM_TYPE.LMOTS_SHA256_N32_W4, b'abc', 3)
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -46,6 +46,7 @@ class Test_H5(unittest.TestCase):
         self.assertEqual(ret.returncode, 1, "H5: Signature Generation not failed.")
         os.remove('testkey')
         os.remove('testkey.pub')
+        os.remove('testkey.lock')
 
 class Test_H5H10(unittest.TestCase):
     def test(self):
@@ -57,6 +58,7 @@ class Test_H5H10(unittest.TestCase):
         self.assertEqual(ret.returncode, 0, "H5H10: Verification failed.")
         os.remove('testkey')
         os.remove('testkey.pub')
+        os.remove('testkey.lock')
         os.remove('test_signature')
 
 
@@ -70,8 +72,132 @@ class Test_H10H5(unittest.TestCase):
         self.assertEqual(ret.returncode, 0, "H10H5: Verification failed.")
         os.remove('testkey')
         os.remove('testkey.pub')
+        os.remove('testkey.lock')
+        os.remove('test_signature')
+
+
+class Test_Checkpoint(unittest.TestCase):
+    def test(self):
+        ret = subprocess.run(['hsslms', 'key-gen', '--lmots', 'LMOTS_SHA256_N32_W2', '--lms', 'LMS_SHA256_M32_H5', 'LMS_SHA256_M32_H5', '-o', 'testkey', '-p', 'abc', '--checkpoint', '--progress'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "Checkpoint: Key Generation failed.")
+        self.assertIn(b'level 0: 32/32 leafs (100.0%)', ret.stderr, "Checkpoint: No progress.")
+        self.assertIn(b'level 1: 32/32 leafs (100.0%)', ret.stderr, "Checkpoint: No progress.")
+        self.assertFalse(os.path.exists('testkey.ckpt'), "Checkpoint: Checkpoint not removed.")
+        ret = subprocess.run(['hsslms', 'sign', '-k', 'testkey', '-m', 'test_case_1_message.bin', '-s', 'test_signature', '-p', 'abc'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "Checkpoint: Signature Generation failed.")
+        ret = subprocess.run(['hsslms', 'verify', '-k', 'testkey.pub', '-m', 'test_case_1_message.bin', '-s', 'test_signature'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "Checkpoint: Verification failed.")
+        os.remove('testkey')
+        os.remove('testkey.pub')
+        os.remove('testkey.lock')
         os.remove('test_signature')
 
 
 if __name__ == '__main__':
     unittest.main()
+
+
+class Test_Split(unittest.TestCase):
+    def test(self):
+        ret = subprocess.run(['hsslms', 'key-gen', '--lmots', 'LMOTS_SHA256_N32_W2', '--lms', 'LMS_SHA256_M32_H5', '-o', 'testkey', '-p', 'abc'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "Split: Key Generation failed.")
+        ret = subprocess.run(['hsslms', 'split', '-k', 'testkey', '-n', '2', '-p', 'abc'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "Split: Split failed.")
+        for shard in ('testkey.shard0', 'testkey.shard1'):
+            ret = subprocess.run(['hsslms', 'sign', '-k', shard, '-m', 'test_case_1_message.bin', '-s', 'test_signature', '-p', 'abc'], capture_output=True)
+            self.assertEqual(ret.returncode, 0, "Split: Signature Generation failed.")
+            ret = subprocess.run(['hsslms', 'verify', '-k', 'testkey.pub', '-m', 'test_case_1_message.bin', '-s', 'test_signature'], capture_output=True)
+            self.assertEqual(ret.returncode, 0, "Split: Verification failed.")
+            os.remove('test_signature')
+        ret = subprocess.run(['hsslms', 'split', '-k', 'testkey', '-n', '2', '-p', 'abc'], capture_output=True)
+        self.assertEqual(ret.returncode, 1, "Split: Existing shards overwritten.")
+        ret = subprocess.run(['hsslms', 'sign', '-k', 'testkey', '-m', 'test_case_1_message.bin', '-s', 'test_signature', '-p', 'abc'], capture_output=True)
+        self.assertEqual(ret.returncode, 1, "Split: Signature Generation with split key not failed.")
+        os.remove('testkey')
+        os.remove('testkey.pub')
+        os.remove('testkey.lock')
+        os.remove('testkey.shard0')
+        os.remove('testkey.shard1')
+        os.remove('testkey.shard0.lock')
+        os.remove('testkey.shard1.lock')
+
+
+class Test_ParallelSign(unittest.TestCase):
+    def test(self):
+        ret = subprocess.run(['hsslms', 'key-gen', '--lmots', 'LMOTS_SHA256_N32_W2', '--lms', 'LMS_SHA256_M32_H5', '-o', 'testkey', '-p', 'abc'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "ParallelSign: Key Generation failed.")
+        procs = [subprocess.Popen(['hsslms', 'sign', '-k', 'testkey', '-m', 'test_case_1_message.bin', '-s', 'test_signature%d' % k, '-p', 'abc'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for k in range(6)]
+        for proc in procs:
+            self.assertEqual(proc.wait(), 0, "ParallelSign: Signature Generation failed.")
+        leafs = set()
+        for k in range(6):
+            ret = subprocess.run(['hsslms', 'verify', '-k', 'testkey.pub', '-m', 'test_case_1_message.bin', '-s', 'test_signature%d' % k], capture_output=True)
+            self.assertEqual(ret.returncode, 0, "ParallelSign: Verification failed.")
+            with open('test_signature%d' % k, 'rb') as fin:
+                leafs.add(fin.read()[4:8])
+            os.remove('test_signature%d' % k)
+        self.assertEqual(len(leafs), 6, "ParallelSign: Leaf used twice.")
+        os.remove('testkey')
+        os.remove('testkey.pub')
+        os.remove('testkey.lock')
+
+
+class Test_PerLevelOTS(unittest.TestCase):
+    def test(self):
+        ret = subprocess.run(['hsslms', 'key-gen', '--lmots', 'LMOTS_SHA256_N32_W8', 'LMOTS_SHA256_N32_W2', '--lms', 'LMS_SHA256_M32_H5', 'LMS_SHA256_M32_H5', '-o', 'testkey', '-p', 'abc'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "PerLevelOTS: Key Generation failed.")
+        ret = subprocess.run(['hsslms', 'sign', '-k', 'testkey', '-m', 'test_case_1_message.bin', '-s', 'test_signature', '-p', 'abc'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "PerLevelOTS: Signature Generation failed.")
+        ret = subprocess.run(['hsslms', 'verify', '-k', 'testkey.pub', '-m', 'test_case_1_message.bin', '-s', 'test_signature'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "PerLevelOTS: Verification failed.")
+        os.remove('testkey')
+        os.remove('testkey.pub')
+        os.remove('testkey.lock')
+        os.remove('test_signature')
+        ret = subprocess.run(['hsslms', 'key-gen', '--lmots', 'LMOTS_SHA256_N32_W8', 'LMOTS_SHA256_N32_W2', '--lms', 'LMS_SHA256_M32_H5', '-o', 'testkey', '-p', 'abc'], capture_output=True)
+        self.assertEqual(ret.returncode, 1, "PerLevelOTS: Key Generation not failed.")
+
+
+class Test_ParameterSets(unittest.TestCase):
+    def test(self):
+        for lmots, lms in (('LMOTS_SHA256_N24_W4', 'LMS_SHA256_M24_H5'), ('LMOTS_SHAKE_N32_W4', 'LMS_SHAKE_M32_H5'), ('LMOTS_SHAKE_N24_W4', 'LMS_SHAKE_M24_H5')):
+            ret = subprocess.run(['hsslms', 'key-gen', '--lmots', lmots, '--lms', lms, lms, '-o', 'testkey', '-p', 'abc'], capture_output=True)
+            self.assertEqual(ret.returncode, 0, "%s: Key Generation failed." % lms)
+            ret = subprocess.run(['hsslms', 'sign', '-k', 'testkey', '-m', 'test_case_1_message.bin', '-s', 'test_signature', '-p', 'abc'], capture_output=True)
+            self.assertEqual(ret.returncode, 0, "%s: Signature Generation failed." % lms)
+            ret = subprocess.run(['hsslms', 'verify', '-k', 'testkey.pub', '-m', 'test_case_1_message.bin', '-s', 'test_signature'], capture_output=True)
+            self.assertEqual(ret.returncode, 0, "%s: Verification failed." % lms)
+            os.remove('testkey')
+            os.remove('testkey.pub')
+            os.remove('testkey.lock')
+            os.remove('test_signature')
+
+
+class Test_Advise(unittest.TestCase):
+    def test(self):
+        ret = subprocess.run(['hsslms', 'advise', '-n', '1048576', '-r', '10', '-l', '1', '--family', 'SHA256_M32', '--calibration-time', '0.01'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "Advise failed.")
+        self.assertIn(b'--lms LMS_SHA256_M32_', ret.stdout)
+        ret = subprocess.run(['hsslms', 'advise', '-n', '1e60', '--calibration-time', '0.01'], capture_output=True)
+        self.assertEqual(ret.returncode, 1, "Advise not failed.")
+        ret = subprocess.run(['hsslms', 'advise', '-n', '1e60', '--levels', '5'], capture_output=True)
+        self.assertEqual(ret.returncode, 2, "Advise accepted too many levels.")
+
+
+class Test_VerifyCache(unittest.TestCase):
+    def test(self):
+        ret = subprocess.run(['hsslms', 'key-gen', '--lmots', 'LMOTS_SHA256_N32_W8', '--lms', 'LMS_SHA256_M32_H5', '-o', 'testkey', '-p', 'abc'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "VerifyCache: Key Generation failed.")
+        ret = subprocess.run(['hsslms', 'sign', '-k', 'testkey', '-m', 'test_case_1_message.bin', '-s', 'test_signature', '-p', 'abc'], capture_output=True)
+        self.assertEqual(ret.returncode, 0, "VerifyCache: Signature Generation failed.")
+        for _ in range(2):
+            ret = subprocess.run(['hsslms', 'verify', '-k', 'testkey.pub', '-m', 'test_case_1_message.bin', '-s', 'test_signature', '--cache', 'test_cache.db'], capture_output=True)
+            self.assertEqual(ret.returncode, 0, "VerifyCache: Verification failed.")
+        ret = subprocess.run(['hsslms', 'verify', '-k', 'testkey.pub', '-m', 'test_case_2_message.bin', '-s', 'test_signature', '--cache', 'test_cache.db'], capture_output=True)
+        self.assertEqual(ret.returncode, 1, "VerifyCache: Verification not failed.")
+        os.remove('testkey')
+        os.remove('testkey.pub')
+        os.remove('testkey.lock')
+        os.remove('test_signature')
+        os.remove('test_cache.db')
+        os.remove('test_cache.db.key')